@@ -2,9 +2,19 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import json
-import joblib
+import copy
+import os
+import uuid
+from functools import partial
 
-from detector import prepare_data, calculate_abuse_scores, get_blocklist
+from detector import prepare_data, calculate_abuse_scores, get_blocklist, RuleHitMatrix, detection_signature, prepare_signature, assemble_scored, lean_memory_from, load_detection_models, MODEL_FILES
+from ingest import read_events
+from jobs import JobManager
+from result_cache import ResultCache, cache_key, hash_bytes, hash_file
+from sweep import sweep_scored
+from ip_ranges import IPRangeIndex
+from profiling import collect_profile, profile_stage
+from report import device_report, export_file, media_report, reason_columns
 
 st.set_page_config(
     layout="wide",
@@ -31,7 +41,7 @@ st.markdown("---")
 
 # --- 기본 설정값, 한글 번역, 설명 (이전과 동일) ---
 DEFAULT_CONFIG = {
-    'burst_attack': {'threshold_clicks': 15, 'score': 15, 'window_min': 5}, 
+    'burst_attack': {'threshold_clicks': 15, 'score': 15, 'window_min': 5, 'windows_min': [1, 5, 60]}, 
     'media_concentration': {'threshold_clicks': 20, 'threshold_mda': 2, 'score': 20}, 
     'abnormal_cvr': {'threshold_cvr': 0.90, 'threshold_clicks': 20, 'score': 45}, 
     'short_ctit': {'threshold_sec': 5, 'score': 15}, 
@@ -43,12 +53,16 @@ DEFAULT_CONFIG = {
     'many_devices_per_ip': {'threshold_devices': 6, 'score': 25, 'carrier_ip_threshold': 10000}, 
     'many_ips_per_device': {'threshold_ips': 15, 'score': 25}, 
     'aws_ip': {'score': 25},
+    'cardinality_sketch': {'enabled': False, 'relative_error': 0.02},
+    'ads_join': {'legacy_inflation': False, 'keep': 'first'},
+    'lean_memory': {'enabled': False},
     # 추가 규칙들
     'fraud_long_ctit': {'threshold_sec': 3600, 'score': 35},
     'suspicious_single_conv': {'score': 30},
     'ctit_anomaly_model': {'score': 35},
     'combo_stealth_bot': {'score': 30},
     'combo_focused_fraud': {'score': 35},
+    'fraud_ring': {'threshold_devices': 5, 'threshold_ips': 3, 'threshold_density': 0.5, 'max_ip_devices': 1000, 'score': 30},
     'blocklist_method': 'percentile', 
     'blocklist_percentile': 0.95, 
     'absolute_score_threshold': 100
@@ -62,7 +76,7 @@ KOREAN_NAMES = {
     'many_ips_per_device': '하나의 기기당 다수의 IP', 'aws_ip': '서버 IP 사용 (AWS)', 
     'fraud_long_ctit': '비정상적으로 긴 CTIT', 'suspicious_single_conv': '의심스러운 단일 전환', 
     'ctit_anomaly_model': 'CTIT 패턴 모델', 'combo_stealth_bot': '콤보: 은신 봇', 
-    'combo_focused_fraud': '콤보: 집중형 사기'
+    'combo_focused_fraud': '콤보: 집중형 사기', 'fraud_ring': '조직형 기기-IP 링'
 }
 RULE_DESCRIPTIONS = {
     'burst_attack': "단시간(예: 5분) 내에 비정상적으로 많은 클릭을 발생시키는 패턴입니다. 주로 단기 보상을 노리는 어뷰저들이 사용합니다.", 
@@ -82,28 +96,171 @@ RULE_DESCRIPTIONS = {
     'suspicious_single_conv': "클릭 수가 1개이면서 심야 시간대에 발생하는 의심스러운 단일 전환을 탐지합니다.",
     'ctit_anomaly_model': "CTIT 패턴을 기반으로 한 머신러닝 모델을 통해 이상 패턴을 탐지합니다.",
     'combo_stealth_bot': "AWS IP 사용과 심야 활동이 결합된 은신 봇 패턴을 탐지합니다.",
-    'combo_focused_fraud': "매체 집중과 다수 IP 사용이 결합된 집중형 사기 패턴을 탐지합니다."
+    'combo_focused_fraud': "매체 집중과 다수 IP 사용이 결합된 집중형 사기 패턴을 탐지합니다.",
+    'fraud_ring': "여러 기기가 같은 IP 묶음을 돌려 쓰며 서로 촘촘히 연결된 무리(링)를 탐지합니다. IP 하나만 보는 규칙으로는 드러나지 않는 조직형 어뷰징을 기기-IP 연결 관계 전체에서 찾아냅니다."
 }
 
 # --- 모델 로딩 함수 (캐시 사용) ---
 @st.cache_resource
 def load_models():
-    models = {}
-    try: models['anomaly_model'] = joblib.load('isolation_forest_model.joblib')
-    except FileNotFoundError: models['anomaly_model'] = None
-    try: models['ctit_anomaly_model'] = joblib.load('ctit_anomaly_model.joblib')
-    except FileNotFoundError: models['ctit_anomaly_model'] = None
-    return models
+    # 프로세스 공용으로 한 번만 로딩하며, 같은 디바이스 피쳐의 예측 점수는 세션/재실행 간에 재사용됩니다.
+    return load_detection_models()
 
 models = load_models()
 
+@st.cache_resource
+def model_fingerprint():
+    """모델 파일 내용 해시 (모델이 바뀌면 채점 결과 캐시도 바뀌도록 캐시 키에 넣습니다)."""
+    return {name: hash_file(path) if os.path.exists(path) else None for name, path in MODEL_FILES.items()}
+
+# --- 결과 캐시 (세션 공용, 디스크) ---
+# 업로드 파일 내용 해시 + 컬럼 매핑 + 관련 설정으로 키를 만들어, 같은 파일을 다시 분석하면 디스크에서 바로 읽습니다.
+CACHE_DIR = os.environ.get('ABUSE_CACHE_DIR', os.path.join('.cache', 'analysis'))
+CACHE_MAX_BYTES = 2 * 2**30
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+result_cache = get_result_cache()
+
+def _analysis_summary(df_original):
+    """결과 화면에 쓰는 디바이스별 로그 수와 분석 기간."""
+    # 날짜 계산 (나중에 사용)
+    if 'done_date' in df_original.columns and df_original['done_date'].notna().any():
+        min_date = pd.to_datetime(df_original['done_date'].dropna()).min()
+        max_date = pd.to_datetime(df_original['done_date'].dropna()).max()
+        date_standard = "전환 완료 시점 기준"
+    else:
+        min_date = df_original['click_date'].min()
+        max_date = df_original['click_date'].max()
+        date_standard = "클릭 시점 기준"
+    return {'logs_per_device': df_original['dvc_idx'].value_counts(), 'min_date': min_date, 'max_date': max_date, 'date_standard': date_standard}
+
+def _cached_summary(entry):
+    return {
+        'logs_per_device': entry['logs_per_device'], 'date_standard': entry['date_standard'],
+        'min_date': pd.Timestamp(entry['min_date']), 'max_date': pd.Timestamp(entry['max_date']),
+    }
+
+# --- 백그라운드 분석 작업 ---
+# 모든 세션이 워커 하나를 함께 쓰며, 세션마다 작업은 하나씩 제출 순서대로 처리됩니다.
+JOB_WORKERS = 1
+ANALYSIS_STAGES = {'prepare': '데이터 준비', 'score_conversion': '전환 로그 채점', 'score_click': '클릭 로그 채점', 'blocklist': '결과 정리 및 제재 리스트'}
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager(max_workers=JOB_WORKERS)
+
+job_manager = get_job_manager()
+if 'session_owner' not in st.session_state:
+    st.session_state.session_owner = uuid.uuid4().hex
+
+def _config_key(config):
+    """제재 리스트가 어떤 설정으로 계산됐는지 비교하는 키 (점수 슬라이더/민감도까지 포함)."""
+    return json.dumps(config, sort_keys=True, default=str)
+
+def run_analysis_job(job, df_rwd, df_list, ip_cache, ip_ranges, mapping, config, models, analysis_key, upload_hashes=None, model_hashes=None):
+    """
+    워커 스레드에서 전체 탐지 파이프라인을 실행합니다 (여기서는 st.* 를 호출하지 않습니다).
+    upload_hashes가 있으면 전처리 결과와 채점 결과를 결과 캐시에서 찾고, 없으면 계산한 뒤 저장합니다.
+    model_hashes는 스크립트 스레드에서 구한 model_fingerprint() 값입니다 (st.cache_resource라 워커에서 부르지 않습니다).
+    """
+    cache = result_cache if upload_hashes else None
+    prepared_key = cache_key('prepared', upload_hashes, mapping, prepare_signature(config))
+    scored_key = cache_key('scored', prepared_key, detection_signature(config), model_hashes)
+    with collect_profile() as profile:
+        job.start_stage('prepare')
+        with profile_stage('cache:lookup'):
+            scored = cache.get(scored_key) if cache else None
+        if scored is not None:
+            all_scored_df, summary = scored['all_scored_df'], _cached_summary(scored)
+        else:
+            with profile_stage('cache:lookup'):
+                prepared = cache.get(prepared_key) if cache else None
+            if prepared is not None:
+                df_original = None
+                df_complete, df_incomplete = prepared['df_complete'], prepared['df_incomplete']
+                clicks_per_mda, cvr_per_mda = prepared['clicks_per_mda'], prepared['cvr_per_mda']
+                summary = _cached_summary(prepared)
+            else:
+                # 얕은 복사: 전처리는 컬럼을 새로 붙이거나 바꿔 끼울 뿐 기존 배열을 고치지 않으므로 세션의 원본 로그는 그대로입니다.
+                ads_rwd_info = df_rwd.copy(deep=False)
+                ads_list = df_list.copy()
+                ads_rwd_info.rename(columns={mapping['dvc_idx']: 'dvc_idx', mapping['user_ip']: 'user_ip'}, inplace=True)
+                ads_list.rename(columns={mapping['ads_idx_list']: 'ads_idx'}, inplace=True)
+                df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(ads_rwd_info, ads_list, ip_cache, config, ip_ranges)
+                if df_original.empty:
+                    raise ValueError("분석할 데이터가 없습니다.")
+                summary = _analysis_summary(df_original)
+                del ads_rwd_info
+                if not lean_memory_from(config):
+                    df_original = None
+                if cache:
+                    with profile_stage('cache:store'):
+                        cache.put(prepared_key, {'df_complete': df_complete, 'df_incomplete': df_incomplete, 'clicks_per_mda': clicks_per_mda, 'cvr_per_mda': cvr_per_mda, **summary})
+
+            job.start_stage('score_conversion')
+            complete_scored = calculate_abuse_scores(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=models['anomaly_model'], ctit_anomaly_model=models['ctit_anomaly_model'], config=config)
+            job.start_stage('score_click')
+            incomplete_scored = calculate_abuse_scores(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=models['anomaly_model'], ctit_anomaly_model=models['ctit_anomaly_model'], config=config)
+            del df_complete, df_incomplete
+            all_scored_df = assemble_scored([complete_scored, incomplete_scored], df_original)
+            del complete_scored, incomplete_scored, df_original
+            if cache:
+                with profile_stage('cache:store'):
+                    cache.put(scored_key, {'all_scored_df': all_scored_df, **summary})
+
+        job.start_stage('blocklist')
+        hit_matrix = RuleHitMatrix(all_scored_df['rule_conditions'])
+        if scored is not None:
+            # 채점 캐시는 점수 설정을 키에 넣지 않으므로, 캐시된 점수를 이번 설정으로 다시 매긴 뒤 제재 리스트를 만듭니다.
+            all_scored_df['abuse_score'], all_scored_df['rule_hits'] = hit_matrix.rescore(config)
+        blocklist = get_blocklist(all_scored_df, "통합 분석", config)
+
+    return {
+        'key': analysis_key, 'all_scored_df': all_scored_df, 'hit_matrix': hit_matrix, 'profile': profile, 'from_cache': scored is not None,
+        'blocklist': blocklist, 'blocklist_config': _config_key(config), **summary,
+    }
+
+@st.fragment(run_every=1.0)
+def show_job_progress(job):
+    """작업 진행 상황을 주기적으로 갱신합니다. 끝나면 전체 화면을 다시 그려 결과를 표시합니다."""
+    if job.done:
+        st.rerun()
+    if job.status == 'queued':
+        st.info(f"⏳ 다른 분석이 끝나기를 기다리는 중입니다 (앞에 {job_manager.queue_position(job)}개 작업).")
+    else:
+        stage_name = ANALYSIS_STAGES.get(job.stage, '시작 중')
+        st.progress(job.progress, text=f"🔄 {stage_name} ({job.completed_stages + 1}/{len(job.stages)}단계, {job.elapsed:.0f}초 경과)")
+    if job.cancel_requested:
+        st.caption("취소 요청됨 — 현재 단계가 끝나면 멈춥니다.")
+    elif st.button("⏹️ 분석 취소", key=f"cancel_{job.id}"):
+        job.cancel()
+        st.rerun()
+
+# 요약 리포트 표에 그릴 최대 행 수
+REPORT_PREVIEW_ROWS = 1000
+
+def export_buttons(df, file_stem, label, primary=False):
+    """
+    CSV/Parquet 다운로드 버튼. 파일은 버튼을 누를 때만 청크 단위로 만들어 bytes로 넘기므로 (callable data, streamlit>=1.52),
+    리런마다 결과 전체를 인코딩하거나 캐시에 사본을 들고 있지 않습니다.
+    """
+    col_csv, col_parquet = st.columns(2)
+    with col_csv:
+        st.download_button(f"{label} (CSV)", partial(export_file, df, 'csv'), f"{file_stem}.csv", "text/csv", key=f"{file_stem}_csv", type="primary" if primary else "secondary")
+    with col_parquet:
+        st.download_button(f"{label} (Parquet)", partial(export_file, df, 'parquet'), f"{file_stem}.parquet", "application/vnd.apache.parquet", key=f"{file_stem}_parquet")
+
 # --- 사이드바 UI 구성 ---
 st.sidebar.title("⚙️ 탐지 설정")
 with st.sidebar.expander("📂 파일 업로드", expanded=True):
-    st.info("분석에 필요한 세 개의 파일을 모두 업로드하세요.")
-    uploaded_file_rwd = st.file_uploader("1. 원본 로그 (광고참여정보 등)", type=['csv'])
+    st.info("원본 로그와 광고 정보 파일은 필수이며, IP 정보 파일들은 선택입니다.")
+    uploaded_file_rwd = st.file_uploader("1. 원본 로그 (광고참여정보 등, CSV/Parquet/Arrow)", type=['csv', 'parquet', 'arrow', 'feather'])
     uploaded_file_list = st.file_uploader("2. 광고 정보 (광고 리스트 등)", type=['csv'])
-    uploaded_file_ip_cache = st.file_uploader("3. IP 정보 (IP 별 AWS 탐지 파일 등)", type=['json'])
+    uploaded_file_ip_cache = st.file_uploader("3. IP 정보 (선택: IP 별 호스트명 캐시 파일 등)", type=['json'])
+    uploaded_file_ip_ranges = st.file_uploader("4. 클라우드 IP 대역 (선택: CIDR 프리픽스 JSON, 예: AWS ip-ranges.json)", type=['json'])
 
 sensitivity = st.sidebar.radio("탐지 민감도 프리셋", ('평균', '엄격', '완화'))
 with st.sidebar.expander("세부 점수 조정하기 (고급)"):
@@ -113,15 +270,45 @@ with st.sidebar.expander("세부 점수 조정하기 (고급)"):
             korean_name = KOREAN_NAMES.get(rule, rule)
             description = RULE_DESCRIPTIONS.get(rule, "설명이 없습니다.")
             config[rule]['score'] = st.slider(f"'{korean_name}' 규칙 점수", 0, 100, params['score'], key=f"score_{rule}", help=description)
+with st.sidebar.expander("🗄️ 결과 캐시"):
+    st.caption(f"같은 파일·컬럼·설정의 분석 결과를 디스크에 저장해 세션 간에 재사용합니다. 현재 {result_cache.size_bytes / 2**20:,.1f} MB / {CACHE_MAX_BYTES / 2**30:.0f} GB")
+    if st.button("캐시 비우기"):
+        result_cache.clear()
+with st.sidebar.expander("대용량 근사 집계 (고급)"):
+    config['cardinality_sketch'] = {
+        'enabled': st.checkbox("IP·기기·매체 고유 수를 근사 집계(HyperLogLog)로 계산", value=False, help="통신사 NAT IP처럼 기기가 매우 많은 IP가 있을 때 메모리를 줄입니다. 결과가 정확 집계와 조금 다를 수 있습니다."),
+        'relative_error': st.select_slider("허용 상대오차", options=[0.01, 0.02, 0.05], value=DEFAULT_CONFIG['cardinality_sketch']['relative_error']),
+    }
+    config['lean_memory'] = {
+        'enabled': st.checkbox("메모리 절약 모드", value=False, help="로그를 복사하지 않고 한 프레임에서 분석하며 보조 컬럼을 작은 자료형으로 보관합니다. 제재 결과는 같고, 결과 표의 행 순서와 일부 보조 컬럼 정밀도(float32)만 다릅니다."),
+    }
+with st.sidebar.expander("광고 정보 병합 (고급)"):
+    config['ads_join'] = {
+        'legacy_inflation': st.checkbox("원본 방식 병합 (ads_list 중복만큼 로그 행 증가)", value=False, help="이전 분석 결과와 같은 수치를 재현할 때만 사용하세요. 끄면 중복 ads_idx는 첫 행의 광고 정보를 씁니다."),
+        'keep': 'first',
+    }
 
 # --- 메인 로직 시작 ---
-if all([uploaded_file_rwd, uploaded_file_list, uploaded_file_ip_cache]):
-    try:
-        st.session_state.df_rwd = pd.read_csv(uploaded_file_rwd)
-        st.session_state.df_list = pd.read_csv(uploaded_file_list)
-        st.session_state.ip_cache = json.load(uploaded_file_ip_cache)
-    except Exception as e:
-        st.error(f"❌ 파일을 읽는 중 오류가 발생했습니다: {e}"); st.stop()
+if all([uploaded_file_rwd, uploaded_file_list]):
+    # 업로드가 바뀐 경우에만 읽습니다. 로그 파싱 결과는 내용 해시로 캐시해 같은 파일이면 어느 세션에서든 Parquet로 바로 읽습니다.
+    upload_key = tuple(f.file_id if f else None for f in (uploaded_file_rwd, uploaded_file_list, uploaded_file_ip_cache, uploaded_file_ip_ranges))
+    if st.session_state.get('upload_key') != upload_key:
+        try:
+            upload_hashes = [hash_bytes(f.getvalue()) if f else None for f in (uploaded_file_rwd, uploaded_file_list, uploaded_file_ip_cache, uploaded_file_ip_ranges)]
+            events_key = cache_key('events', upload_hashes[0])
+            cached_events = result_cache.get(events_key)
+            if cached_events is None:
+                st.session_state.df_rwd = read_events(uploaded_file_rwd)
+                result_cache.put(events_key, {'events': st.session_state.df_rwd})
+            else:
+                st.session_state.df_rwd = cached_events['events']
+            st.session_state.df_list = pd.read_csv(uploaded_file_list)
+            st.session_state.ip_cache = json.load(uploaded_file_ip_cache) if uploaded_file_ip_cache else None
+            st.session_state.ip_ranges = IPRangeIndex.from_json(json.load(uploaded_file_ip_ranges)) if uploaded_file_ip_ranges else None
+            st.session_state.upload_hashes = upload_hashes
+            st.session_state.upload_key = upload_key
+        except Exception as e:
+            st.error(f"❌ 파일을 읽는 중 오류가 발생했습니다: {e}"); st.stop()
 
     st.header("STEP 1: 핵심 컬럼 확인하기")
     # ... (이하 컬럼 매핑 부분은 변경 없음, 생략)
@@ -141,207 +328,220 @@ if 'mapping' in st.session_state:
     st.markdown("---")
     st.header("STEP 2: 어뷰징 분석 실행하기")
     
-    if st.button("🚀 어뷰징 분석 시작하기", type="primary"):
-        with st.spinner('데이터를 분석중입니다...'):
-            ads_rwd_info = st.session_state.df_rwd.copy()
-            ads_list = st.session_state.df_list.copy()
-            mapping = st.session_state.mapping
-            ads_rwd_info.rename(columns={mapping['dvc_idx']: 'dvc_idx', mapping['user_ip']: 'user_ip'}, inplace=True)
-            ads_list.rename(columns={mapping['ads_idx_list']: 'ads_idx'}, inplace=True)
-            
-            if sensitivity == '엄격': config['blocklist_percentile'] = 0.97
-            elif sensitivity == '완화': config['blocklist_percentile'] = 0.85
-            
-            df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(
-                ads_rwd_info, ads_list, st.session_state.ip_cache, config
-            )
-            if df_original.empty: st.error("분석할 데이터가 없습니다."); st.stop()
-            
-            complete_scored = calculate_abuse_scores(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=models['anomaly_model'], ctit_anomaly_model=models['ctit_anomaly_model'], config=config)
-            incomplete_scored = calculate_abuse_scores(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=models['anomaly_model'], ctit_anomaly_model=models['ctit_anomaly_model'], config=config)
-            all_scored_df = pd.concat([complete_scored, incomplete_scored], ignore_index=True)
-            final_block_list, device_scores = get_blocklist(all_scored_df, "통합 분석")
-            
-            # threshold 계산
-            if not device_scores.empty:
-                if config.get('blocklist_method', 'percentile') == 'percentile':
-                    threshold = device_scores.quantile(config.get('blocklist_percentile', 0.95))
-                else:
-                    threshold = config.get('absolute_score_threshold', 100)
+    if sensitivity == '엄격': config['blocklist_percentile'] = 0.97
+    elif sensitivity == '완화': config['blocklist_percentile'] = 0.85
+
+    # 업로드 파일, 컬럼 매핑, 임계값 설정이 같으면 규칙 적중 행렬을 재사용할 수 있습니다.
+    analysis_key = (st.session_state.upload_key, json.dumps(st.session_state.mapping, sort_keys=True), detection_signature(config))
+    if 'analysis' in st.session_state and st.session_state.analysis['key'] != analysis_key:
+        del st.session_state.analysis
+
+    # 업로드 조합/설정이 바뀌어 결과가 버려질 작업은 미리 취소합니다.
+    job = st.session_state.get('analysis_job')
+    if job is not None and st.session_state.analysis_job_key != analysis_key:
+        job.cancel()
+    if job is not None and job.done:
+        del st.session_state.analysis_job
+        if job.status == 'done' and job.result['key'] == analysis_key:
+            st.session_state.analysis = job.result
+        elif job.status == 'failed':
+            st.error(f"❌ 분석 중 오류가 발생했습니다: {job.error.splitlines()[0]}")
+            with st.expander("오류 상세"): st.code(job.error)
+        elif job.status == 'cancelled':
+            st.warning("분석이 취소되었습니다.")
+        job = None
+
+    if st.button("🚀 어뷰징 분석 시작하기", type="primary", disabled=job is not None) and 'analysis' not in st.session_state:
+        job = job_manager.submit(
+            st.session_state.session_owner, run_analysis_job,
+            st.session_state.df_rwd, st.session_state.df_list, st.session_state.get('ip_cache'), st.session_state.get('ip_ranges'),
+            st.session_state.mapping, copy.deepcopy(config), models, analysis_key=analysis_key,
+            upload_hashes=st.session_state.get('upload_hashes'), model_hashes=model_fingerprint(), stages=ANALYSIS_STAGES,
+        )
+        st.session_state.analysis_job, st.session_state.analysis_job_key = job, analysis_key
+
+    if job is not None:
+        show_job_progress(job)
+
+    analysis = st.session_state.get('analysis')
+    if analysis is not None:
+        # 작업이 계산한 제재 리스트를 그대로 쓰고, 점수 슬라이더 등 설정이 바뀐 경우에만
+        # 전체 파이프라인 대신 캐시된 규칙 적중 행렬로 즉시 재채점해 다시 만듭니다.
+        all_scored_df = analysis['all_scored_df']
+        if analysis['blocklist_config'] != _config_key(config):
+            all_scored_df['abuse_score'], all_scored_df['rule_hits'] = analysis['hit_matrix'].rescore(config)
+            analysis['blocklist'] = get_blocklist(all_scored_df, "통합 분석", config)
+            analysis['blocklist_config'] = _config_key(config)
+        final_block_list, device_scores, threshold = analysis['blocklist']
+        if threshold is None:
+            threshold = 0
+        
+        st.success("✅ 분석이 완료되었습니다!" + (" (캐시된 결과)" if analysis.get('from_cache') else ""))
+
+        with st.expander("⏱️ 성능 프로파일"):
+            profile_df = analysis['profile'].to_frame()
+            if profile_df.empty:
+                st.info("기록된 성능 정보가 없습니다.")
             else:
-                threshold = 0
-            
-            st.success("✅ 분석이 완료되었습니다!")
+                st.caption("단계·규칙·모델별 실행 시간, 입력/출력(적중) 행 수, 메모리(RSS) 변화량과 단계 중 최대 RSS입니다. 상위 단계는 하위 단계 시간을 포함합니다.")
+                profile_df = profile_df.rename(columns={'calls': '호출 수', 'seconds': '시간(초)', 'rows_in': '입력 행', 'rows_out': '출력 행', 'memory_delta_mb': '메모리 변화(MB)', 'peak_rss_mb': '최대 RSS(MB)', 'rows_per_sec': '처리량(행/초)'})
+                st.bar_chart(profile_df['시간(초)'].sort_values(ascending=False).head(15))
+                st.dataframe(profile_df.style.format({'시간(초)': '{:.4f}', '메모리 변화(MB)': '{:.1f}', '최대 RSS(MB)': '{:,.0f}', '처리량(행/초)': '{:,.0f}'}), use_container_width=True)
+                col_json, col_prom = st.columns(2)
+                with col_json: st.download_button("프로파일 JSON 다운로드", analysis['profile'].to_json(), "profile.json", "application/json")
+                with col_prom: st.download_button("Prometheus 텍스트 다운로드", analysis['profile'].to_prometheus(), "profile.prom", "text/plain")
+
+        with st.expander("🎚️ 민감도 프리셋 비교"):
+            # 현재 점수 설정으로 세 프리셋과 절대 커트라인을 한 번에 평가합니다 (파이프라인 재실행 없음).
+            presets = {'평균': 0.95, '엄격': 0.97, '완화': 0.85}
+            sweep_configs = {name: {**config, 'blocklist_method': 'percentile', 'blocklist_percentile': percentile} for name, percentile in presets.items()}
+            sweep_configs['절대 점수'] = {**config, 'blocklist_method': 'absolute'}
+            sweep_summary, sweep_overlap, _ = sweep_scored(all_scored_df, sweep_configs, analysis['hit_matrix'])
+            sweep_summary = sweep_summary.rename(columns={'name': '프리셋', 'threshold': '커트라인 점수', 'blocked': '제재 디바이스 수'})
+            st.dataframe(sweep_summary[['프리셋', '커트라인 점수', '제재 디바이스 수']], use_container_width=True, hide_index=True)
+            st.caption("프리셋 간 공통 제재 디바이스 수")
+            st.dataframe(sweep_overlap, use_container_width=True)
+
+        min_date, max_date, date_standard = analysis['min_date'], analysis['max_date'], analysis['date_standard']
 
-            # 날짜 계산 (나중에 사용)
-            if 'done_date' in df_original.columns and df_original['done_date'].notna().any():
-                min_date = pd.to_datetime(df_original['done_date'].dropna()).min()
-                max_date = pd.to_datetime(df_original['done_date'].dropna()).max()
-                date_standard = "전환 완료 시점 기준"
+        # 분석 기준 표시 (표 형태)
+        st.markdown("### 📋 분석 기준")
+        
+        # 규칙들을 점수순으로 정렬
+        rules_data = []
+        for rule, params in config.items():
+            if isinstance(params, dict) and 'score' in params:
+                score = params['score']
+                korean_name = KOREAN_NAMES.get(rule, rule)
+                rules_data.append({
+                    '기준명': korean_name,
+                    '점수': score,
+                    '중요도': '높음' if score >= 30 else '낮음'
+                })
+        
+        # 점수순으로 정렬
+        rules_data.sort(key=lambda x: x['점수'], reverse=True)
+        
+        # 표 생성
+        rules_df = pd.DataFrame(rules_data)
+        
+        # 중요도 컬럼 제거 후 표시
+        display_df = rules_df.drop(columns=['중요도'])
+        
+        # 30점 이상인 항목들의 글씨를 굵게 만들기
+        def bold_high_score(row):
+            if row['점수'] >= 30:
+                return ['font-weight: bold'] * len(row)
             else:
-                min_date = df_original['click_date'].min()
-                max_date = df_original['click_date'].max()
-                date_standard = "클릭 시점 기준"
+                return ['font-weight: normal'] * len(row)
+        
+        # CSS를 사용하여 점수 컬럼을 왼쪽 정렬하고 너비 조정
+        st.markdown("""
+        <style>
+        .dataframe td:nth-child(2) {
+            text-align: left !important;
+            padding-left: 8px !important;
+            width: 60px !important;
+            max-width: 60px !important;
+        }
+        .dataframe th:nth-child(2) {
+            text-align: left !important;
+            width: 60px !important;
+            max-width: 60px !important;
+        }
+        div[data-testid="stDataFrame"] table td:nth-child(2) {
+            text-align: left !important;
+            width: 60px !important;
+            max-width: 60px !important;
+        }
+        /* 더 강력한 선택자들 */
+        table td:nth-child(2) {
+            text-align: left !important;
+        }
+        .stDataFrame table td:nth-child(2) {
+            text-align: left !important;
+        }
+        [data-testid="stDataFrame"] table tbody tr td:nth-child(2) {
+            text-align: left !important;
+        }
+        </style>
+        """, unsafe_allow_html=True)
+        
+        # 스타일 적용
+        styled_df = display_df.style.apply(bold_high_score, axis=1)
+        
+        st.dataframe(styled_df, use_container_width=True, height=300)
+        
+        st.markdown("---")
 
-            # 분석 기준 표시 (표 형태)
-            st.markdown("### 📋 분석 기준")
-            
-            # 규칙들을 점수순으로 정렬
-            rules_data = []
-            for rule, params in config.items():
-                if isinstance(params, dict) and 'score' in params:
-                    score = params['score']
-                    korean_name = KOREAN_NAMES.get(rule, rule)
-                    rules_data.append({
-                        '기준명': korean_name,
-                        '점수': score,
-                        '중요도': '높음' if score >= 30 else '낮음'
-                    })
-            
-            # 점수순으로 정렬
-            rules_data.sort(key=lambda x: x['점수'], reverse=True)
-            
-            # 표 생성
-            rules_df = pd.DataFrame(rules_data)
-            
-            # 중요도 컬럼 제거 후 표시
-            display_df = rules_df.drop(columns=['중요도'])
+        # 분석 결과 요약 (원래 위치로 복원)
+        # 1. 제목과 날짜 표시를 위한 영역 분리
+        col_title, col_date = st.columns([0.7, 0.3])
+        
+        with col_title:
+            st.subheader("📊 분석 결과 요약")
+        
+        # 2. 날짜를 오른쪽에 더 큰 글씨로 표시
+        with col_date:
+            st.markdown(f"""
+            <div style="text-align: right; padding-top: 10px;">
+                <p style="font-size: 1.1rem; font-weight: 500; margin: 0;">{min_date.strftime('%Y.%m.%d')} ~ {max_date.strftime('%Y.%m.%d')}</p>
+                <p style="font-size: 0.8rem; color: #8A8B94; margin: 0;">({date_standard})</p>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        logs_per_device = analysis['logs_per_device']
+        total_devices = len(logs_per_device)
+        abusive_devices_count = len(final_block_list)
+        device_abuse_ratio = (abusive_devices_count / total_devices) * 100 if total_devices > 0 else 0
+        total_logs = int(logs_per_device.sum())
+        abusive_logs = int(logs_per_device.reindex(final_block_list).fillna(0).sum())
+        log_abuse_ratio = (abusive_logs / total_logs) * 100 if total_logs > 0 else 0
+        
+        col1, col2 = st.columns(2)
+        with col1: st.markdown(f"""<div style="padding: 10px; border-radius: 5px; background-color: #262730;"><p style="font-size: 16px; color: #FAFAFA; margin-bottom: 5px;">전체 디바이스 중 어뷰징 비율</p><p style="font-size: 28px; color: #FAFAFA; font-weight: bold;">{device_abuse_ratio:.2f}%</p><p style="font-size: 18px; color: #8A8B94;">{abusive_devices_count:,} / {total_devices:,} 개</p></div>""", unsafe_allow_html=True)
+        with col2: st.markdown(f"""<div style="padding: 10px; border-radius: 5px; background-color: #262730;"><p style="font-size: 16px; color: #FAFAFA; margin-bottom: 5px;">전체 로그 중 어뷰징 비율</p><p style="font-size: 28px; color: #FAFAFA; font-weight: bold;">{log_abuse_ratio:.2f}%</p><p style="font-size: 18px; color: #8A8B94;">{abusive_logs:,} / {total_logs:,} 건</p></div>""", unsafe_allow_html=True)
+        st.metric("차단 임계 점수", f"{threshold:.2f} 점")
+        st.divider()
+
+        # ... (이하 나머지 코드는 변경 없음)
+        if not final_block_list: 
+            st.info("탐지된 어뷰징 의심 디바이스가 없습니다.")
+        else:
+            st.subheader("📊 어뷰징 유저가 가장 많이 이용한 매체 Top 10")
             
-            # 30점 이상인 항목들의 글씨를 굵게 만들기
-            def bold_high_score(row):
-                if row['점수'] >= 30:
-                    return ['font-weight: bold'] * len(row)
-                else:
-                    return ['font-weight: normal'] * len(row)
+            # 어뷰징 디바이스가 가장 많이 이용한 mda_idx 계산 (제재 이벤트 프레임을 복사하지 않고 (매체, 디바이스) 쌍만 집계)
+            mda_abuse_counts = media_report(all_scored_df, final_block_list, top=10)
             
-            # CSS를 사용하여 점수 컬럼을 왼쪽 정렬하고 너비 조정
-            st.markdown("""
-            <style>
-            .dataframe td:nth-child(2) {
-                text-align: left !important;
-                padding-left: 8px !important;
-                width: 60px !important;
-                max-width: 60px !important;
-            }
-            .dataframe th:nth-child(2) {
-                text-align: left !important;
-                width: 60px !important;
-                max-width: 60px !important;
-            }
-            div[data-testid="stDataFrame"] table td:nth-child(2) {
-                text-align: left !important;
-                width: 60px !important;
-                max-width: 60px !important;
-            }
-            /* 더 강력한 선택자들 */
-            table td:nth-child(2) {
-                text-align: left !important;
-            }
-            .stDataFrame table td:nth-child(2) {
-                text-align: left !important;
-            }
-            [data-testid="stDataFrame"] table tbody tr td:nth-child(2) {
-                text-align: left !important;
-            }
-            </style>
-            """, unsafe_allow_html=True)
+            # 결과 데이터프레임 생성
+            mda_abuse_df = mda_abuse_counts.reset_index()
+            mda_abuse_df.columns = ['매체 ID (mda_idx)', '어뷰징 유저 수']
+            mda_abuse_df['전체 어뷰징 중 비율 (%)'] = (mda_abuse_df['어뷰징 유저 수'] / abusive_devices_count * 100).map('{:.2f}%'.format)
             
-            # 스타일 적용
-            styled_df = display_df.style.apply(bold_high_score, axis=1)
+            st.dataframe(mda_abuse_df, use_container_width=True)
+            export_buttons(mda_abuse_df, "abuse_media_report", "📈 매체 리포트 다운로드")
+            st.divider()
             
-            st.dataframe(styled_df, use_container_width=True, height=300)
+            # 교차 분석 부분 삭제
             
-            st.markdown("---")
-
-            # 분석 결과 요약 (원래 위치로 복원)
-            # 1. 제목과 날짜 표시를 위한 영역 분리
-            col_title, col_date = st.columns([0.7, 0.3])
+            st.subheader("📄 어뷰징 요약 리포트 (디바이스별)")
             
-            with col_title:
-                st.subheader("📊 분석 결과 요약")
+            # 디바이스별 최고 점수와, 모든 이벤트에서 적중한 사유의 합집합 (점수 내림차순)
+            summary_df = device_report(all_scored_df, final_block_list)
             
-            # 2. 날짜를 오른쪽에 더 큰 글씨로 표시
-            with col_date:
-                st.markdown(f"""
-                <div style="text-align: right; padding-top: 10px;">
-                    <p style="font-size: 1.1rem; font-weight: 500; margin: 0;">{min_date.strftime('%Y.%m.%d')} ~ {max_date.strftime('%Y.%m.%d')}</p>
-                    <p style="font-size: 0.8rem; color: #8A8B94; margin: 0;">({date_standard})</p>
-                </div>
-                """, unsafe_allow_html=True)
+            # 사유 비트마스크를 한글 사유로 변환 (제재 대상 디바이스에 대해서만 디코딩)
+            summary_df = reason_columns(summary_df, names=KOREAN_NAMES, sep=', ', empty='정보 없음')
             
-            total_devices = df_original['dvc_idx'].nunique()
-            abusive_devices_count = len(final_block_list)
-            device_abuse_ratio = (abusive_devices_count / total_devices) * 100 if total_devices > 0 else 0
-            total_logs = len(df_original)
-            abusive_logs = len(df_original[df_original['dvc_idx'].isin(final_block_list)])
-            log_abuse_ratio = (abusive_logs / total_logs) * 100 if total_logs > 0 else 0
+            # 컬럼명 변경
+            summary_df = summary_df[['dvc_idx', 'abuse_score', 'reasons']]
+            summary_df.columns = ['디바이스 ID', '어뷰징 점수', '주요 어뷰징 사유']
             
-            col1, col2 = st.columns(2)
-            with col1: st.markdown(f"""<div style="padding: 10px; border-radius: 5px; background-color: #262730;"><p style="font-size: 16px; color: #FAFAFA; margin-bottom: 5px;">전체 디바이스 중 어뷰징 비율</p><p style="font-size: 28px; color: #FAFAFA; font-weight: bold;">{device_abuse_ratio:.2f}%</p><p style="font-size: 18px; color: #8A8B94;">{abusive_devices_count:,} / {total_devices:,} 개</p></div>""", unsafe_allow_html=True)
-            with col2: st.markdown(f"""<div style="padding: 10px; border-radius: 5px; background-color: #262730;"><p style="font-size: 16px; color: #FAFAFA; margin-bottom: 5px;">전체 로그 중 어뷰징 비율</p><p style="font-size: 28px; color: #FAFAFA; font-weight: bold;">{log_abuse_ratio:.2f}%</p><p style="font-size: 18px; color: #8A8B94;">{abusive_logs:,} / {total_logs:,} 건</p></div>""", unsafe_allow_html=True)
-            st.metric("차단 임계 점수", f"{threshold:.2f} 점")
-            st.divider()
-
-            # ... (이하 나머지 코드는 변경 없음)
-            if not final_block_list: 
-                st.info("탐지된 어뷰징 의심 디바이스가 없습니다.")
-            else:
-                abusive_df = all_scored_df[all_scored_df['dvc_idx'].isin(final_block_list)].copy()
-                @st.cache_data
-                def convert_df_to_csv(df): return df.to_csv(index=False).encode('utf-8-sig')
-
-                st.subheader("📊 어뷰징 유저가 가장 많이 이용한 매체 Top 10")
-                
-                # 어뷰징 디바이스가 가장 많이 이용한 mda_idx 계산
-                mda_abuse_counts = abusive_df.groupby('mda_idx')['dvc_idx'].nunique().sort_values(ascending=False).head(10)
-                
-                # 결과 데이터프레임 생성
-                mda_abuse_df = mda_abuse_counts.reset_index()
-                mda_abuse_df.columns = ['매체 ID (mda_idx)', '어뷰징 유저 수']
-                mda_abuse_df['전체 어뷰징 중 비율 (%)'] = (mda_abuse_df['어뷰징 유저 수'] / abusive_devices_count * 100).map('{:.2f}%'.format)
-                
-                st.dataframe(mda_abuse_df, use_container_width=True)
-                st.download_button("📈 매체 리포트 다운로드", convert_df_to_csv(mda_abuse_df), "abuse_media_report.csv", "text/csv")
-                st.divider()
-                
-                # 교차 분석 부분 삭제
-                
-                st.subheader("📄 어뷰징 요약 리포트 (디바이스별)")
-                
-                # 어뷰징 사유를 한글로 변환하는 함수
-                def translate_reasons(row):
-                    if pd.isna(row['abuse_reasons']) or row['abuse_reasons'] == '':
-                        return '정보 없음'
-                    
-                    reasons = []
-                    reason_parts = row['abuse_reasons'].split(']')
-                    for part in reason_parts:
-                        if part.strip():
-                            # [Reason_Name] 형태에서 Reason_Name만 추출
-                            reason_name = part.replace('[', '').strip()
-                            if reason_name:
-                                # 영어 이름을 한글 이름으로 변환
-                                korean_name = KOREAN_NAMES.get(reason_name.lower(), reason_name)
-                                reasons.append(korean_name)
-                    return ', '.join(reasons) if reasons else '정보 없음'
-                
-                # 디바이스별로 그룹화하여 최고 점수와 사유 추출
-                summary_df = abusive_df.groupby('dvc_idx').agg({
-                    'abuse_score': 'max',
-                    'abuse_reasons': 'first'
-                }).reset_index()
-                
-                # 어뷰징 사유를 한글로 변환
-                summary_df['주요 어뷰징 사유'] = summary_df.apply(translate_reasons, axis=1)
-                
-                # 컬럼명 변경 및 정렬
-                summary_df = summary_df[['dvc_idx', 'abuse_score', '주요 어뷰징 사유']]
-                summary_df.columns = ['디바이스 ID', '어뷰징 점수', '주요 어뷰징 사유']
-                summary_df = summary_df.sort_values('어뷰징 점수', ascending=False).reset_index(drop=True)
-                
-                st.dataframe(summary_df)
-                st.download_button("✅ 요약 리포트 다운로드", convert_df_to_csv(summary_df), "abuse_summary_report.csv", "text/csv", type="primary")
+            # 표에는 상위 일부만 보내고, 전체는 다운로드로 받습니다 (수십만 행을 한 번에 그리면 페이지가 멈춥니다)
+            if len(summary_df) > REPORT_PREVIEW_ROWS:
+                st.caption(f"점수 상위 {REPORT_PREVIEW_ROWS:,}개만 표시합니다. 전체 {len(summary_df):,}개는 아래에서 내려받으세요.")
+            st.dataframe(summary_df.head(REPORT_PREVIEW_ROWS))
+            export_buttons(summary_df, "abuse_summary_report", "✅ 요약 리포트 다운로드", primary=True)
 
 else:
     st.header("STEP 1: 데이터 파일 업로드하기")
-    st.info("⬆️ 사이드바에서 분석에 필요한 3개 파일을 모두 업로드하면 다음 단계가 나타납니다.")
\ No newline at end of file
+    st.info("⬆️ 사이드바에서 원본 로그와 광고 정보 파일을 업로드하면 다음 단계가 나타납니다.")
\ No newline at end of file
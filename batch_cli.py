@@ -0,0 +1,251 @@
+# 파일 이름: batch_cli.py
+
+import argparse
+import copy
+import fnmatch
+import functools
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from detector import CONFIG, blocklist_threshold, detection_signature, run_detection
+from ingest import ARROW_SUFFIXES, PARQUET_SUFFIXES, read_events
+from ip_ranges import IPRangeIndex
+from profiling import collect_profile, peak_rss_mb, profile_stage
+from report import device_report, reason_columns, write_parquet_chunks
+from sketches import QuantileSketch
+
+LOG_SUFFIXES = ('.csv',) + PARQUET_SUFFIXES + ARROW_SUFFIXES
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+SUMMARY_FILE = 'run_summary.json'
+GLOBAL_BLOCKLIST_FILE = 'blocklist_global.parquet'
+
+# 워커 프로세스마다 한 번만 받아 두는 전역 값 (광고 정보, IP 캐시/대역, 설정, 모델/출력 경로)
+_WORKER_CONTEXT = {}
+
+def discover_partitions(log_dir, pattern='*'):
+    """
+    log_dir 바로 아래의 로그 파일 하나, 또는 하위 디렉터리 하나(예: date=2025-06-01/)를 파티션 하나로 봅니다.
+    '.'이나 '_'로 시작하는 이름(_SUCCESS 등)은 건너뛰고, pattern(glob)에 맞는 이름만 고릅니다.
+    반환값: [(파티션 이름, [로그 파일 경로, ...]), ...] (이름순)
+    """
+    partitions = []
+    for entry in sorted(os.scandir(log_dir), key=lambda entry: entry.name):
+        if entry.name.startswith(('.', '_')) or not fnmatch.fnmatch(entry.name, pattern):
+            continue
+        if entry.is_dir():
+            files = sorted(
+                os.path.join(entry.path, name) for name in os.listdir(entry.path)
+                if name.lower().endswith(LOG_SUFFIXES) and not name.startswith(('.', '_'))
+            )
+            if files:
+                partitions.append((entry.name, files))
+        elif entry.name.lower().endswith(LOG_SUFFIXES):
+            partitions.append((os.path.splitext(entry.name)[0], [entry.path]))
+    return partitions
+
+def load_config(path=None):
+    """CONFIG에 JSON 설정 파일의 값을 덮어씁니다. 규칙처럼 딕셔너리인 항목은 키 단위로 합칩니다."""
+    config = copy.deepcopy(CONFIG)
+    if path is None:
+        return config
+    with open(path, encoding='utf-8') as f:
+        overrides = json.load(f)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+def _write_parquet(df, path):
+    """row group 단위로 나눠 쓰고, 스케줄러가 재시도할 때 반쯤 쓴 파일을 읽지 않도록 임시 파일에 쓴 뒤 이름을 바꿉니다."""
+    tmp_path = path + '.tmp'
+    write_parquet_chunks(df, tmp_path)
+    os.replace(tmp_path, path)
+
+def run_partition(name, files, output_dir, ads_list, ip_cache_data, config, model_dir=MODEL_DIR, ip_ranges=None):
+    """
+    파티션 하나를 run_detection()으로 탐지하고 결과를 Parquet로 씁니다. 진행 메시지는 logs/<이름>.log에 남깁니다.
+      scored/<이름>.parquet        채점된 이벤트
+      device_scores/<이름>.parquet 디바이스별 최고 점수 (partition, dvc_idx, abuse_score)
+      blocklist/<이름>.parquet     제재 디바이스 (partition, dvc_idx, abuse_score, rule_hits, events, reasons; 사유는 이벤트 전체의 합집합)
+    반환값: 실행 요약 딕셔너리 (상태, 행 수, 제재 수, 단계별 프로파일, 워커 최대 RSS)
+        성공하면 'score_sketch'(디바이스 점수 QuantileSketch)도 담으며, run_batch()가 꺼내 전역 커트라인에 씁니다.
+    """
+    summary = {'partition': name, 'files': files, 'status': 'done'}
+    start = time.perf_counter()
+    log_path = os.path.join(output_dir, 'logs', f'{name}.log')
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, redirect_stdout(log), collect_profile() as profile:
+            with profile_stage('read_events') as stage:
+                events = pd.concat([read_events(path) for path in files], ignore_index=True)
+                stage.rows_out = len(events)
+            summary['rows'] = len(events)
+            if events.empty:
+                summary['status'] = 'empty'
+                return summary
+            block_list, all_scored_df, device_scores = run_detection(events, ads_list, ip_cache_data, config, ip_ranges=ip_ranges, model_dir=model_dir)
+            del events
+            with profile_stage('write_outputs', len(all_scored_df)):
+                _write_parquet(all_scored_df, os.path.join(output_dir, 'scored', f'{name}.parquet'))
+                device_scores = device_scores.rename('abuse_score').rename_axis('dvc_idx').reset_index()
+                device_scores.insert(0, 'partition', name)
+                _write_parquet(device_scores, os.path.join(output_dir, 'device_scores', f'{name}.parquet'))
+                blocked = reason_columns(device_report(all_scored_df, block_list), empty='')
+                blocked.insert(0, 'partition', name)
+                _write_parquet(blocked, os.path.join(output_dir, 'blocklist', f'{name}.parquet'))
+        summary.update({
+            'events': len(all_scored_df), 'devices_scored': len(device_scores), 'blocked': len(block_list), 'stages': profile.stages,
+            'score_sketch': QuantileSketch.from_values(device_scores['abuse_score']),
+        })
+    except Exception as error:
+        summary.update({'status': 'failed', 'error': f'{type(error).__name__}: {error}'})
+        with open(log_path, 'a', encoding='utf-8') as log:
+            traceback.print_exc(file=log)
+    finally:
+        summary['seconds'] = time.perf_counter() - start
+        summary['worker_peak_rss_mb'] = peak_rss_mb()
+    return summary
+
+def _init_worker(context):
+    _WORKER_CONTEXT.update(context)
+
+def _run_partition_in_worker(name, files):
+    return run_partition(name, files, **_WORKER_CONTEXT)
+
+def write_global_blocklist(output_dir, partitions, score_sketch, config=None):
+    """
+    파티션별 디바이스 점수 스케치를 합친 score_sketch로 전역 커트라인을 구하고, 그 이상인 디바이스를 전역 제재 리스트로 씁니다.
+    전역 분포의 표본은 (파티션, 디바이스)별 최고 점수이며, 한 디바이스가 여러 파티션에서 넘으면 최고 점수와 파티션 목록으로 합칩니다.
+      blocklist_global.parquet  (dvc_idx, abuse_score, partitions)
+    반환값: (전역 커트라인 또는 None, 전역 제재 디바이스 수)
+    """
+    threshold = blocklist_threshold(score_sketch, config)
+    parts = []
+    if threshold is not None:
+        for name in partitions:
+            scores = pd.read_parquet(os.path.join(output_dir, 'device_scores', f'{name}.parquet'))
+            parts.append(scores[scores['abuse_score'] >= threshold])
+    blocked = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame({'partition': [], 'dvc_idx': [], 'abuse_score': []})
+    blocked = blocked.groupby('dvc_idx').agg(abuse_score=('abuse_score', 'max'), partitions=('partition', ', '.join)).reset_index()
+    _write_parquet(blocked, os.path.join(output_dir, GLOBAL_BLOCKLIST_FILE))
+    return threshold, len(blocked)
+
+def check_global_threshold(output_dir, config=None):
+    """
+    run_batch()가 쓴 device_scores/를 모두 읽어 정확한 전역 커트라인을 계산하고, run_summary.json의 스케치 커트라인과 비교합니다.
+    반환값: {'sketch': 스케치 커트라인, 'exact': 정확한 커트라인, 'match': 같으면 True}
+    """
+    with open(os.path.join(output_dir, SUMMARY_FILE), encoding='utf-8') as f:
+        summary = json.load(f)
+    names = [result['partition'] for result in summary['partitions'] if result['status'] == 'done']
+    scores = pd.concat([pd.read_parquet(os.path.join(output_dir, 'device_scores', f'{name}.parquet')) for name in names], ignore_index=True)
+    config = config or CONFIG
+    if config.get('blocklist_method', 'percentile') == 'percentile':
+        exact = float(scores['abuse_score'].quantile(config['blocklist_percentile'])) if len(scores) else None
+    else:
+        exact = blocklist_threshold(QuantileSketch(), config)
+    sketch = summary['global_threshold']
+    return {'sketch': sketch, 'exact': exact, 'match': sketch == exact}
+
+def run_batch(log_dir, ads_list, ip_cache_data, output_dir, config=None, workers=1, pattern='*', model_dir=MODEL_DIR, ip_ranges=None):
+    """
+    날짜별로 나뉜 로그 디렉터리의 파티션들을 workers개 프로세스로 동시에 탐지하고, 결과와 실행 요약을 output_dir에 씁니다.
+    파티션마다 독립된 하루치 탐지이며(커트라인도 파티션별), 한 파티션이 실패해도 나머지는 계속 진행합니다.
+    끝나면 파티션별 디바이스 점수 스케치를 합쳐 모든 점수를 모으지 않고 전역 커트라인을 구하고 blocklist_global.parquet을 씁니다.
+    반환값: 실행 요약 딕셔너리 (output_dir/run_summary.json과 같은 내용)
+    """
+    config = config or CONFIG
+    partitions = discover_partitions(log_dir, pattern)
+    for subdir in ('scored', 'device_scores', 'blocklist', 'logs'):
+        os.makedirs(os.path.join(output_dir, subdir), exist_ok=True)
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    context = {
+        'output_dir': output_dir, 'ads_list': ads_list, 'ip_cache_data': ip_cache_data,
+        'config': config, 'model_dir': model_dir, 'ip_ranges': ip_ranges,
+    }
+    print(f"--- 파티션 {len(partitions)}개, 워커 {workers}개로 탐지 시작 ---")
+    results = []
+    def report(result):
+        results.append(result)
+        detail = f"제재 {result['blocked']:,}개" if result['status'] == 'done' else result.get('error', result['status'])
+        print(f"[{len(results)}/{len(partitions)}] {result['partition']}: {result['status']} ({result['seconds']:.1f}초, {detail})")
+
+    if workers > 1 and len(partitions) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) as pool:
+            futures = {pool.submit(_run_partition_in_worker, name, files): (name, files) for name, files in partitions}
+            for future in as_completed(futures):
+                try:
+                    report(future.result())
+                except Exception as error:  # 워커 프로세스가 죽은 경우(메모리 부족 등)
+                    name, files = futures[future]
+                    report({'partition': name, 'files': files, 'status': 'failed', 'error': f'{type(error).__name__}: {error}', 'seconds': 0.0})
+    else:
+        for name, files in partitions:
+            report(run_partition(name, files, **context))
+
+    results.sort(key=lambda result: result['partition'])
+    done = [result for result in results if result['status'] == 'done']
+    # 스케치는 요약 JSON에 넣지 않고 합쳐서 전역 커트라인에만 씁니다.
+    sketches = [result.pop('score_sketch') for result in done]
+    score_sketch = functools.reduce(QuantileSketch.merge, sketches, QuantileSketch())
+    global_threshold, blocked_global = write_global_blocklist(output_dir, [result['partition'] for result in done], score_sketch, config)
+    seconds = time.perf_counter() - start
+    rows = sum(result.get('rows', 0) for result in results)
+    summary = {
+        'started_at': started_at.isoformat(), 'finished_at': datetime.now(timezone.utc).isoformat(),
+        'log_dir': os.path.abspath(log_dir), 'output_dir': os.path.abspath(output_dir), 'workers': workers,
+        'config_signature': detection_signature(config),
+        'seconds': seconds, 'rows': rows, 'rows_per_sec': rows / seconds if seconds else None,
+        'partitions_total': len(results), 'partitions_done': len(done),
+        'partitions_failed': sum(result['status'] == 'failed' for result in results),
+        'blocked_total': sum(result['blocked'] for result in done),
+        'global_threshold': global_threshold, 'global_threshold_exact': score_sketch.is_exact, 'blocked_global': blocked_global,
+        'partitions': results,
+    }
+    tmp_path = os.path.join(output_dir, SUMMARY_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, os.path.join(output_dir, SUMMARY_FILE))
+    if global_threshold is not None:
+        print(f"--- 전역 커트라인 점수: {global_threshold:.2f} (파티션 {len(done)}개 스케치 병합), 전역 제재 {blocked_global:,}개 ---")
+    print(f"\n✅ {len(done)}/{len(results)}개 파티션 완료, {rows:,}행 {seconds:.1f}초 ({summary['rows_per_sec'] or 0:,.0f}행/초)")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="날짜별로 나뉜 광고 참여 로그 디렉터리를 파티션 단위로 동시에 탐지해 Parquet로 저장합니다.")
+    parser.add_argument('log_dir', help="파티션 로그 디렉터리 (파티션마다 CSV/Parquet/Arrow 파일 하나 또는 하위 디렉터리 하나)")
+    parser.add_argument('--ads-list', required=True, help="광고 정보 CSV")
+    parser.add_argument('--ip-cache', help="IP 별 호스트명 캐시 JSON")
+    parser.add_argument('--ip-ranges', help="클라우드 IP 대역 JSON (예: AWS ip-ranges.json)")
+    parser.add_argument('--output', required=True, help="결과 디렉터리 (scored/, device_scores/, blocklist/, logs/, blocklist_global.parquet, run_summary.json)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="동시에 처리할 파티션 수 (기본: CPU 수)")
+    parser.add_argument('--pattern', default='*', help="처리할 파티션 이름 glob (예: '2025-06-*')")
+    parser.add_argument('--config', help="CONFIG를 덮어쓸 JSON 파일")
+    parser.add_argument('--model-dir', default=MODEL_DIR, help="모델 파일(.joblib) 디렉터리")
+    args = parser.parse_args(argv)
+
+    ads_list = pd.read_csv(args.ads_list)
+    ip_cache_data = None
+    if args.ip_cache:
+        with open(args.ip_cache, encoding='utf-8') as f:
+            ip_cache_data = json.load(f)
+    ip_ranges = None
+    if args.ip_ranges:
+        with open(args.ip_ranges, encoding='utf-8') as f:
+            ip_ranges = IPRangeIndex.from_json(json.load(f))
+    summary = run_batch(args.log_dir, ads_list, ip_cache_data, args.output, load_config(args.config), args.workers, args.pattern, args.model_dir, ip_ranges)
+    # 스케줄러가 실패를 알 수 있도록, 실패한 파티션이 있으면 0이 아닌 종료 코드를 돌려줍니다.
+    return 1 if summary['partitions_failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
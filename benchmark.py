@@ -0,0 +1,205 @@
+# 파일 이름: benchmark.py
+
+import argparse
+import gc
+import json
+import os
+import threading
+import time
+from contextlib import redirect_stdout
+
+import pandas as pd
+
+from detector import CONFIG, assemble_scored, calculate_abuse_scores, get_blocklist, lean_memory_from, load_detection_models, prepare_data, run_detection
+from profiling import current_rss_mb
+from synthetic import generate_ad_logs, write_synthetic_logs, evaluate_detection
+
+BENCHMARK_SIZES = (10**4, 10**5, 10**6)
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class StageTimer:
+    """
+    단계별 경과 시간과 최대 RSS를 기록합니다.
+    최대 RSS는 단계가 도는 동안 백그라운드 스레드가 주기적으로 RSS를 읽어 구합니다.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stages = {}
+
+    def _sample(self, stop, peak):
+        while not stop.wait(self.interval):
+            peak[0] = max(peak[0], current_rss_mb())
+
+    def run(self, name, func, *args, **kwargs):
+        gc.collect()
+        start_rss = current_rss_mb()
+        peak, stop = [start_rss], threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stop, peak), daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+            peak[0] = max(peak[0], current_rss_mb())
+            self.stages[name] = {'seconds': elapsed, 'peak_rss_mb': peak[0], 'rss_growth_mb': peak[0] - start_rss}
+
+def _load_models():
+    return load_detection_models(MODEL_DIR)
+
+def _clear_model_memos(models):
+    """크기별 측정이 앞선 크기의 예측 캐시를 재사용하지 않도록 비웁니다."""
+    for model in models.values():
+        if model is not None:
+            model.clear_memo()
+
+def _quiet(func):
+    """벤치마크 시간 측정에 print 출력이 섞이지 않도록 표준 출력을 버립니다."""
+    def wrapper(*args, **kwargs):
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            return func(*args, **kwargs)
+    return wrapper
+
+def benchmark_batch(n_rows, seed=0, config=None, models=None):
+    """메모리 배치 경로(prepare_data → calculate_abuse_scores → get_blocklist)를 단계별로 측정합니다."""
+    config = config or CONFIG
+    models = models if models is not None else _load_models()
+    timer = StageTimer()
+    ads_rwd_info, ads_list, ip_cache, truth = timer.run('generate', generate_ad_logs, n_rows, seed=seed)
+    df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = timer.run('prepare_data', _quiet(prepare_data), ads_rwd_info, ads_list, ip_cache, config)
+    del ads_rwd_info
+    if not lean_memory_from(config):
+        df_original = None
+    scored = []
+    for name, df, analysis_type in (('score_conversion', df_complete, 'conversion'), ('score_click', df_incomplete, 'click')):
+        scored.append(timer.run(name, calculate_abuse_scores, df, analysis_type, clicks_per_mda, cvr_per_mda, config=config, **models))
+    del df_complete, df_incomplete
+    all_scored_df = timer.run('assemble', assemble_scored, scored, df_original)
+    del scored, df_original
+    block_list, _, _ = timer.run('get_blocklist', _quiet(get_blocklist), all_scored_df, "벤치마크", config)
+    return timer.stages, evaluate_detection(block_list, truth)
+
+def benchmark_streaming(n_rows, seed=0, config=None, models=None, workdir='.', chunksize=500_000):
+    """메모리에 올리지 않는 크기를 위해 합성 로그를 Parquet로 쓴 뒤 스트리밍 경로 전체를 측정합니다."""
+    from streaming import run_streaming_detection
+
+    config = config or CONFIG
+    models = models if models is not None else _load_models()
+    timer = StageTimer()
+    path = os.path.join(workdir, f'synthetic_{n_rows}_{seed}.parquet')
+    ads_list, ip_cache, truth = timer.run('generate', _quiet(write_synthetic_logs), path, n_rows, seed=seed)
+    try:
+        block_list, _ = timer.run('streaming', _quiet(run_streaming_detection), path, ads_list, ip_cache, config, chunksize, **models)
+    finally:
+        os.remove(path)
+    return timer.stages, evaluate_detection(block_list, truth)
+
+def benchmark_engines(n_rows, seed=0, config=None, models=None, workdir='.', threads=None, memory_limit=None):
+    """
+    같은 합성 Parquet 로그를 DuckDB 백엔드와 판다스 배치 경로(run_detection)로 각각 끝까지 탐지해 시간/최대 RSS를 잽니다.
+    DuckDB를 먼저 돌려 판다스 쪽이 늘려 놓은 RSS가 DuckDB 측정에 섞이지 않게 하며, 흘려 쓰는 파일은 workdir에 둡니다.
+    """
+    from duckdb_backend import run_duckdb_detection
+
+    config = config or CONFIG
+    models = models if models is not None else _load_models()
+    timer = StageTimer()
+    path = os.path.join(workdir, f'synthetic_{n_rows}_{seed}.parquet')
+    ads_list, ip_cache, truth = timer.run('generate', _quiet(write_synthetic_logs), path, n_rows, seed=seed)
+    try:
+        _clear_model_memos(models)
+        duckdb_blocked, _ = timer.run('duckdb', _quiet(run_duckdb_detection), path, ads_list, ip_cache, config, threads=threads, memory_limit=memory_limit, temp_directory=workdir, **models)
+        _clear_model_memos(models)
+        pandas_blocked = timer.run('pandas', _quiet(run_detection), path, ads_list, ip_cache, config, model_dir=MODEL_DIR)[0]
+    finally:
+        os.remove(path)
+    return timer.stages, {'same_blocklist': sorted(duckdb_blocked) == sorted(pandas_blocked), **evaluate_detection(duckdb_blocked, truth)}
+
+def crossover_size(result, metric='seconds'):
+    """run_engine_crossover() 결과에서 그 크기부터 끝까지 DuckDB의 metric(시간 또는 RSS 증가량)이 판다스보다 작은 가장 작은 행 수 (없으면 None)."""
+    values = result.pivot(index='rows', columns='engine', values=metric).sort_index()
+    faster = (values['duckdb'] < values['pandas']).to_numpy()
+    for i, n_rows in enumerate(values.index):
+        if faster[i:].all():
+            return int(n_rows)
+    return None
+
+def run_engine_crossover(sizes=BENCHMARK_SIZES, seed=0, config=None, workdir='.', threads=None, memory_limit=None):
+    """
+    크기별로 판다스 배치 경로와 DuckDB 백엔드의 시간/최대 RSS를 비교하고, 시간과 메모리 각각 DuckDB가 앞서기 시작하는 교차 크기를 출력합니다.
+    DuckDB는 코어 수만큼 빨라지고 memory_limit를 주면 RSS가 그 근처에 머무르므로, 교차 크기는 코어 수와 메모리 한도에 따라 달라집니다.
+    반환값: 크기×엔진별 결과 DataFrame
+    """
+    models = _load_models()
+    rows = []
+    for n_rows in sizes:
+        print(f"--- {n_rows:,}행 (pandas vs duckdb) ---")
+        stages, quality = benchmark_engines(n_rows, seed, config, models, workdir, threads, memory_limit)
+        for engine in ('pandas', 'duckdb'):
+            stage = stages[engine]
+            rows.append({'rows': n_rows, 'engine': engine, **stage, 'rows_per_sec': n_rows / stage['seconds'], **quality})
+        print(f"pandas {stages['pandas']['seconds']:.2f}초 / {stages['pandas']['rss_growth_mb']:,.0f}MB, "
+              f"duckdb {stages['duckdb']['seconds']:.2f}초 / {stages['duckdb']['rss_growth_mb']:,.0f}MB, 제재 리스트 일치: {quality['same_blocklist']}")
+        gc.collect()
+    result = pd.DataFrame(rows)
+    for metric, label in (('seconds', '시간'), ('rss_growth_mb', '메모리')):
+        crossover = crossover_size(result, metric)
+        print(f"{label} 교차 크기: {crossover:,}행부터 DuckDB가 앞섭니다." if crossover else f"{label}: 측정한 크기에서는 DuckDB가 계속 앞서지 않습니다.")
+    return result
+
+def run_benchmark(sizes=BENCHMARK_SIZES, seed=0, config=None, streaming_from=10**7, workdir='.'):
+    """
+    크기별로 합성 로그를 만들어 단계별 시간/최대 RSS/처리량과 주입 봇 탐지 정밀도·재현율을 측정합니다.
+    streaming_from 이상 크기는 스트리밍 경로로 측정합니다.
+    반환값: 크기×단계별 결과 DataFrame (탐지 지표는 크기별로 같은 값이 반복됩니다)
+    """
+    models = _load_models()
+    rows = []
+    for n_rows in sizes:
+        mode = 'streaming' if n_rows >= streaming_from else 'batch'
+        print(f"--- {n_rows:,}행 ({mode}) ---")
+        _clear_model_memos(models)
+        if mode == 'streaming':
+            stages, quality = benchmark_streaming(n_rows, seed, config, models, workdir)
+        else:
+            stages, quality = benchmark_batch(n_rows, seed, config, models)
+        pipeline_seconds = sum(stage['seconds'] for name, stage in stages.items() if name != 'generate')
+        for name, stage in stages.items():
+            rows.append({'rows': n_rows, 'mode': mode, 'stage': name, **stage,
+                         'rows_per_sec': n_rows / stage['seconds'] if stage['seconds'] else float('inf')})
+        rows.append({'rows': n_rows, 'mode': mode, 'stage': 'total', 'seconds': pipeline_seconds,
+                     'peak_rss_mb': max(stage['peak_rss_mb'] for stage in stages.values()),
+                     'rows_per_sec': n_rows / pipeline_seconds, **quality})
+        print(f"처리량 {n_rows / pipeline_seconds:,.0f}행/초, 정밀도 {quality['precision']:.3f}, 재현율 {quality['recall']:.3f}")
+        gc.collect()
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="합성 광고 로그로 어뷰징 탐지 파이프라인 성능을 측정합니다.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES), help="측정할 로그 행 수 (10^4 ~ 10^8)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--streaming-from', type=int, default=10**7, help="이 행 수 이상은 스트리밍 경로로 측정")
+    parser.add_argument('--workdir', default='.', help="스트리밍 측정용 임시 Parquet를 둘 디렉터리")
+    parser.add_argument('--output', help="결과를 저장할 JSON 경로")
+    parser.add_argument('--lean', action='store_true', help="메모리 절약 모드(lean_memory)로 측정")
+    parser.add_argument('--engines', action='store_true', help="판다스 배치 경로와 DuckDB 백엔드를 크기별로 비교해 교차 크기를 찾습니다")
+    parser.add_argument('--threads', type=int, help="DuckDB 스레드 수 (기본: 모든 코어)")
+    parser.add_argument('--memory-limit', help="DuckDB 메모리 한도 (예: '4GB', 넘으면 workdir로 흘려 씀)")
+    args = parser.parse_args()
+
+    config = {**CONFIG, 'lean_memory': {'enabled': args.lean}}
+    if args.engines:
+        result = run_engine_crossover(args.sizes, args.seed, config, args.workdir, args.threads, args.memory_limit)
+    else:
+        result = run_benchmark(args.sizes, args.seed, config, streaming_from=args.streaming_from, workdir=args.workdir)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(result.round(3).to_string(index=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result.to_dict(orient='records'), f, ensure_ascii=False, indent=2, default=float)
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,19 @@
 import pandas as pd
 import numpy as np
 import json
-import joblib
+import os
+from functools import partial
+
+from fraud_rings import RING_COLUMNS, ring_components
+from ingest import read_events
+from ip_ranges import classify_ips
+from model_server import load_optional_model, serve
+from profiling import active_profile, collect_profile, profiled, profile_stage, record_lap, start_laps
+from sketches import DEFAULT_RELATIVE_ERROR, QuantileSketch, approx_pair_counts
 
 # --- 설정값 (CONFIG) ---
 CONFIG = {
-    'burst_attack': {'threshold_clicks': 15, 'score': 15, 'window_min': 5},
+    'burst_attack': {'threshold_clicks': 15, 'score': 15, 'window_min': 5, 'windows_min': [1, 5, 60]}, # windows_min: 함께 계산할 다중 윈도우(분)
     'media_concentration': {'threshold_clicks': 20, 'threshold_mda': 2, 'score': 20},
     'abnormal_cvr': {'threshold_cvr': 0.90, 'threshold_clicks': 20, 'score': 45}, # threshold_clicks 하향
     'short_ctit': {'threshold_sec': 5, 'score': 15},
@@ -19,6 +27,9 @@ CONFIG = {
     'many_devices_per_ip': {'threshold_devices': 6, 'score': 25, 'carrier_ip_threshold': 10000}, # threshold_devices 하향
     'many_ips_per_device': {'threshold_ips': 15, 'score': 25},
     'aws_ip': {'score': 25},
+    'cardinality_sketch': {'enabled': False, 'relative_error': DEFAULT_RELATIVE_ERROR}, # IP↔디바이스/매체 고유 수를 HyperLogLog로 근사 (상대 표준오차)
+    'ads_join': {'legacy_inflation': False, 'keep': 'first'}, # legacy_inflation: 원본처럼 ads_list 중복 ads_idx만큼 행을 늘림 / keep: 중복 ads_idx 중 쓸 행
+    'lean_memory': {'enabled': False}, # 전체 프레임 복사 없이 한 프레임을 구간으로 나눠 채점하고 보조 컬럼을 작은 dtype으로 보관 (prepare_data 참고)
     
     # ▼▼▼ 추가 규칙들 ▼▼▼
     'fraud_long_ctit': {'threshold_sec': 3600, 'score': 35},  # 1시간 초과
@@ -26,6 +37,7 @@ CONFIG = {
     'ctit_anomaly_model': {'score': 35},
     'combo_stealth_bot': {'score': 30},
     'combo_focused_fraud': {'score': 35},
+    'fraud_ring': {'threshold_devices': 5, 'threshold_ips': 3, 'threshold_density': 0.5, 'max_ip_devices': 1000, 'score': 30}, # 디바이스–IP 그래프의 조밀한 연결 요소(링), max_ip_devices 초과 IP는 링을 잇지 않음
     
     # ▼▼▼ 제재 방식 선택 및 절대 점수 기준 추가 ▼▼▼
     'blocklist_method': 'percentile',     # 'percentile' 또는 'absolute' 선택
@@ -33,44 +45,485 @@ CONFIG = {
     'absolute_score_threshold': 100
 }
 
-def prepare_data(ads_rwd_info, ads_list, ip_cache_data, config):
+def count_clicks_in_windows(dvc_idx, click_date, windows_min):
     """
-    데이터를 읽고 병합하며 기본적인 전처리를 수행합니다.
-    (원본 스크립트의 '0단계' 로직과 100% 동일)
-    """
-    # 원본처럼 ads_list의 중복을 제거하지 않아 데이터 뻥튀기 현상을 재현합니다.
-    ads_rwd_info['hostname'] = ads_rwd_info['user_ip'].map(ip_cache_data).fillna('N/A')
-    ads_rwd_info['is_aws'] = ads_rwd_info['hostname'].str.contains('amazonaws.com|AMAZON|AWS', case=False, na=False)
-    df_original = pd.merge(ads_rwd_info, ads_list[['ads_idx', 'ads_type', 'ads_category','ads_name']], on='ads_idx', how='left')
-    df_original = df_original.loc[:, ~df_original.columns.duplicated()]
-    df_original['dvc_idx'] = pd.to_numeric(df_original['dvc_idx'], errors='coerce')
-    df_original.dropna(subset=['dvc_idx'], inplace=True)
-    df_original = df_original[df_original['dvc_idx'] != 0].copy()
-    df_original['dvc_idx'] = df_original['dvc_idx'].astype(int)
+    (dvc_idx, click_date)로 정렬된 배열에서 클릭마다 (t - N분, t] 구간에 있는 같은 디바이스의 클릭 수를 계산합니다.
+    같은 시각의 클릭은 모두 같은 값을 가지며, 여러 윈도우를 한 번의 순위 계산과 searchsorted로 처리합니다.
+    반환값: {윈도우(분): int32 배열}
+    """
+    click_ns = pd.Series(click_date).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    valid = ~pd.isna(pd.Series(click_date)).to_numpy()
+    counts = {minutes: np.ones(len(click_ns), dtype=np.int32) for minutes in windows_min}  # 시각이 없는 클릭은 자기 자신만 셉니다
+    dvc, click_ns = np.asarray(dvc_idx)[valid], click_ns[valid]
+    if len(click_ns) == 0:
+        return counts
+
+    new_device = np.ones(len(dvc), dtype=bool)
+    new_device[1:] = dvc[1:] != dvc[:-1]
+    dvc_codes = np.cumsum(new_device, dtype=np.int64) - 1
+    # 클릭 시각과 각 윈도우 시작 시각을 공통 순위로 바꿔 (디바이스, 시각)을 단조 증가하는 정수 키 하나로 만듭니다.
+    window_starts = [click_ns - int(minutes * 60 * 1_000_000_000) for minutes in windows_min]
+    _, ranks = np.unique(np.concatenate([click_ns] + window_starts), return_inverse=True)
+    n_ranks = ranks.max() + 1
+    keys = dvc_codes * n_ranks + ranks[:len(click_ns)]
+    window_end = np.searchsorted(keys, keys, side='right')
+    for i, minutes in enumerate(windows_min, start=1):
+        start_keys = dvc_codes * n_ranks + ranks[i * len(click_ns):(i + 1) * len(click_ns)]
+        counts[minutes][valid] = window_end - np.searchsorted(keys, start_keys, side='right')
+    return counts
+
+ADS_COLUMNS = ['ads_type', 'ads_category', 'ads_name']
+
+def ads_lookup(ads_list, keep='first'):
+    """ads_idx마다 한 행만 남긴 광고 정보 테이블(ads_idx 색인)을 반환합니다. 중복 ads_idx는 keep('first'/'last') 행을 씁니다."""
+    ads = ads_list[['ads_idx'] + ADS_COLUMNS].drop_duplicates(subset='ads_idx', keep=keep)
+    return ads.set_index('ads_idx')
+
+def join_ads_info(ads_rwd_info, ads_list, legacy_inflation=False, keep='first', inplace=False):
+    """
+    로그에 광고 정보(ads_type, ads_category, ads_name)를 붙입니다.
+    기본은 중복을 정리한 ads_list 색인에서 값을 찾아 붙이므로 행 수가 늘지 않습니다 (pd.merge(how='left')와 같은 행 순서·컬럼 이름).
+    legacy_inflation=True면 원본처럼 중복 제거 없이 병합해, 중복된 ads_idx의 이벤트가 중복 수만큼 늘어납니다.
+    inplace=True면 (중복 제거 병합일 때) 로그 프레임을 복사하지 않고 그 프레임에 컬럼을 붙여 반환합니다.
+    """
+    if legacy_inflation:
+        return pd.merge(ads_rwd_info, ads_list[['ads_idx'] + ADS_COLUMNS], on='ads_idx', how='left')
+    ads = ads_lookup(ads_list, keep).reindex(ads_rwd_info['ads_idx'])
+    if inplace:
+        df = ads_rwd_info
+        df.reset_index(drop=True, inplace=True)
+    else:
+        df = ads_rwd_info.reset_index(drop=True)
+    for column in ADS_COLUMNS:
+        values = ads[column].to_numpy()
+        if column in df.columns:  # merge와 같은 이름 충돌 처리
+            df = df.rename(columns={column: f'{column}_x'})
+            column = f'{column}_y'
+        df[column] = values
+    return df
+
+def ads_join_inflation(ads_rwd_info, ads_list):
+    """
+    원본 방식(중복 제거 없는 병합)이 로그 행을 얼마나 늘리는지 병합 없이 계산합니다.
+    반환값: 딕셔너리 (events, legacy_rows, inflated_rows, duplicated_ads, affected_events)
+    """
+    copies = ads_list['ads_idx'].value_counts()
+    per_event = ads_rwd_info['ads_idx'].map(copies).fillna(1).clip(lower=1).to_numpy(dtype=np.int64)
+    return {
+        'events': len(ads_rwd_info),
+        'legacy_rows': int(per_event.sum()),
+        'inflated_rows': int(per_event.sum() - len(ads_rwd_info)),
+        'duplicated_ads': int((copies > 1).sum()),
+        'affected_events': int((per_event > 1).sum()),
+    }
+
+@profiled('preprocess_events')
+def preprocess_events(ads_rwd_info, ads_list, ip_cache_data, ip_ranges=None, config=None):
+    """
+    행 단위 전처리(IP 분류, 광고 정보 병합, dvc_idx 정제, 날짜 변환)를 수행합니다.
+    행끼리 의존하지 않으므로 전체 로그에도, 스트리밍 청크에도 그대로 쓸 수 있습니다.
+    IP 분류는 고유 IP마다 한 번만 하며, ip_cache_data(호스트명 캐시)와 ip_ranges(CIDR 색인)는 둘 다 선택입니다.
+    광고 정보 병합 방식은 config['ads_join']을 따릅니다 (join_ads_info 참고).
+    lean_memory 모드에서는 ads_rwd_info를 복사하지 않고 그 프레임을 고쳐 씁니다.
+    """
+    config = config or CONFIG
+    ads_join = config.get('ads_join', {})
+    with profile_stage('classify_ips', len(ads_rwd_info)):
+        ads_rwd_info['hostname'], ads_rwd_info['is_aws'] = classify_ips(ads_rwd_info['user_ip'], ip_cache_data, ip_ranges)
+    with profile_stage('merge_ads_list', len(ads_rwd_info)) as stage:
+        df_original = join_ads_info(ads_rwd_info, ads_list, ads_join.get('legacy_inflation', False), ads_join.get('keep', 'first'), inplace=lean_memory_from(config))
+        stage.rows_out = len(df_original)
+    if df_original.columns.duplicated().any():
+        df_original = df_original.loc[:, ~df_original.columns.duplicated()]
+    # dvc_idx가 없거나 0인 행은 한 번의 take로 걸러냅니다 (모두 유효하면 복사하지 않음).
+    dvc_idx = pd.to_numeric(df_original['dvc_idx'], errors='coerce')
+    valid = (dvc_idx.notna() & (dvc_idx != 0)).to_numpy(dtype=bool)
+    if not valid.all():
+        df_original = df_original.take(np.flatnonzero(valid))
+        dvc_idx = dvc_idx[valid]
+    df_original['dvc_idx'] = dvc_idx.astype(int)
     df_original['click_date'] = pd.to_datetime(df_original['click_date'])
+    return df_original
+
+def complete_mask(df):
+    """전환 분석 대상(ctit, user_ip, dvc_idx가 모두 있는 행) 여부를 bool Series로 반환합니다."""
+    return df[['ctit', 'user_ip', 'dvc_idx']].notna().all(axis=1)
+
+def count_mda_clicks(df):
+    """매체별 (클릭 수, 전환 수)를 반환합니다. 청크별 결과를 더해도 전체 결과와 같습니다."""
+    clicks_per_mda = df.groupby('mda_idx').size()
+    conversions_per_mda = df.dropna(subset=['done_date']).groupby('mda_idx').size()
+    return clicks_per_mda, conversions_per_mda
+
+@profiled('prepare_data')
+def prepare_data(ads_rwd_info, ads_list, ip_cache_data, config, ip_ranges=None):
+    """
+    데이터를 읽고 병합하며 기본적인 전처리를 수행합니다.
+    (원본 스크립트의 '0단계' 로직과 동일하되, Burst 클릭 수는 병합 없이 계산해 같은 시각의 클릭이 있어도 행이 늘지 않습니다)
+    ads_list에 중복 ads_idx가 있으면 원본 방식 병합이 늘렸을 행 수를 함께 출력합니다.
+    """
+    inflation = ads_join_inflation(ads_rwd_info, ads_list)
+    if inflation['inflated_rows']:
+        mode = "원본 방식으로 병합해" if config.get('ads_join', {}).get('legacy_inflation') else "중복을 정리해 병합하며, 원본 방식이면"
+        print(f"⚠️ ads_list 중복 ads_idx {inflation['duplicated_ads']:,}개: {mode} 이벤트 {inflation['affected_events']:,}건에서 행이 {inflation['inflated_rows']:,}개 늘어납니다.")
+    df_original = preprocess_events(ads_rwd_info, ads_list, ip_cache_data, ip_ranges, config)
+    if lean_memory_from(config):
+        return _prepare_partitioned(df_original, config)
     
-    # Burst Attack 피쳐 계산 (원본과 동일)
+    # Burst Attack 피쳐 계산: 한 번 정렬한 뒤 여러 윈도우를 병합 없이 한 번에 계산
     df_original.sort_values(by=['dvc_idx', 'click_date'], inplace=True)
-    window = f"{config['burst_attack']['window_min']}min"  # CONFIG에서 가져온 값
-    clicks_in_Nmin = df_original.set_index('click_date').groupby('dvc_idx').rolling(window)['ads_idx'].count().reset_index(name='clicks_in_Nmin')
-    df_original = pd.merge(df_original, clicks_in_Nmin, on=['dvc_idx', 'click_date'], how='left')
-    df_original['clicks_in_Nmin'].fillna(1, inplace=True)
+    df_original.reset_index(drop=True, inplace=True)
+    window_min = config['burst_attack']['window_min']
+    windows = sorted(set(config['burst_attack'].get('windows_min', [])) | {window_min})
+    with profile_stage('burst_windows', len(df_original)):
+        clicks_in_windows = count_clicks_in_windows(df_original['dvc_idx'].to_numpy(), df_original['click_date'], windows)
+    for minutes in windows:
+        df_original[f'clicks_in_{minutes}min'] = clicks_in_windows[minutes]
+    df_original['clicks_in_Nmin'] = clicks_in_windows[window_min]
     
     # 완전한 데이터와 불완전한 데이터 분리
-    df_complete = df_original.dropna(subset=['ctit', 'user_ip', 'dvc_idx']).copy()
-    df_incomplete = df_original[~df_original.index.isin(df_complete.index)].copy()
+    is_complete = complete_mask(df_original).to_numpy()
+    df_complete = df_original.take(np.flatnonzero(is_complete))
+    df_incomplete = df_original.take(np.flatnonzero(~is_complete))
     
     # CVR 계산
-    clicks_per_mda = df_original.groupby('mda_idx').size()
-    conversions_per_mda = df_original.dropna(subset=['done_date']).groupby('mda_idx').size()
+    clicks_per_mda, conversions_per_mda = count_mda_clicks(df_original)
     cvr_per_mda = (conversions_per_mda / clicks_per_mda).fillna(0)
     
     return df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda
 
-def calculate_abuse_scores(df, analysis_type='conversion', clicks_per_mda_series=None, cvr_per_mda_series=None, anomaly_model=None, ctit_anomaly_model=None, config=None):
+def lean_memory_from(config):
+    """config의 메모리 절약 모드 여부."""
+    return bool((config or {}).get('lean_memory', {}).get('enabled'))
+
+def _compact(values):
+    """정수는 값이 들어가는 가장 작은 정수형으로, 실수는 float32로 줄입니다. 정수 변환은 값이 바뀌지 않습니다."""
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if values.dtype.kind in 'iu':
+        return pd.to_numeric(values, downcast='unsigned' if values.min() >= 0 else 'integer')
+    if values.dtype.kind == 'f':
+        return values.astype(np.float32)
+    return values
+
+def _prepare_partitioned(df_original, config):
+    """
+    prepare_data()의 메모리 절약 경로. 전체 프레임을 한 번만 재배열해 (전환 대상 → 나머지) 순서로 두고,
+    각 구간은 (dvc_idx, click_date)로 정렬된 상태라 df_complete/df_incomplete를 복사 없는 구간 뷰로 반환합니다.
+    채점 결과는 assemble_scored()로 df_original에 컬럼만 붙여 합칩니다. 값은 기본 경로와 같고 행 순서만 구간 순서입니다.
+    """
+    keys = df_original[['dvc_idx', 'click_date']].reset_index(drop=True)
+    order = keys.sort_values(by=['dvc_idx', 'click_date']).index.to_numpy()
+    window_min = config['burst_attack']['window_min']
+    windows = sorted(set(config['burst_attack'].get('windows_min', [])) | {window_min})
+    with profile_stage('burst_windows', len(df_original)):
+        clicks_in_windows = count_clicks_in_windows(keys['dvc_idx'].to_numpy()[order], keys['click_date'].iloc[order], windows)
+    del keys
+    is_complete = complete_mask(df_original).to_numpy()[order]
+    partition = np.concatenate([np.flatnonzero(is_complete), np.flatnonzero(~is_complete)])
+    df_original = df_original.take(order[partition])
+    df_original.reset_index(drop=True, inplace=True)
+    for minutes in windows:
+        df_original[f'clicks_in_{minutes}min'] = _compact(clicks_in_windows[minutes][partition]).to_numpy()
+    df_original['clicks_in_Nmin'] = df_original[f'clicks_in_{window_min}min']
+    del clicks_in_windows, order, partition
+
+    n_complete = int(is_complete.sum())
+    # 얕은 복사라 채점이 새 컬럼을 붙여도 df_original에는 영향이 없고, 기존 컬럼 메모리는 공유합니다.
+    df_complete = df_original.iloc[:n_complete].copy(deep=False)
+    df_incomplete = df_original.iloc[n_complete:].copy(deep=False)
+    clicks_per_mda, conversions_per_mda = count_mda_clicks(df_original)
+    cvr_per_mda = (conversions_per_mda / clicks_per_mda).fillna(0)
+    return df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda
+
+def assemble_scored(scored_parts, df_original=None):
+    """
+    분석 유형별 채점 결과를 하나로 합칩니다 (pd.concat(scored_parts, ignore_index=True)와 같은 행·컬럼).
+    메모리 절약 경로의 구간 결과이면 df_original에 새 컬럼만 붙여 만들고, 각 구간의 컬럼은 옮기는 즉시 버립니다.
+    """
+    parts = [part for part in scored_parts if not part.empty]
+    expected = np.arange(sum(len(part) for part in parts))
+    if df_original is None or len(df_original) != len(expected) or not np.array_equal(np.concatenate([part.index.to_numpy() for part in parts] or [expected]), expected):
+        return pd.concat(scored_parts, ignore_index=True)
+    new_columns = []
+    for part in parts:
+        new_columns += [column for column in part.columns if column not in df_original.columns and column not in new_columns]
+    for column in new_columns:
+        dtype = next(part[column].dtype for part in parts if column in part)
+        filler = dtype if dtype.kind == 'f' else np.float64  # 한쪽에만 있는 컬럼은 pd.concat처럼 NaN으로 채웁니다
+        pieces = [part.pop(column) if column in part else pd.Series(np.nan, index=part.index, dtype=filler) for part in parts]
+        df_original[column] = pd.concat(pieces)
+        del pieces
+    return df_original
+
+# --- 규칙 히트 비트마스크 레지스트리 ---
+# CONFIG의 규칙 키마다 비트 하나를 할당합니다. 이벤트별 적중 규칙은 'rule_hits'(uint32) 컬럼 하나에 저장하고,
+# 사람이 읽는 사유 문자열은 제재 대상이나 리포트에 필요할 때만 decode_reasons()로 풀어냅니다.
+# 순서는 기존 규칙 적용 순서와 같으며, 'aws_ip' 앞의 규칙들이 AWS 게이트(점수 > 0) 판단에 쓰입니다.
+RULE_ORDER = [
+    'burst_attack', 'media_concentration', 'abnormal_cvr', 'short_ctit', 'suspicious_early_hour',
+    'consistent_ctit', 'fraud_long_ctit', 'suspicious_single_conv', 'heavy_click_spam', 'anomaly_model',
+    'rapid_click', 'many_devices_per_ip', 'many_ips_per_device',
+    'aws_ip', 'ctit_anomaly_model', 'combo_stealth_bot', 'combo_focused_fraud', 'fraud_ring',
+]
+RULE_BITS = {rule: bit for bit, rule in enumerate(RULE_ORDER)}
+RULE_LABELS = {
+    'burst_attack': 'Burst_Attack', 'media_concentration': 'Media_Concentration', 'abnormal_cvr': 'Abnormal_CVR',
+    'short_ctit': 'Short_CTIT', 'suspicious_early_hour': 'Suspicious_Early_Hour', 'consistent_ctit': 'Consistent_CTIT',
+    'fraud_long_ctit': 'Fraud_Long_CTIT', 'suspicious_single_conv': 'Suspicious_Single_Conversion',
+    'heavy_click_spam': 'Heavy_Click_Spam', 'anomaly_model': 'Anomaly_Model_Flag', 'rapid_click': 'Rapid_Click',
+    'many_devices_per_ip': 'Many_Devices_Per_IP', 'many_ips_per_device': 'Many_IPs_Per_Device', 'aws_ip': 'AWS_IP_Used',
+    'ctit_anomaly_model': 'CTIT_Anomaly_Model', 'combo_stealth_bot': 'Combo_Stealth_Bot', 'combo_focused_fraud': 'Combo_Focused_Fraud',
+    'fraud_ring': 'Fraud_Ring',
+}
+# AWS 사용 자체는 조건일 뿐이고, 앞선 규칙들로 이미 점수가 있는 이벤트에서만 실제 적중으로 인정합니다.
+GATED_RULES = ('aws_ip', 'combo_stealth_bot')
+
+def _rule_bit(rule):
+    return np.uint32(1 << RULE_BITS[rule])
+
+def _set_rule(cond_hits, mask, rule):
+    """규칙 조건을 만족하는 이벤트의 비트를 켭니다."""
+    mask = np.asarray(mask, dtype=bool)
+    cond_hits[mask] |= _rule_bit(rule)
+    record_lap(f'rule:{rule}', len(cond_hits), mask)  # 프로파일링 중이면 직전 규칙 이후 구간(이 규칙의 마스크 계산)을 기록
+
+_GATED_MASK = np.uint32(sum(1 << RULE_BITS[rule] for rule in GATED_RULES))
+
+class RuleHitMatrix:
+    """
+    이벤트 × 규칙 적중 행렬을 서로 다른 조건 비트마스크 패턴 단위로 압축해 보관합니다.
+    임계값은 그대로이고 점수(score)만 바뀌면 rescore()로 행렬-벡터 곱 한 번에 전체 이벤트 점수를 다시 계산합니다.
+    """
+    def __init__(self, rule_conditions):
+        codes, patterns = pd.factorize(np.asarray(rule_conditions, dtype=np.uint32), sort=False)
+        self.codes = codes
+        self.patterns = np.asarray(patterns, dtype=np.uint32)
+        self.bits = (self.patterns[:, None] >> np.arange(len(RULE_ORDER), dtype=np.uint32)) & 1
+
+    def rescore(self, config):
+        """CONFIG 점수로 (이벤트별 어뷰징 점수, 실제 적중 비트마스크)를 반환합니다."""
+        weights = np.array([config.get(rule, {}).get('score', 0) for rule in RULE_ORDER])
+        gate_bit = RULE_BITS['aws_ip']
+        gate_open = self.bits[:, :gate_bit] @ weights[:gate_bit] > 0
+        effective = np.where(gate_open, self.patterns, self.patterns & ~_GATED_MASK).astype(np.uint32)
+        eff_bits = (effective[:, None] >> np.arange(len(RULE_ORDER), dtype=np.uint32)) & 1
+        pattern_scores = eff_bits @ weights
+        return pattern_scores[self.codes], effective[self.codes]
+
+    def rescore_many(self, configs):
+        """
+        여러 설정의 점수를 한 번의 행렬 곱으로 계산합니다 (rescore()를 설정마다 부르는 것과 같은 결과).
+        반환값: 패턴 × 설정 점수 행렬 (이벤트별 점수는 결과[self.codes])
+        """
+        weights = np.array([[config.get(rule, {}).get('score', 0) for rule in RULE_ORDER] for config in configs]).reshape(-1, len(RULE_ORDER))
+        gate_bit = RULE_BITS['aws_ip']
+        gate_open = self.bits[:, :gate_bit] @ weights[:, :gate_bit].T > 0
+        gated = [RULE_BITS[rule] for rule in GATED_RULES]
+        return self.bits @ weights.T - np.where(gate_open, 0, self.bits[:, gated] @ weights[:, gated].T)
+
+def score_rule_hits(cond_hits, config):
+    """
+    규칙 조건 비트마스크와 CONFIG 점수로 이벤트별 어뷰징 점수와 실제 적중 비트마스크를 계산합니다.
+    서로 다른 비트마스크 값(보통 수백 개 이하)마다 한 번씩만 계산한 뒤 이벤트로 펼칩니다.
+    """
+    return RuleHitMatrix(cond_hits).rescore(config)
+
+def detection_signature(config):
+    """
+    점수(score)와 제재 기준을 제외한 탐지 설정을 문자열로 반환합니다.
+    이 값이 같으면 규칙 조건 비트마스크도 같으므로 RuleHitMatrix.rescore()만으로 재계산할 수 있습니다.
+    """
+    thresholds = {
+        rule: {key: value for key, value in params.items() if key != 'score'}
+        for rule, params in config.items() if isinstance(params, dict)
+    }
+    return json.dumps(thresholds, sort_keys=True, default=str)
+
+def prepare_signature(config):
+    """prepare_data() 결과에 영향을 주는 설정(Burst 윈도우, 광고 정보 병합 방식)만 문자열로 반환합니다. 전처리 결과 캐시 키에 씁니다."""
+    burst = config['burst_attack']
+    return json.dumps({'window_min': burst['window_min'], 'windows_min': sorted(burst.get('windows_min', [])), 'ads_join': config.get('ads_join', {})}, sort_keys=True)
+
+def decode_reasons(rule_hits, names=None, sep=', ', empty=''):
+    """
+    rule_hits 비트마스크를 사람이 읽는 사유 문자열로 변환합니다.
+    서로 다른 비트마스크 값마다 한 번씩만 풀어내므로 제재 대상이나 리포트 행에만 호출하세요.
+    names를 주지 않으면 기존 '[Burst_Attack] [Rapid_Click] ' 형식을 그대로 재현합니다.
+    """
+    hits = pd.Series(rule_hits)
+    codes, uniques = pd.factorize(hits.astype(np.int64), sort=False)
+    decoded = []
+    for value in uniques:
+        rules = [rule for rule in RULE_ORDER if int(value) & (1 << RULE_BITS[rule])]
+        if not rules:
+            decoded.append(empty)
+        elif names is None:
+            decoded.append(''.join(f'[{RULE_LABELS[rule]}] ' for rule in rules))
+        else:
+            decoded.append(sep.join(names.get(rule, RULE_LABELS[rule]) for rule in rules))
+    decoded = np.asarray(decoded + [empty], dtype=object)
+    return pd.Series(decoded[codes], index=hits.index)
+
+def _group_moments(values, codes, n_groups):
+    """그룹 코드별 (유효 개수, 평균, 표본 표준편차)를 NaN을 제외하고 계산합니다."""
+    valid = ~np.isnan(values)
+    valid_codes, valid_values = codes[valid], values[valid]
+    count = np.bincount(valid_codes, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(valid_codes, weights=valid_values, minlength=n_groups) / count
+        deviation = valid_values - mean[valid_codes]
+        m2 = np.bincount(valid_codes, weights=deviation * deviation, minlength=n_groups)
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+    return count, mean, std
+
+def _group_order_stats(values, codes, starts, count):
+    """그룹 코드로 정렬된 배열에서 그룹별 (중앙값, 최솟값, 최댓값)을 한 번의 정렬로 계산합니다."""
+    sorted_values = values[np.lexsort((values, codes))]  # 그룹 안에서 NaN은 뒤로 밀립니다
+    safe_count = np.maximum(count, 1)  # 유효값이 없는 그룹은 NaN 위치를 읽어 NaN이 됩니다
+    median = (sorted_values[starts + (safe_count - 1) // 2] + sorted_values[starts + safe_count // 2]) / 2
+    return median, sorted_values[starts], sorted_values[starts + safe_count - 1]
+
+def _distinct_pair_counts(left_codes, right_codes, n_left, n_right):
+    """(left, right) 코드 쌍의 중복을 제거해 양쪽 기준 고유 상대 개수를 함께 계산합니다. 코드 -1(NaN)은 제외합니다."""
+    valid = (left_codes >= 0) & (right_codes >= 0)
+    pairs = pd.unique(left_codes[valid].astype(np.int64) * n_right + right_codes[valid])
+    return np.bincount(pairs // n_right, minlength=n_left), np.bincount(pairs % n_right, minlength=n_right)
+
+def sketch_error_from(config):
+    """config에서 근사 집계 상대오차를 읽습니다. 근사 모드가 꺼져 있으면 None(정확 집계)입니다."""
+    sketch = (config or {}).get('cardinality_sketch', {})
+    return sketch.get('relative_error', DEFAULT_RELATIVE_ERROR) if sketch.get('enabled') else None
+
+def build_feature_tables(df, medians=(), sketch_error=None):
+    """
+    (dvc_idx, click_date)로 정렬된 이벤트 프레임에서 규칙과 모델이 쓰는 디바이스/IP/매체 집계를 한 번에 계산합니다.
+    groupby('dvc_idx')를 반복하는 대신 정렬된 디바이스 경계와 bincount로 모든 디바이스 집계를 한 패스에 만듭니다.
+    medians에 'time_diff_sec' 또는 'ctit'를 넣으면 모델 입력용 중앙값/최솟값/최댓값도 계산합니다.
+    sketch_error를 주면 IP/매체/디바이스 고유 수를 고유 쌍 대신 그 상대오차의 HyperLogLog 스케치로 근사합니다.
+
+    반환값: 디바이스 피쳐 테이블(index=dvc_idx), IP 피쳐 테이블(index=user_ip),
+            이벤트별 배열 딕셔너리 ('dvc_code', 'ip_code', 'time_diff_sec')
+    """
+    dvc = df['dvc_idx'].to_numpy()
+    n = len(dvc)
+    new_device = np.ones(n, dtype=bool)
+    new_device[1:] = dvc[1:] != dvc[:-1]
+    starts = np.flatnonzero(new_device)
+    dvc_codes = np.cumsum(new_device) - 1
+    n_devices = len(starts)
+
+    # 디바이스 내 클릭 간격 (첫 클릭은 NaN)
+    click_ns = df['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    missing = df['click_date'].isna().to_numpy()
+    time_diff = np.empty(n)
+    time_diff[1:] = (click_ns[1:] - click_ns[:-1]) / 1_000_000_000
+    invalid = new_device | missing
+    invalid[1:] |= missing[:-1]
+    time_diff[invalid] = np.nan
+
+    ip_codes, ip_uniques = pd.factorize(df['user_ip'])
+    mda_codes, mda_uniques = pd.factorize(df['mda_idx'])
+    if sketch_error is None:
+        ip_count, dvc_count_per_ip = _distinct_pair_counts(dvc_codes, ip_codes, n_devices, len(ip_uniques))
+        mda_count, _ = _distinct_pair_counts(dvc_codes, mda_codes, n_devices, len(mda_uniques))
+    else:
+        ip_count = approx_pair_counts(dvc_codes, df['user_ip'], n_devices, sketch_error)
+        mda_count = approx_pair_counts(dvc_codes, df['mda_idx'], n_devices, sketch_error)
+        dvc_count_per_ip = approx_pair_counts(ip_codes, dvc, len(ip_uniques), sketch_error)
+
+    features = {
+        'total_clicks': np.diff(np.append(starts, n)),
+        'ip_count': ip_count,
+        'mda_count': mda_count,
+    }
+    for prefix, values in (('interval', time_diff), ('ctit', df['ctit'].to_numpy(dtype=float))):
+        count, mean, std = _group_moments(values, dvc_codes, n_devices)
+        features.update({f'{prefix}_count': count, f'{prefix}_mean': mean, f'{prefix}_std': std})
+        source = 'time_diff_sec' if prefix == 'interval' else 'ctit'
+        if source in medians:
+            median, minimum, maximum = _group_order_stats(values, dvc_codes, starts, count)
+            features.update({f'{prefix}_median': median, f'{prefix}_min': minimum, f'{prefix}_max': maximum})
+
+    device_features = pd.DataFrame(features, index=pd.Index(dvc[starts], name='dvc_idx'))
+    ip_features = pd.DataFrame({'dvc_count': dvc_count_per_ip}, index=pd.Index(ip_uniques, name='user_ip'))
+    event_arrays = {'dvc_code': dvc_codes, 'ip_code': ip_codes, 'time_diff_sec': time_diff}
+    return device_features, ip_features, event_arrays
+
+def build_ip_features(df, sketch_error=None):
+    """
+    IP별 고유 디바이스 수 테이블(index=user_ip)을 만듭니다.
+    디바이스 단위로 나눠 채점(샤드/병렬)할 때 전역 IP 집계로 한 번만 계산해 넘깁니다.
+    """
+    dvc_codes, dvc_uniques = pd.factorize(df['dvc_idx'])
+    ip_codes, ip_uniques = pd.factorize(df['user_ip'])
+    if sketch_error is None:
+        _, dvc_count_per_ip = _distinct_pair_counts(dvc_codes, ip_codes, len(dvc_uniques), len(ip_uniques))
+    else:
+        dvc_count_per_ip = approx_pair_counts(ip_codes, df['dvc_idx'].to_numpy(), len(ip_uniques), sketch_error)
+    return pd.DataFrame({'dvc_count': dvc_count_per_ip}, index=pd.Index(ip_uniques, name='user_ip'))
+
+def _broadcast(values, codes):
+    """그룹 단위 값을 이벤트로 펼칩니다. 코드 -1(NaN 키)은 NaN으로 채웁니다."""
+    out = np.asarray(values)[codes]
+    missing = codes < 0
+    if missing.any():
+        out = out.astype(float)
+        out[missing] = np.nan
+    return out
+
+def _device_model_scores(model, model_features):
+    """디바이스 단위 모델 입력의 이상 점수(decision_function, 음수면 이상)를 반환합니다. 결측 행은 예측하지 않고 NaN입니다."""
+    return serve(model).decision_function(model_features)
+
+def add_model_flags(device_features, analysis_type, anomaly_model=None, ctit_anomaly_model=None):
+    """
+    디바이스 피쳐 테이블에 이상 탐지 모델 판정 컬럼('anomaly_model_flag', 'ctit_anomaly_model_flag')과
+    이상 점수 컬럼('anomaly_model_score', 'ctit_anomaly_model_score', 음수일수록 이상, 예측 안 한 행은 NaN)을 추가합니다.
+    이미 판정 컬럼이 있으면 다시 예측하지 않으므로, 청크/샤드마다 같은 테이블을 넘겨도 모델은 한 번만 돕니다.
+    """
+    if analysis_type == 'click' and anomaly_model and 'anomaly_model_flag' not in device_features:
+        interval_features = device_features[['interval_mean', 'interval_std', 'interval_median', 'interval_count']]
+        interval_features.columns = ['mean', 'std', 'median', 'count']
+        with profile_stage('model:anomaly_model', len(interval_features)) as stage:
+            device_features['anomaly_model_score'] = _device_model_scores(anomaly_model, interval_features)
+            device_features['anomaly_model_flag'] = device_features['anomaly_model_score'].to_numpy() < 0
+            stage.rows_out = int(device_features['anomaly_model_flag'].sum())
+    if analysis_type == 'conversion' and ctit_anomaly_model and 'ctit_anomaly_model_flag' not in device_features:
+        ctit_features = device_features[['ctit_mean', 'ctit_std', 'ctit_median', 'ctit_count', 'ctit_min', 'ctit_max']]
+        ctit_features.columns = ['mean', 'std', 'median', 'count', 'min', 'max']
+        ctit_features = ctit_features.where(ctit_features['count'] >= 3)
+        with profile_stage('model:ctit_anomaly_model', len(ctit_features)) as stage:
+            device_features['ctit_anomaly_model_score'] = _device_model_scores(ctit_anomaly_model, ctit_features)
+            device_features['ctit_anomaly_model_flag'] = device_features['ctit_anomaly_model_score'].to_numpy() < 0
+            stage.rows_out = int(device_features['ctit_anomaly_model_flag'].sum())
+    return device_features
+
+# 메모리 절약 모드에서 채점 후 작은 dtype(정수는 최소 정수형, 실수는 float32)으로 줄이는 보조 컬럼
+LEAN_HELPER_COLUMNS = [
+    'time_diff_sec', 'dvc_count_per_ip', 'ip_count_per_dvc', 'total_clicks_per_dvc', 'click_hour', 'unique_mda_count',
+    'mda_cvr', 'click_interval_std', 'ctit_std', 'anomaly_model_score', 'ctit_anomaly_model_score', 'ring_size', 'ring_density',
+]
+
+def _sorted_by_device_time(df):
+    """(dvc_idx, click_date) 순으로 이미 정렬돼 있는지 확인합니다. 정렬돼 있으면 sort_values()가 행을 옮기지 않으므로 건너뜁니다."""
+    dvc_idx, click_date = df['dvc_idx'], df['click_date']
+    if not dvc_idx.is_monotonic_increasing or click_date.dtype.kind != 'M' or click_date.isna().any():
+        return False
+    dvc, click = dvc_idx.to_numpy(), click_date.to_numpy()
+    return bool(((dvc[1:] != dvc[:-1]) | (click[1:] >= click[:-1])).all())
+
+# calculate_abuse_scores가 읽는 입력 컬럼 (샤드/워커로 보낼 때 이 컬럼만 전송합니다)
+SCORING_INPUT_COLUMNS = ['dvc_idx', 'click_date', 'user_ip', 'mda_idx', 'ctit', 'clicks_in_Nmin', 'ads_type', 'ads_category', 'is_aws']
+
+def calculate_abuse_scores(df, analysis_type='conversion', clicks_per_mda_series=None, cvr_per_mda_series=None, anomaly_model=None, ctit_anomaly_model=None, config=None, device_features=None, ip_features=None, ring_features=None):
     """
     어뷰징 점수를 계산합니다.
-    (원본 스크립트의 '1단계' 로직과 100% 동일)
+    (원본 스크립트의 '1단계' 로직과 100% 동일, 사유는 'rule_hits' 비트마스크로 기록)
+    
+    device_features/ip_features를 주면 df 밖에서 미리 집계한 피쳐 테이블(스트리밍 상태, 전역 IP 집계 등)을
+    사용합니다. device_features를 줄 때는 df에 디바이스별 'time_diff_sec'이 미리 채워져 있어야 합니다.
+    링 규칙은 디바이스–IP 그래프 전체가 필요하므로, 피쳐를 밖에서 넘길 때는 ring_features(index=dvc_idx, RING_COLUMNS)나
+    그 컬럼을 담은 device_features도 함께 넘겨야 합니다 (fraud_rings.ring_feature_table 참고).
     """
     if df.empty:
         return df
@@ -79,167 +532,245 @@ def calculate_abuse_scores(df, analysis_type='conversion', clicks_per_mda_series
     if config is None:
         config = CONFIG
 
-    df['abuse_score'] = 0
-    df['abuse_reasons'] = ''
-    dvc_per_ip = df.groupby('user_ip')['dvc_idx'].nunique()
-    ip_per_dvc = df.groupby('dvc_idx')['user_ip'].nunique()
-    df['dvc_count_per_ip'] = df['user_ip'].map(dvc_per_ip)
-    df['ip_count_per_dvc'] = df['dvc_idx'].map(ip_per_dvc)
-    df.sort_values(by=['dvc_idx', 'click_date'], inplace=True)
-    df['time_diff_sec'] = df.groupby('dvc_idx')['click_date'].diff().dt.total_seconds()
-    df['total_clicks_per_dvc'] = df.groupby('dvc_idx')['dvc_idx'].transform('count')
+    if not _sorted_by_device_time(df):
+        df.sort_values(by=['dvc_idx', 'click_date'], inplace=True)
+    # 모든 디바이스/IP 집계는 정렬된 프레임에서 한 번에 계산하고, 규칙과 모델이 함께 읽습니다.
+    ip_codes = local_ip_features = None
+    if device_features is None:
+        medians = ()
+        if analysis_type == 'click' and anomaly_model:
+            medians += ('time_diff_sec',)
+        if analysis_type == 'conversion' and ctit_anomaly_model:
+            medians += ('ctit',)
+        with profile_stage(f'features:{analysis_type}', len(df)) as stage:
+            device_features, local_ip_features, events = build_feature_tables(df, medians, sketch_error_from(config))
+            stage.rows_out = len(device_features)
+        dvc_codes = events['dvc_code']
+        df['time_diff_sec'] = events['time_diff_sec']
+        if ip_features is None:
+            ip_features, ip_codes = local_ip_features, events['ip_code']
+    elif ip_features is None:
+        raise ValueError("device_features를 넘길 때는 ip_features도 함께 넘겨야 합니다.")
+    else:
+        dvc_codes = device_features.index.get_indexer(df['dvc_idx'])
+        if (dvc_codes < 0).any():
+            raise ValueError("device_features에 없는 dvc_idx가 포함되어 있습니다.")
+    if ip_codes is None:
+        ip_codes = ip_features.index.get_indexer(df['user_ip'])
+    if ring_features is None and RING_COLUMNS[0] in device_features:
+        ring_features = device_features
+    if ring_features is not None:
+        ring_codes = ring_features.index.get_indexer(df['dvc_idx'])
+        if (ring_codes < 0).any():
+            raise ValueError("ring_features에 없는 dvc_idx가 포함되어 있습니다.")
+        rings = {column: ring_features[column].to_numpy()[ring_codes] for column in RING_COLUMNS}
+    elif ip_features is local_ip_features:
+        with profile_stage(f'rings:{analysis_type}', len(df)):
+            rings = ring_components(dvc_codes, ip_codes, len(device_features), len(ip_features), config['fraud_ring']['max_ip_devices'])
+        rings = {column: values[dvc_codes] for column, values in rings.items()}
+    else:
+        raise ValueError("디바이스/IP 피쳐를 밖에서 넘길 때는 ring_features도 함께 넘겨야 합니다.")
+    device_features = add_model_flags(device_features, analysis_type, anomaly_model, ctit_anomaly_model)
+    start_laps()
+    df['dvc_count_per_ip'] = _broadcast(ip_features['dvc_count'].to_numpy(), ip_codes)
+    df['ip_count_per_dvc'] = device_features['ip_count'].to_numpy()[dvc_codes]
+    df['total_clicks_per_dvc'] = device_features['total_clicks'].to_numpy()[dvc_codes]
     df['click_hour'] = df['click_date'].dt.hour
+    record_lap(f'broadcast:{analysis_type}', len(df))
+    cond_hits = np.zeros(len(df), dtype=np.uint32)
 
     # (기존 규칙 적용 로직은 동일)
     burst_attack_mask = df['clicks_in_Nmin'] > config['burst_attack']['threshold_clicks']
-    df.loc[burst_attack_mask, 'abuse_score'] += config['burst_attack']['score']; df.loc[burst_attack_mask, 'abuse_reasons'] += '[Burst_Attack] '
-    unique_mda_per_dvc = df.groupby('dvc_idx')['mda_idx'].nunique()
-    df['unique_mda_count'] = df['dvc_idx'].map(unique_mda_per_dvc)
+    _set_rule(cond_hits, burst_attack_mask, 'burst_attack')
+    df['unique_mda_count'] = device_features['mda_count'].to_numpy()[dvc_codes]
     media_concentration_mask = (df['total_clicks_per_dvc'] > config['media_concentration']['threshold_clicks']) & (df['unique_mda_count'] < config['media_concentration']['threshold_mda'])
-    df.loc[media_concentration_mask, 'abuse_score'] += config['media_concentration']['score']; df.loc[media_concentration_mask, 'abuse_reasons'] += '[Media_Concentration] '
+    _set_rule(cond_hits, media_concentration_mask, 'media_concentration')
     if cvr_per_mda_series is not None and not cvr_per_mda_series.empty:
         df['mda_cvr'] = df['mda_idx'].map(cvr_per_mda_series)
         abnormal_cvr_mask = (df['mda_cvr'] > config['abnormal_cvr']['threshold_cvr']) & (df['mda_idx'].map(clicks_per_mda_series) > config['abnormal_cvr']['threshold_clicks'])
-        df.loc[abnormal_cvr_mask, 'abuse_score'] += config['abnormal_cvr']['score']; df.loc[abnormal_cvr_mask, 'abuse_reasons'] += '[Abnormal_CVR] '
+        _set_rule(cond_hits, abnormal_cvr_mask, 'abnormal_cvr')
     
     if analysis_type == 'conversion':
-        df['click_interval_std'] = df.groupby('dvc_idx')['time_diff_sec'].transform('std').fillna(0)
-        df['ctit_std'] = df.groupby('dvc_idx')['ctit'].transform('std').fillna(0)
-        conditions = [(df['ads_type'] == 4) | (df['ads_category'] == 4), (df['ads_type'].isin([1,2,3,5,6,7,10,11])) | (df['ads_category'].isin([1,2,3,5,6,7,8,10,13])), (df['ads_type'] == 12) | (df['ads_category'].isin([11,12]))]
-        choices = [0.05, 0.5, 1.0]; df['dynamic_consistency_threshold'] = np.select(conditions, choices, default=0.1)
+        df['click_interval_std'] = np.nan_to_num(device_features['interval_std'].to_numpy()[dvc_codes])
+        df['ctit_std'] = np.nan_to_num(device_features['ctit_std'].to_numpy()[dvc_codes])
+        if not lean_memory_from(config):  # 어느 규칙도 읽지 않는 참고용 컬럼이라 메모리 절약 모드에서는 만들지 않습니다
+            conditions = [(df['ads_type'] == 4) | (df['ads_category'] == 4), (df['ads_type'].isin([1,2,3,5,6,7,10,11])) | (df['ads_category'].isin([1,2,3,5,6,7,8,10,13])), (df['ads_type'] == 12) | (df['ads_category'].isin([11,12]))]
+            choices = [0.05, 0.5, 1.0]; df['dynamic_consistency_threshold'] = np.select(conditions, choices, default=0.1)
         short_ctit_mask = df['ctit'] < config['short_ctit']['threshold_sec']
-        df.loc[short_ctit_mask, 'abuse_score'] += config['short_ctit']['score']; df.loc[short_ctit_mask, 'abuse_reasons'] += '[Short_CTIT] '
+        _set_rule(cond_hits, short_ctit_mask, 'short_ctit')
         early_hour_mask = df['click_hour'].between(config['suspicious_early_hour']['start_hour'], config['suspicious_early_hour']['end_hour'])
         suspicious_in_early_hour_mask = early_hour_mask & ((df['time_diff_sec'] < 2) | (df['ctit'] < 10))
-        df.loc[suspicious_in_early_hour_mask, 'abuse_score'] += config['suspicious_early_hour']['score']; df.loc[suspicious_in_early_hour_mask, 'abuse_reasons'] += '[Suspicious_Early_Hour] '
+        _set_rule(cond_hits, suspicious_in_early_hour_mask, 'suspicious_early_hour')
         consistent_ctit_mask = (df['ctit_std'] < config['consistent_ctit']['threshold_std']) & (df['total_clicks_per_dvc'] > config['consistent_ctit']['threshold_clicks'])
-        df.loc[consistent_ctit_mask, 'abuse_score'] += config['consistent_ctit']['score']; df.loc[consistent_ctit_mask, 'abuse_reasons'] += '[Consistent_CTIT] '
+        _set_rule(cond_hits, consistent_ctit_mask, 'consistent_ctit')
 
         # ▼▼▼ 여기에 새로운 "맞춤형 저격 룰" 추가 ▼▼▼
         # --- (신규) 맞춤형 저격 룰 ---
         # 1. 유령 클릭 (비정상적으로 긴 CTIT)
         long_ctit_mask = df['ctit'] > config['fraud_long_ctit']['threshold_sec']
-        df.loc[long_ctit_mask, 'abuse_score'] += config['fraud_long_ctit']['score']
-        df.loc[long_ctit_mask, 'abuse_reasons'] += '[Fraud_Long_CTIT] '
+        _set_rule(cond_hits, long_ctit_mask, 'fraud_long_ctit')
 
         # 2. 의심스러운 단일 전환 (클릭 수가 1개 & 심야 활동)
         single_click_mask = df['total_clicks_per_dvc'] == 1
         suspicious_single_conv_mask = single_click_mask & early_hour_mask
-        df.loc[suspicious_single_conv_mask, 'abuse_score'] += config['suspicious_single_conv']['score']
-        df.loc[suspicious_single_conv_mask, 'abuse_reasons'] += '[Suspicious_Single_Conversion] '
+        _set_rule(cond_hits, suspicious_single_conv_mask, 'suspicious_single_conv')
         # ▲▲▲ 여기까지 새로운 "맞춤형 저격 룰" 추가 ▲▲▲
 
     elif analysis_type == 'click':
         heavy_clicker_mask = df['total_clicks_per_dvc'] > config['heavy_click_spam']['threshold_clicks']
-        df.loc[heavy_clicker_mask, 'abuse_score'] += config['heavy_click_spam']['score']; df.loc[heavy_clicker_mask, 'abuse_reasons'] += '[Heavy_Click_Spam] '
-        if anomaly_model:
-            device_features = df.groupby('dvc_idx')['time_diff_sec'].agg(['mean', 'std', 'median', 'count']).dropna()
-            if not device_features.empty:
-                predictions = anomaly_model.predict(device_features)
-                anomalous_dvc_ids = device_features.index[predictions == -1]
-                model_based_mask = df['dvc_idx'].isin(anomalous_dvc_ids)
-                df.loc[model_based_mask, 'abuse_score'] += config['anomaly_model']['score']
-                df.loc[model_based_mask, 'abuse_reasons'] += '[Anomaly_Model_Flag] '
+        _set_rule(cond_hits, heavy_clicker_mask, 'heavy_click_spam')
+        if 'anomaly_model_flag' in device_features:
+            _set_rule(cond_hits, device_features['anomaly_model_flag'].to_numpy()[dvc_codes], 'anomaly_model')
+            df['anomaly_model_score'] = device_features['anomaly_model_score'].to_numpy()[dvc_codes]
     
     rapid_click_mask = df['time_diff_sec'] < config['rapid_click']['threshold_sec']
-    df.loc[rapid_click_mask, 'abuse_score'] += config['rapid_click']['score']; df.loc[rapid_click_mask, 'abuse_reasons'] += '[Rapid_Click] '
+    _set_rule(cond_hits, rapid_click_mask, 'rapid_click')
     
     lower_bound = config['many_devices_per_ip']['threshold_devices']
     upper_bound = config['many_devices_per_ip']['carrier_ip_threshold']
     many_dvc_mask = df['dvc_count_per_ip'].between(lower_bound + 1, upper_bound)
-    df.loc[many_dvc_mask, 'abuse_score'] += config['many_devices_per_ip']['score']; df.loc[many_dvc_mask, 'abuse_reasons'] += '[Many_Devices_Per_IP] '
+    _set_rule(cond_hits, many_dvc_mask, 'many_devices_per_ip')
     many_ip_mask = df['ip_count_per_dvc'] > config['many_ips_per_device']['threshold_ips']
-    df.loc[many_ip_mask, 'abuse_score'] += config['many_ips_per_device']['score']; df.loc[many_ip_mask, 'abuse_reasons'] += '[Many_IPs_Per_Device] '
-    aws_abuse_mask = (df['is_aws']) & (df['abuse_score'] > 0)
-    df.loc[aws_abuse_mask, 'abuse_score'] += config['aws_ip']['score']; df.loc[aws_abuse_mask, 'abuse_reasons'] += '[AWS_IP_Used] '
-    
-    if analysis_type == 'conversion' and ctit_anomaly_model:
-        device_ctit_features = df.dropna(subset=['ctit']).groupby('dvc_idx')['ctit'].agg(
-            ['mean', 'std', 'median', 'count', 'min', 'max']
-        ).dropna()
-        device_ctit_features = device_ctit_features[device_ctit_features['count'] >= 3]
-        if not device_ctit_features.empty:
-            predictions = ctit_anomaly_model.predict(device_ctit_features)
-            anomalous_ctit_dvc_ids = device_ctit_features.index[predictions == -1]
-            ctit_model_mask = df['dvc_idx'].isin(anomalous_ctit_dvc_ids)
-            df.loc[ctit_model_mask, 'abuse_score'] += config['ctit_anomaly_model']['score']
-            df.loc[ctit_model_mask, 'abuse_reasons'] += '[CTIT_Anomaly_Model] '
-
-    if 'aws_abuse_mask' in locals() and 'early_hour_mask' in locals():
-        combo_stealth_bot_mask = aws_abuse_mask & early_hour_mask
-        df.loc[combo_stealth_bot_mask, 'abuse_score'] += config['combo_stealth_bot']['score']
-        df.loc[combo_stealth_bot_mask, 'abuse_reasons'] += '[Combo_Stealth_Bot] '
-
-    if 'media_concentration_mask' in locals() and 'many_ip_mask' in locals():
-        combo_focused_fraud_mask = media_concentration_mask & many_ip_mask
-        df.loc[combo_focused_fraud_mask, 'abuse_score'] += config['combo_focused_fraud']['score']
-        df.loc[combo_focused_fraud_mask, 'abuse_reasons'] += '[Combo_Focused_Fraud] '
+    _set_rule(cond_hits, many_ip_mask, 'many_ips_per_device')
+    # AWS 규칙은 앞선 규칙 점수가 있는 이벤트에서만 적중합니다 (score_rule_hits의 게이트 참고)
+    aws_mask = df['is_aws']
+    _set_rule(cond_hits, aws_mask, 'aws_ip')
+    
+    if analysis_type == 'conversion' and 'ctit_anomaly_model_flag' in device_features:
+        _set_rule(cond_hits, device_features['ctit_anomaly_model_flag'].to_numpy()[dvc_codes], 'ctit_anomaly_model')
+        df['ctit_anomaly_model_score'] = device_features['ctit_anomaly_model_score'].to_numpy()[dvc_codes]
+
+    if analysis_type == 'conversion':
+        combo_stealth_bot_mask = aws_mask & early_hour_mask
+        _set_rule(cond_hits, combo_stealth_bot_mask, 'combo_stealth_bot')
 
+    combo_focused_fraud_mask = media_concentration_mask & many_ip_mask
+    _set_rule(cond_hits, combo_focused_fraud_mask, 'combo_focused_fraud')
+
+    # 링 규칙: 여러 디바이스가 여러 IP를 돌려 쓰며 촘촘히 얽힌 연결 요소 (한 홉짜리 IP 규칙이 못 보는 조직형 어뷰징)
+    df['ring_size'] = rings['ring_size']
+    df['ring_density'] = rings['ring_density']
+    ring = config['fraud_ring']
+    fraud_ring_mask = (rings['ring_size'] >= ring['threshold_devices']) & (rings['ring_ip_count'] >= ring['threshold_ips']) & (rings['ring_density'] >= ring['threshold_density'])
+    _set_rule(cond_hits, fraud_ring_mask, 'fraud_ring')
+
+    # 점수와 무관한 조건 비트마스크를 남겨 두면 점수만 바뀔 때 RuleHitMatrix로 즉시 재계산할 수 있습니다.
+    df['rule_conditions'] = cond_hits
+    with profile_stage('score_rule_hits', len(df)):
+        df['abuse_score'], df['rule_hits'] = score_rule_hits(cond_hits, config)
+    if lean_memory_from(config):
+        # 규칙 판정이 끝난 뒤에 줄이므로 판정은 원래 정밀도 그대로입니다.
+        for column in LEAN_HELPER_COLUMNS:
+            if column in df:
+                df[column] = _compact(df[column])
     return df
 
 # ▼▼▼ get_blocklist 함수 수정 ▼▼▼
-def get_blocklist(df_scored, name=""):
-    method = CONFIG.get('blocklist_method', 'percentile')
+def blocklist_threshold(score_sketch, config=None):
+    """
+    디바이스 점수 분위수 스케치(sketches.QuantileSketch)로 제재 커트라인 점수를 구합니다.
+    날짜/파티션/워커별 디바이스 점수 스케치를 merge()로 합쳐 넘기면, 모든 점수를 모으지 않고도 전역 커트라인을 얻습니다.
+    잘못된 방식이거나 점수가 없으면 None입니다.
+    """
+    config = config or CONFIG
+    method = config.get('blocklist_method', 'percentile')
+    if method == 'percentile':
+        return score_sketch.quantile(config['blocklist_percentile']) if score_sketch.count else None
+    if method == 'absolute':
+        return config['absolute_score_threshold']
+    return None
+
+@profiled('get_blocklist')
+def get_blocklist(df_scored, name="", config=None, score_sketch=None):
+    """
+    디바이스별 최고 점수가 커트라인 이상인 디바이스를 제재 리스트로 뽑습니다.
+    score_sketch를 주면 percentile 커트라인을 df_scored 대신 그 스케치(다른 파티션까지 합친 전역 분포)로 계산합니다.
+    반환값: (제재 디바이스 리스트, 디바이스별 최고 점수 Series, 커트라인 점수 또는 None)
+    """
+    config = config or CONFIG
+    method = config.get('blocklist_method', 'percentile')
     
     if df_scored.empty:
         print(f"--- [{name}] 분석 대상 데이터가 없어 건너뜁니다. ---")
-        return [], pd.Series() # 빈 리스트와 빈 Series 반환
+        return [], pd.Series(), None # 빈 리스트와 빈 Series 반환
         
     high_score_events = df_scored[df_scored['abuse_score'] > 0]
     device_scores = high_score_events.groupby('dvc_idx')['abuse_score'].max()
     
     if not device_scores.empty:
+        if method not in ('percentile', 'absolute'):
+            print(f"--- [{name}] 잘못된 threshold 방식입니다. 'percentile' 또는 'absolute'를 사용하세요. ---")
+            return [], device_scores, None
+        if score_sketch is None:
+            score_sketch = QuantileSketch.from_values(device_scores)
+        threshold = blocklist_threshold(score_sketch, config)
         if method == 'percentile':
-            percentile = CONFIG['blocklist_percentile']
-            threshold = device_scores.quantile(percentile)
+            percentile = config['blocklist_percentile']
             print(f"--- [{name}] 상위 {(1-percentile)*100:.1f}% 커트라인 점수(상대): {threshold:.2f} ---")
-        elif method == 'absolute':
-            threshold = CONFIG['absolute_score_threshold']
-            print(f"--- [{name}] 커트라인 점수(절대): {threshold:.2f} ---")
         else:
-            print(f"--- [{name}] 잘못된 threshold 방식입니다. 'percentile' 또는 'absolute'를 사용하세요. ---")
-            return [], device_scores
+            print(f"--- [{name}] 커트라인 점수(절대): {threshold:.2f} ---")
             
         abusive_devices = device_scores[device_scores >= threshold]
-        return abusive_devices.index.tolist(), device_scores # 리스트와 함께 device_scores도 반환
+        return abusive_devices.index.tolist(), device_scores, threshold # 리스트, device_scores와 함께 커트라인도 반환
     else:
-        return [], pd.Series()
+        return [], pd.Series(), None
+
+MODEL_FILES = {'anomaly_model': 'isolation_forest_model.joblib', 'ctit_anomaly_model': 'ctit_anomaly_model.joblib'}
+
+def load_detection_models(model_dir=None):
+    """
+    model_dir(없으면 현재 작업 디렉터리)의 모델 파일을 {'anomaly_model': ..., 'ctit_anomaly_model': ...}로 읽습니다.
+    파일이 없는 모델은 None이며, 모델은 프로세스당 한 번만 읽습니다 (model_server.load_model).
+    """
+    return {name: load_optional_model(os.path.join(model_dir or '', filename)) for name, filename in MODEL_FILES.items()}
 
-def run_detection(ads_rwd_info, ads_list, ip_cache_data, config):
+def run_detection(ads_rwd_info, ads_list, ip_cache_data, config, n_workers=None, ip_ranges=None, profile_path=None, model_dir=None):
     """
     전체 어뷰징 탐지 프로세스를 실행합니다.
+    ads_rwd_info에는 DataFrame 대신 로그 파일 경로(CSV/Parquet/Arrow IPC)를 줄 수 있으며, 이 경우 명시 스키마로 읽습니다.
+    profile_path를 주면 단계/규칙/모델별 성능 프로파일을 JSON(.prom이면 Prometheus 텍스트)으로 저장합니다.
+    모델 파일은 model_dir(없으면 현재 작업 디렉터리)에서 찾습니다.
     """
+    if profile_path is not None:
+        with collect_profile(active_profile()) as profile:
+            result = run_detection(ads_rwd_info, ads_list, ip_cache_data, config, n_workers, ip_ranges, model_dir=model_dir)
+        profile.save(profile_path)
+        print(f"✅ 성능 프로파일 저장: {profile_path}")
+        return result
+    if isinstance(ads_rwd_info, (str, os.PathLike)):
+        ads_rwd_info = read_events(ads_rwd_info)
     print("--- 0단계: 데이터 준비 ---")
     
-    # 모델 로딩
-    try:
-        anomaly_model = joblib.load('isolation_forest_model.joblib')
-        print("✅ 이상 탐지 모델 로딩 완료.")
-    except FileNotFoundError:
-        anomaly_model = None
-        print("⚠️ 이상 탐지 모델 파일을 찾을 수 없습니다.")
-    
-    try:
-        ctit_anomaly_model = joblib.load('ctit_anomaly_model.joblib')
-        print("✅ CTIT 이상 탐지 모델 로딩 완료.")
-    except FileNotFoundError:
-        ctit_anomaly_model = None
-        print("⚠️ CTIT 이상 탐지 모델 파일을 찾을 수 없습니다.")
+    # 모델 로딩 (프로세스당 한 번, 같은 파일이면 다시 읽지 않음)
+    models = load_detection_models(model_dir)
+    anomaly_model, ctit_anomaly_model = models['anomaly_model'], models['ctit_anomaly_model']
+    print("✅ 이상 탐지 모델 로딩 완료." if anomaly_model else "⚠️ 이상 탐지 모델 파일을 찾을 수 없습니다.")
+    print("✅ CTIT 이상 탐지 모델 로딩 완료." if ctit_anomaly_model else "⚠️ CTIT 이상 탐지 모델 파일을 찾을 수 없습니다.")
     
     # 데이터 준비
-    df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(ads_rwd_info, ads_list, ip_cache_data, config)
+    df_original, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(ads_rwd_info, ads_list, ip_cache_data, config, ip_ranges)
+    del ads_rwd_info
+    if not lean_memory_from(config):
+        df_original = None  # 분리된 두 프레임만 쓰므로 원본은 바로 놓아 줍니다
     
     print("✅ 데이터 준비 및 정제 완료.")
     print(f"df_complete 크기: {df_complete.shape}, df_incomplete 크기: {df_incomplete.shape}")
     
     print("\n--- 2단계: 분석 실행 ---")
-    df_complete_scored = calculate_abuse_scores(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config)
-    df_incomplete_scored = calculate_abuse_scores(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config)
+    score = calculate_abuse_scores
+    if n_workers and n_workers > 1:
+        # 디바이스 샤드 단위 프로세스 풀 채점 (결과는 직렬 경로와 동일)
+        from parallel import calculate_abuse_scores_parallel
+        score = partial(calculate_abuse_scores_parallel, n_workers=n_workers)
+    df_complete_scored = score(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config)
+    df_incomplete_scored = score(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config)
     
     print("\n--- 3단계: 결과 추출 ---")
     # 통합된 데이터 전체에서 제재 대상을 한 번에 추출
-    all_scored_df = pd.concat([df_complete_scored, df_incomplete_scored], ignore_index=True)
-    final_block_list, device_scores = get_blocklist(all_scored_df, "통합 어뷰징")
+    del df_complete, df_incomplete
+    all_scored_df = assemble_scored([df_complete_scored, df_incomplete_scored], df_original)
+    del df_complete_scored, df_incomplete_scored
+    final_block_list, device_scores, _ = get_blocklist(all_scored_df, "통합 어뷰징", config)
     
     print(f"\n✅ 최종 통합 제재 디바이스: {len(final_block_list)}개")
     
@@ -0,0 +1,367 @@
+# 파일 이름: duckdb_backend.py
+
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from detector import (
+    ADS_COLUMNS, CONFIG, RULE_BITS, ads_lookup, add_model_flags, calculate_abuse_scores, get_blocklist, prepare_data,
+    score_rule_hits, sketch_error_from,
+)
+from fraud_rings import ring_feature_table
+from ingest import _file_format
+from ip_ranges import classify_ips
+from profiling import profile_stage
+
+# --- DuckDB 실행 백엔드 ---
+# prepare_data()/calculate_abuse_scores()와 같은 CONFIG 규칙을 내장 DuckDB 쿼리로 실행합니다.
+# 이벤트 단위 작업(Burst 윈도우, 디바이스/IP/매체 집계, 규칙 마스크, 점수, 커트라인)은 모두 SQL이라
+# 로그 파일을 직접 읽고, 모든 코어를 쓰며, memory_limit를 넘는 중간 결과는 temp_directory로 흘려 씁니다.
+# 판다스로 가져오는 것은 디바이스 단위 표(모델 입력, 링 간선)와 고유 IP/규칙 패턴처럼 작은 표뿐입니다.
+REQUIRED_COLUMNS = ('ads_idx', 'mda_idx', 'dvc_idx', 'user_ip', 'click_date', 'done_date', 'ctit')
+
+def _sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _sql_number(value):
+    """CONFIG 값을 SQL 숫자 리터럴로 바꿉니다. 실수는 DECIMAL이 아닌 DOUBLE로 비교되도록 캐스팅합니다."""
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    return f"CAST({float(value)!r} AS DOUBLE)"
+
+def connect(database=':memory:', threads=None, memory_limit=None, temp_directory=None):
+    """
+    탐지용 DuckDB 연결을 엽니다. threads를 주지 않으면 DuckDB 기본값(모든 코어)을 씁니다.
+    memory_limit(예: '4GB')를 넘는 정렬/집계/윈도우 중간 결과는 temp_directory에 흘려 씁니다.
+    """
+    con = duckdb.connect(database)
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit:
+        con.execute(f"SET memory_limit = {_sql_string(memory_limit)}")
+    if temp_directory:
+        con.execute(f"SET temp_directory = {_sql_string(temp_directory)}")
+    # 결과 행 순서를 지키지 않아야 큰 중간 결과를 스레드별로 나눠 흘려 쓸 수 있습니다 (행 순서는 어디에도 쓰지 않습니다).
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+def _source_relation(con, source):
+    """
+    로그를 DuckDB가 스캔할 관계식으로 바꿉니다. 결과에는 원본 행 순서를 나타내는 '__pos' 컬럼이 붙습니다.
+    판다스 경로는 같은 시각의 클릭을 원본 행 순서로 정렬하므로, 클릭 간격을 같은 이벤트에 매기려면 이 순서가 필요합니다.
+    Parquet 파일(또는 파일 목록)은 DuckDB가 직접 읽고 파일 안 행 번호로 순서를 매깁니다.
+    CSV, DataFrame, Arrow IPC(메모리 맵)는 행 번호를 줄 수 없어 입력 순서를 지키며 임시 테이블로 한 번 옮깁니다.
+    """
+    if isinstance(source, pd.DataFrame):
+        con.register('raw_source', source)
+        relation = 'raw_source'
+    else:
+        paths = [os.fspath(source)] if isinstance(source, (str, os.PathLike)) else [os.fspath(path) for path in source]
+        file_format = _file_format(paths[0])
+        if file_format == 'parquet':
+            return '(' + ' UNION ALL BY NAME '.join(
+                f"(SELECT * EXCLUDE (file_row_number), {i << 40} + file_row_number AS __pos FROM read_parquet({_sql_string(path)}, file_row_number = true))"
+                for i, path in enumerate(paths)
+            ) + ')'
+        if file_format == 'csv':
+            relation = f"read_csv([{', '.join(_sql_string(path) for path in paths)}], header = true, union_by_name = true)"
+        else:
+            import pyarrow as pa
+            import pyarrow.ipc as pa_ipc
+            tables = [pa_ipc.open_file(pa.memory_map(path)).read_all() for path in paths]
+            con.register('raw_source', pa.concat_tables(tables, promote_options='default'))
+            relation = 'raw_source'
+    con.execute("SET preserve_insertion_order = true")
+    try:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE raw_log AS SELECT * FROM {relation}")
+    finally:
+        con.execute("SET preserve_insertion_order = false")
+    return "(SELECT *, rowid AS __pos FROM raw_log)"
+
+def load_events(con, source, ads_list, ip_cache_data=None, config=None, ip_ranges=None):
+    """
+    prepare_data()의 전처리와 Burst 윈도우를 쿼리 하나로 실행해 'events' 테이블을 만듭니다.
+    (IP 분류, 광고 정보 병합, dvc_idx 정제, 날짜 변환, 윈도우별 클릭 수, 전환 분석 대상 여부, 디바이스 내 클릭 간격)
+    IP 분류는 고유 IP만 판다스로 가져와 classify_ips()로 한 번씩 합니다.
+    반환값: 이벤트 수
+    """
+    config = config or CONFIG
+    relation = _source_relation(con, source)
+    columns = set(con.sql(f"SELECT * FROM {relation} LIMIT 0").columns)
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"로그에 필요한 컬럼이 없습니다: {', '.join(missing)}")
+
+    with profile_stage('duckdb:classify_ips') as stage:
+        ips = con.sql(f"SELECT DISTINCT CAST(user_ip AS VARCHAR) AS user_ip FROM {relation} WHERE user_ip IS NOT NULL").df()['user_ip']
+        hostnames, is_aws = classify_ips(ips, ip_cache_data, ip_ranges)
+        con.register('ip_classes', pd.DataFrame({'user_ip': ips.to_numpy(dtype=object), 'hostname': hostnames, 'is_aws': is_aws}))
+        stage.rows_out = len(ips)
+    ads_join = config.get('ads_join', {})
+    if ads_join.get('legacy_inflation', False):
+        ads = ads_list[['ads_idx'] + ADS_COLUMNS]  # 원본처럼 중복 ads_idx만큼 행이 늘어납니다
+    else:
+        ads = ads_lookup(ads_list, ads_join.get('keep', 'first')).reset_index()
+    con.register('ads', ads.assign(__ads_pos=np.arange(len(ads))))
+
+    window_min = config['burst_attack']['window_min']
+    windows = sorted(set(config['burst_attack'].get('windows_min', [])) | {window_min})
+    # (t - N분, t] 구간: 정수 나노초 순서 키에서 N분보다 1ns 짧게 거슬러 올라가면 왼쪽 끝이 빠집니다. 같은 시각의 클릭은 모두 셉니다.
+    window_columns = ''.join(
+        f",\n            CAST(CASE WHEN click_date IS NULL THEN 1 ELSE count(*) OVER (PARTITION BY dvc_idx ORDER BY epoch_ns(click_date)"
+        f" RANGE BETWEEN {int(minutes * 60 * 1_000_000_000) - 1} PRECEDING AND CURRENT ROW) END AS INTEGER) AS clicks_in_{minutes}min"
+        for minutes in windows
+    )
+    with profile_stage('duckdb:events') as stage:
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE events AS
+        WITH prepared AS (
+            SELECT r.* REPLACE (
+                    CAST(trunc(TRY_CAST(r.dvc_idx AS DOUBLE)) AS BIGINT) AS dvc_idx,
+                    CAST(r.user_ip AS VARCHAR) AS user_ip,
+                    TRY_CAST(r.click_date AS TIMESTAMP_NS) AS click_date,
+                    TRY_CAST(r.done_date AS TIMESTAMP_NS) AS done_date,
+                    TRY_CAST(r.ctit AS DOUBLE) AS ctit
+                ),
+                {', '.join(f'a.{column}' for column in ADS_COLUMNS)}, a.__ads_pos,
+                coalesce(i.hostname, 'N/A') AS hostname,
+                coalesce(i.is_aws, false) AS is_aws
+            FROM {relation} r
+            LEFT JOIN ads a ON CAST(r.ads_idx AS BIGINT) = CAST(a.ads_idx AS BIGINT)
+            LEFT JOIN ip_classes i ON CAST(r.user_ip AS VARCHAR) = i.user_ip
+            WHERE coalesce(trunc(TRY_CAST(r.dvc_idx AS DOUBLE)), 0) <> 0
+        ),
+        split AS (
+            SELECT *, (ctit IS NOT NULL AND user_ip IS NOT NULL) AS is_complete FROM prepared
+        ),
+        windowed AS (
+            SELECT *{window_columns},
+                -- 분석 유형(전환/클릭)마다 따로 정렬한 디바이스 내 직전 클릭과의 간격(초). 첫 클릭과 시각이 없는 클릭은 NULL이며, 같은 시각은 원본 행 순서를 따릅니다.
+                CAST(epoch_ns(click_date) - lag(epoch_ns(click_date)) OVER (PARTITION BY is_complete, dvc_idx ORDER BY click_date NULLS LAST, __pos, __ads_pos) AS DOUBLE) / 1e9 AS time_diff_sec
+            FROM split
+        )
+        SELECT * EXCLUDE (__ads_pos), clicks_in_{window_min}min AS clicks_in_Nmin FROM windowed
+        """)
+        con.execute("DROP TABLE IF EXISTS raw_log")
+        rows = con.sql("SELECT count(*) FROM events").fetchone()[0]
+        stage.rows_out = rows
+    return rows
+
+def build_feature_tables(con, config=None, anomaly_model=None, ctit_anomaly_model=None):
+    """
+    'events'에서 build_feature_tables()/count_mda_clicks()와 같은 집계를 분석 유형(is_complete)별로 만듭니다.
+      mda_stats(mda_idx, clicks, cvr), devices(is_complete, dvc_idx, ...), ips(is_complete, user_ip, dvc_count),
+      rings(is_complete, dvc_idx, ring_size, ring_ip_count, ring_density), model_flags(is_complete, dvc_idx, ...)
+    링(연결 요소)과 이상 탐지 모델은 판다스 쪽에서 계산하되, 링은 링을 잇는 IP의 고유 (디바이스, IP) 쌍만,
+    모델은 디바이스 피쳐 표만 가져옵니다.
+    """
+    config = config or CONFIG
+    with_medians = anomaly_model is not None or ctit_anomaly_model is not None
+    order_stats = ''.join(
+        f", median({source}) AS {prefix}_median, min({source}) AS {prefix}_min, max({source}) AS {prefix}_max"
+        for prefix, source in (('interval', 'time_diff_sec'), ('ctit', 'ctit'))
+    ) if with_medians else ''
+    with profile_stage('duckdb:features'):
+        con.execute("""
+        CREATE OR REPLACE TEMP TABLE mda_stats AS
+        SELECT mda_idx, count(*) AS clicks, count(done_date) / count(*) AS cvr FROM events WHERE mda_idx IS NOT NULL GROUP BY mda_idx
+        """)
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE devices AS
+        SELECT is_complete, dvc_idx, count(*) AS total_clicks,
+            count(DISTINCT user_ip) AS ip_count, count(DISTINCT mda_idx) AS mda_count,
+            count(time_diff_sec) AS interval_count, avg(time_diff_sec) AS interval_mean, stddev_samp(time_diff_sec) AS interval_std,
+            count(ctit) AS ctit_count, avg(ctit) AS ctit_mean, stddev_samp(ctit) AS ctit_std{order_stats}
+        FROM events GROUP BY is_complete, dvc_idx
+        """)
+        con.execute("""
+        CREATE OR REPLACE TEMP TABLE ips AS
+        SELECT is_complete, user_ip, count(DISTINCT dvc_idx) AS dvc_count FROM events WHERE user_ip IS NOT NULL GROUP BY is_complete, user_ip
+        """)
+
+    max_ip_devices = int(config['fraud_ring']['max_ip_devices'])
+    rings, flags = [], []
+    for is_complete, analysis_type in ((True, 'conversion'), (False, 'click')):
+        with profile_stage(f'duckdb:rings:{analysis_type}') as stage:
+            pairs = con.execute(f"""
+            SELECT DISTINCT e.dvc_idx, e.user_ip FROM events e JOIN ips i USING (is_complete, user_ip)
+            WHERE e.is_complete = ? AND i.dvc_count BETWEEN 2 AND {max_ip_devices}
+            """, [is_complete]).df()
+            ring = ring_feature_table(pairs['dvc_idx'], pairs['user_ip'], max_ip_devices).reset_index()
+            rings.append(ring.assign(is_complete=is_complete))
+            stage.rows_out = len(pairs)
+        if (analysis_type == 'click' and anomaly_model) or (analysis_type == 'conversion' and ctit_anomaly_model):
+            device_features = con.execute("SELECT * EXCLUDE (is_complete) FROM devices WHERE is_complete = ?", [is_complete]).df().set_index('dvc_idx')
+            device_features = add_model_flags(device_features, analysis_type, anomaly_model, ctit_anomaly_model)
+            model_columns = [column for column in device_features if column.endswith(('_model_flag', '_model_score'))]
+            flags.append(device_features[model_columns].reset_index().assign(is_complete=is_complete))
+    con.register('rings', pd.concat(rings, ignore_index=True))
+    model_flags = pd.concat(flags, ignore_index=True) if flags else pd.DataFrame({'is_complete': pd.Series(dtype=bool), 'dvc_idx': pd.Series(dtype=np.int64)})
+    for column, dtype in (('anomaly_model_flag', bool), ('anomaly_model_score', float), ('ctit_anomaly_model_flag', bool), ('ctit_anomaly_model_score', float)):
+        if column not in model_flags:
+            model_flags[column] = pd.Series(dtype=dtype)
+    con.register('model_flags', model_flags)
+
+def rule_conditions_sql(config):
+    """calculate_abuse_scores()의 규칙 조건을 CONFIG 값으로 채운 SQL 비트마스크 식으로 만듭니다 (NULL 비교는 거짓)."""
+    early_hour = f"hour(e.click_date) BETWEEN {_sql_number(config['suspicious_early_hour']['start_hour'])} AND {_sql_number(config['suspicious_early_hour']['end_hour'])}"
+    media_concentration = f"d.total_clicks > {_sql_number(config['media_concentration']['threshold_clicks'])} AND d.mda_count < {_sql_number(config['media_concentration']['threshold_mda'])}"
+    many_ips = f"d.ip_count > {_sql_number(config['many_ips_per_device']['threshold_ips'])}"
+    ring = config['fraud_ring']
+    conditions = {
+        'burst_attack': f"e.clicks_in_Nmin > {_sql_number(config['burst_attack']['threshold_clicks'])}",
+        'media_concentration': media_concentration,
+        'abnormal_cvr': f"m.cvr > {_sql_number(config['abnormal_cvr']['threshold_cvr'])} AND m.clicks > {_sql_number(config['abnormal_cvr']['threshold_clicks'])}",
+        'short_ctit': f"e.is_complete AND e.ctit < {_sql_number(config['short_ctit']['threshold_sec'])}",
+        'suspicious_early_hour': f"e.is_complete AND {early_hour} AND (e.time_diff_sec < 2 OR e.ctit < 10)",
+        'consistent_ctit': f"e.is_complete AND coalesce(d.ctit_std, 0) < {_sql_number(config['consistent_ctit']['threshold_std'])} AND d.total_clicks > {_sql_number(config['consistent_ctit']['threshold_clicks'])}",
+        'fraud_long_ctit': f"e.is_complete AND e.ctit > {_sql_number(config['fraud_long_ctit']['threshold_sec'])}",
+        'suspicious_single_conv': f"e.is_complete AND d.total_clicks = 1 AND {early_hour}",
+        'heavy_click_spam': f"NOT e.is_complete AND d.total_clicks > {_sql_number(config['heavy_click_spam']['threshold_clicks'])}",
+        'anomaly_model': "NOT e.is_complete AND f.anomaly_model_flag",
+        'rapid_click': f"e.time_diff_sec < {_sql_number(config['rapid_click']['threshold_sec'])}",
+        'many_devices_per_ip': f"i.dvc_count BETWEEN {_sql_number(config['many_devices_per_ip']['threshold_devices'])} + 1 AND {_sql_number(config['many_devices_per_ip']['carrier_ip_threshold'])}",
+        'many_ips_per_device': many_ips,
+        'aws_ip': "e.is_aws",
+        'ctit_anomaly_model': "e.is_complete AND f.ctit_anomaly_model_flag",
+        'combo_stealth_bot': f"e.is_complete AND e.is_aws AND {early_hour}",
+        'combo_focused_fraud': f"({media_concentration}) AND {many_ips}",
+        'fraud_ring': f"coalesce(r.ring_size, 1) >= {_sql_number(ring['threshold_devices'])} AND coalesce(r.ring_ip_count, 0) >= {_sql_number(ring['threshold_ips'])}"
+                      f" AND coalesce(r.ring_density, 0.0) >= {_sql_number(ring['threshold_density'])}",
+    }
+    return ' | '.join(f"CASE WHEN coalesce({condition}, false) THEN {1 << RULE_BITS[rule]} ELSE 0 END" for rule, condition in conditions.items())
+
+def score_events(con, config=None):
+    """
+    'events'와 집계 테이블을 이어 붙여 규칙 조건 비트마스크를 계산한 'scored' 테이블을 만들고, 'events'는 지웁니다.
+    점수는 서로 다른 비트마스크(보통 수백 개 이하)만 가져와 score_rule_hits()로 계산한 'rule_scores' 표를 조인해 붙입니다.
+    반환값: 점수까지 붙인 채점 이벤트를 읽는 SELECT 문
+    """
+    config = config or CONFIG
+    if sketch_error_from(config) is not None:
+        raise ValueError("DuckDB 백엔드는 정확 집계만 지원합니다. cardinality_sketch를 끄고 실행하세요.")
+    with profile_stage('duckdb:rule_conditions') as stage:
+        con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE scored AS
+        SELECT e.* EXCLUDE (is_complete, __pos),
+            i.dvc_count AS dvc_count_per_ip, d.ip_count AS ip_count_per_dvc, d.total_clicks AS total_clicks_per_dvc,
+            hour(e.click_date) AS click_hour, d.mda_count AS unique_mda_count, m.cvr AS mda_cvr,
+            CASE WHEN e.is_complete THEN coalesce(d.interval_std, 0) END AS click_interval_std,
+            CASE WHEN e.is_complete THEN coalesce(d.ctit_std, 0) END AS ctit_std,
+            f.anomaly_model_score, f.ctit_anomaly_model_score,
+            coalesce(r.ring_size, 1) AS ring_size, coalesce(r.ring_density, 0.0) AS ring_density,
+            CAST({rule_conditions_sql(config)} AS UINTEGER) AS rule_conditions
+        FROM events e
+        JOIN devices d USING (is_complete, dvc_idx)
+        LEFT JOIN ips i USING (is_complete, user_ip)
+        LEFT JOIN mda_stats m USING (mda_idx)
+        LEFT JOIN rings r USING (is_complete, dvc_idx)
+        LEFT JOIN model_flags f USING (is_complete, dvc_idx)
+        """)
+        con.execute("DROP TABLE events")
+        stage.rows_out = con.sql("SELECT count(*) FROM scored").fetchone()[0]
+    with profile_stage('duckdb:score_rule_hits') as stage:
+        patterns = con.sql("SELECT DISTINCT rule_conditions FROM scored").df()['rule_conditions'].to_numpy(dtype=np.uint32)
+        scores, hits = score_rule_hits(patterns, config)
+        con.register('rule_scores', pd.DataFrame({'rule_conditions': patterns, 'abuse_score': scores.astype(np.int64), 'rule_hits': hits}))
+        stage.rows_out = len(patterns)
+    return "SELECT s.*, p.abuse_score, p.rule_hits FROM scored s JOIN rule_scores p USING (rule_conditions)"
+
+def blocklist_from_scored(con, scored_sql, name="", config=None):
+    """
+    get_blocklist()와 같은 제재 리스트를 쿼리로 뽑습니다 (디바이스별 최고 점수와 percentile 커트라인 모두 DuckDB에서 계산).
+    percentile 커트라인은 quantile_cont(선형 보간)이라 pandas Series.quantile()과 같습니다.
+    반환값: (제재 디바이스 리스트, 디바이스별 최고 점수 Series, 커트라인 점수 또는 None)
+    """
+    config = config or CONFIG
+    method = config.get('blocklist_method', 'percentile')
+    with profile_stage('duckdb:device_scores') as stage:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE device_scores AS SELECT dvc_idx, max(abuse_score) AS abuse_score FROM ({scored_sql}) WHERE abuse_score > 0 GROUP BY dvc_idx")
+        device_scores = con.sql("SELECT dvc_idx, abuse_score FROM device_scores ORDER BY dvc_idx").df().set_index('dvc_idx')['abuse_score']
+        stage.rows_out = len(device_scores)
+    if device_scores.empty:
+        print(f"--- [{name}] 분석 대상 데이터가 없어 건너뜁니다. ---")
+        return [], device_scores, None
+    if method == 'percentile':
+        percentile = config['blocklist_percentile']
+        threshold = con.execute("SELECT quantile_cont(abuse_score, ?) FROM device_scores", [float(percentile)]).fetchone()[0]
+        print(f"--- [{name}] 상위 {(1-percentile)*100:.1f}% 커트라인 점수(상대): {threshold:.2f} ---")
+    elif method == 'absolute':
+        threshold = config['absolute_score_threshold']
+        print(f"--- [{name}] 커트라인 점수(절대): {threshold:.2f} ---")
+    else:
+        print(f"--- [{name}] 잘못된 threshold 방식입니다. 'percentile' 또는 'absolute'를 사용하세요. ---")
+        return [], device_scores, None
+    return device_scores[device_scores >= threshold].index.tolist(), device_scores, threshold
+
+def run_duckdb_detection(source, ads_list, ip_cache_data, config=None, anomaly_model=None, ctit_anomaly_model=None, output_path=None, ip_ranges=None,
+                         database=':memory:', threads=None, memory_limit=None, temp_directory=None):
+    """
+    로그(DataFrame, 또는 Parquet/CSV/Arrow 파일 경로나 경로 목록)를 DuckDB 백엔드로 탐지합니다. 규칙과 점수는 배치 경로와 같습니다.
+    output_path를 주면 채점된 이벤트를 Parquet로 씁니다 (어느 규칙도 읽지 않는 dynamic_consistency_threshold는 만들지 않습니다).
+    반환값: (최종 제재 디바이스 리스트, 디바이스별 최고 점수 Series)
+    """
+    config = config or CONFIG
+    con = connect(database, threads, memory_limit, temp_directory)
+    try:
+        print("--- 1단계: 전처리와 Burst 윈도우 (DuckDB) ---")
+        rows = load_events(con, source, ads_list, ip_cache_data, config, ip_ranges)
+        print(f"✅ 이벤트 {rows:,}건 준비 완료.")
+        print("--- 2단계: 디바이스/IP/매체 집계, 링, 모델 ---")
+        build_feature_tables(con, config, anomaly_model, ctit_anomaly_model)
+        print("--- 3단계: 규칙 적용과 채점 ---")
+        scored_sql = score_events(con, config)
+        if output_path is not None:
+            with profile_stage('duckdb:write_scored'):
+                con.execute(f"COPY ({scored_sql}) TO {_sql_string(os.fspath(output_path))} (FORMAT parquet)")
+            print(f"✅ 채점 결과 저장: {output_path}")
+        final_block_list, device_scores, _ = blocklist_from_scored(con, scored_sql, "DuckDB 통합", config)
+    finally:
+        con.close()
+    print(f"\n✅ 최종 통합 제재 디바이스: {len(final_block_list)}개")
+    return final_block_list, device_scores
+
+def check_duckdb_parity(ads_rwd_info, ads_list, ip_cache_data, config=None, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None, threads=None):
+    """
+    같은 로그를 판다스 배치 경로(prepare_data + calculate_abuse_scores + get_blocklist)와 DuckDB 백엔드로 채점해 비교합니다.
+    반환값: {'events': 비교한 이벤트 수, 'score_mismatches': 점수가 다른 이벤트 수, 'hit_mismatches': 적중 비트가 다른 이벤트 수,
+             'blocked': 판다스 제재 디바이스 수, 'blocklist_mismatches': 한쪽에만 있는 제재 디바이스 수, 'threshold_diff': 커트라인 차이}
+    """
+    config = config or CONFIG
+    log = ads_rwd_info.reset_index(drop=True)
+    log['_row'] = np.arange(len(log))
+
+    _, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(log.copy(), ads_list, ip_cache_data, config, ip_ranges)
+    batch = pd.concat([
+        calculate_abuse_scores(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config),
+        calculate_abuse_scores(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config),
+    ], ignore_index=True)
+    batch_blocked, _, batch_threshold = get_blocklist(batch, "판다스", config)
+
+    con = connect(threads=threads)
+    try:
+        load_events(con, log, ads_list, ip_cache_data, config, ip_ranges)
+        build_feature_tables(con, config, anomaly_model, ctit_anomaly_model)
+        scored_sql = score_events(con, config)
+        duck = con.sql(scored_sql).df()
+        duck_blocked, _, duck_threshold = blocklist_from_scored(con, scored_sql, "DuckDB", config)
+    finally:
+        con.close()
+
+    keys = ['_row', 'ads_type', 'ads_category', 'ads_name']
+    batch = batch.sort_values(keys, kind='stable', ignore_index=True)
+    duck = duck.sort_values(keys, kind='stable', ignore_index=True)
+    if len(batch) != len(duck):
+        raise AssertionError(f"이벤트 수가 다릅니다: 판다스 {len(batch)}건, DuckDB {len(duck)}건")
+    return {
+        'events': len(batch),
+        'score_mismatches': int((batch['abuse_score'].to_numpy() != duck['abuse_score'].to_numpy()).sum()),
+        'hit_mismatches': int((batch['rule_hits'].to_numpy() != duck['rule_hits'].to_numpy()).sum()),
+        'blocked': len(batch_blocked),
+        'blocklist_mismatches': len(set(batch_blocked) ^ set(duck_blocked)),
+        'threshold_diff': abs((batch_threshold or 0) - (duck_threshold or 0)),
+    }
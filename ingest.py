@@ -0,0 +1,154 @@
+# 파일 이름: ingest.py
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:  # pyarrow가 없으면 pandas 기본 CSV 경로만 사용합니다.
+    pa = None
+
+# --- 이벤트 로그(ads_rwd_info) 스키마 ---
+# ID는 int32(결측 허용 Int32), IP는 범주형, 날짜는 datetime64[ns], CTIT는 float64로 읽어 추론/재파싱 비용과 메모리를 줄입니다.
+ID_COLUMNS = ('ads_idx', 'mda_idx', 'dvc_idx')
+CATEGORY_COLUMNS = ('user_ip',)
+FLOAT_COLUMNS = ('ctit',)
+DATE_COLUMNS = ('click_date', 'done_date')
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+def _arrow_column_types(strict=True):
+    """
+    CSV 컬럼 타입. strict=False면 ID와 날짜를 문자열로 읽어 apply_event_schema()가 pandas 방식으로 변환하게 합니다
+    ('1.0' 같은 실수형 ID, int32를 넘는 ID, '2025/06/01' 형식이나 시간대가 붙은 날짜 등).
+    """
+    types = {column: pa.int32() if strict else pa.string() for column in ID_COLUMNS}
+    types.update({column: pa.dictionary(pa.int32(), pa.string()) for column in CATEGORY_COLUMNS})
+    types.update({column: pa.timestamp('ns') if strict else pa.string() for column in DATE_COLUMNS})
+    types.update({column: pa.float64() if strict else pa.string() for column in FLOAT_COLUMNS})
+    return types
+
+def _arrow_to_pandas(table):
+    """Arrow 테이블을 판다스로 옮깁니다. int32는 결측을 float로 바꾸지 않도록 Int32로 받습니다."""
+    return apply_event_schema(table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get))
+
+def _file_format(source, file_format=None):
+    if file_format:
+        return file_format
+    name = str(getattr(source, 'name', source)).lower()
+    if name.endswith(PARQUET_SUFFIXES):
+        return 'parquet'
+    if name.endswith(ARROW_SUFFIXES):
+        return 'arrow'
+    return 'csv'
+
+def apply_event_schema(df):
+    """
+    이벤트 로그 컬럼을 명시 스키마로 변환합니다 (없는 컬럼은 건너뜁니다).
+    int32 범위를 넘는 ID 컬럼은 값이 잘리지 않도록 Int64로 둡니다.
+    시간대가 붙은 날짜는 기록된 현지 시각 그대로 시간대만 뗍니다 (click_hour 규칙이 보는 시각이 바뀌지 않도록).
+    """
+    for column in ID_COLUMNS:
+        if column in df.columns and df[column].dtype != 'Int32':
+            values = pd.to_numeric(df[column], errors='coerce')
+            fits_int32 = values.dropna().between(np.iinfo(np.int32).min, np.iinfo(np.int32).max).all()
+            df[column] = values.astype('Int32' if fits_int32 else 'Int64')
+    for column in FLOAT_COLUMNS:
+        if column in df.columns and df[column].dtype != np.float64:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    for column in DATE_COLUMNS:
+        if column in df.columns and df[column].dtype != 'datetime64[ns]':
+            values = pd.to_datetime(df[column])
+            if isinstance(values.dtype, pd.DatetimeTZDtype):
+                values = values.dt.tz_localize(None)
+            df[column] = values.astype('datetime64[ns]')
+    return df
+
+def read_events(source, file_format=None):
+    """
+    이벤트 로그를 스키마에 맞춰 읽습니다. source는 경로 또는 업로드된 파일 객체입니다.
+    - Parquet / Arrow IPC(feather): 컬럼 타입을 그대로 읽고 스키마만 맞춥니다.
+    - CSV: pyarrow가 있으면 멀티스레드 CSV 파서로 타입을 지정해 읽고, 없으면 pandas로 읽은 뒤 변환합니다.
+      지정 타입으로 읽을 수 없는 값이 있으면 ID와 날짜를 문자열로 다시 읽어 pandas 경로와 같은 규칙으로 변환합니다.
+    """
+    file_format = _file_format(source, file_format)
+    if file_format == 'parquet':
+        return apply_event_schema(pd.read_parquet(source))
+    if file_format == 'arrow':
+        return apply_event_schema(pd.read_feather(source))
+    if pa is None:
+        return apply_event_schema(pd.read_csv(source))
+    start = source.tell() if hasattr(source, 'tell') else None
+    convert_options = pa_csv.ConvertOptions(column_types=_arrow_column_types(), strings_can_be_null=True)
+    try:
+        return _arrow_to_pandas(pa_csv.read_csv(source, convert_options=convert_options))
+    except pa.ArrowInvalid:
+        if start is not None:
+            source.seek(start)
+    convert_options = pa_csv.ConvertOptions(column_types=_arrow_column_types(strict=False), strings_can_be_null=True)
+    return _arrow_to_pandas(pa_csv.read_csv(source, convert_options=convert_options))
+
+def check_csv_coercion():
+    """
+    Arrow 지정 타입으로는 읽히지 않던 CSV 입력('2025/06/01' 날짜, '1.0' ID, '+09:00' 시간대, int32를 넘는 dvc_idx)을
+    read_events()가 pandas 경로(pd.read_csv + apply_event_schema)와 같은 값으로 읽는지 확인합니다.
+    반환값: {입력 이름: 일치 여부}
+    """
+    import io
+
+    header = "ads_idx,mda_idx,dvc_idx,user_ip,click_date,done_date,ctit\n"
+    cases = {
+        'slash_dates': "1,2,3,1.1.1.1,2025/06/01 12:00:00,2025/06/01 12:01:00,60\n",
+        'float_ids': "1.0,2.0,3.0,1.1.1.1,2025-06-01 12:00:00,,\n",
+        'tz_offsets': "1,2,3,1.1.1.1,2025-06-01 12:00:00+09:00,2025-06-01 12:01:00+09:00,60\n",
+        'int64_dvc_idx': "1,2,3000000000,1.1.1.1,2025-06-01 12:00:00,,\n",
+    }
+    results = {}
+    for name, row in cases.items():
+        data = (header + row).encode()
+        expected = apply_event_schema(pd.read_csv(io.BytesIO(data)))
+        actual = read_events(io.BytesIO(data))
+        results[name] = expected.astype({'user_ip': str}).equals(actual.astype({'user_ip': str}))
+    return results
+
+def iter_event_chunks(path, chunksize=500_000, **read_csv_kwargs):
+    """
+    click_date 오름차순으로 저장된 이벤트 로그를 스키마를 적용한 청크 단위로 읽습니다 (스트리밍 모드용).
+    CSV는 pandas 청크 리더를 쓰며, read_csv_kwargs는 CSV에만 적용됩니다.
+    """
+    file_format = _file_format(path)
+    if file_format == 'parquet':
+        for batch in pa_parquet.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield _arrow_to_pandas(pa.Table.from_batches([batch]))
+    elif file_format == 'arrow':
+        with pa.memory_map(os.fspath(path)) as source:
+            reader = pa_ipc.open_file(source)
+            batches, rows = [], 0
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= chunksize:
+                    yield _arrow_to_pandas(pa.Table.from_batches(batches))
+                    batches, rows = [], 0
+            if batches:
+                yield _arrow_to_pandas(pa.Table.from_batches(batches))
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+            yield apply_event_schema(chunk)
+
+def write_events(df, path):
+    """이벤트 로그를 확장자에 맞는 컬럼 포맷(Parquet 또는 Arrow IPC)으로 저장합니다. CSV 원본을 한 번 변환해 두는 용도입니다."""
+    df = apply_event_schema(df.copy())
+    if _file_format(path) == 'arrow':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_parquet(path, index=False)
@@ -0,0 +1,136 @@
+# 파일 이름: ip_ranges.py
+
+import ipaddress
+import json
+
+import numpy as np
+import pandas as pd
+
+# 역방향 DNS 호스트명으로 클라우드(AWS) IP를 판별할 때 쓰는 패턴
+CLOUD_HOSTNAME_PATTERN = 'amazonaws.com|AMAZON|AWS'
+
+def _iter_cidrs(data):
+    """
+    CIDR 표 JSON에서 프리픽스 문자열을 꺼냅니다. 다음 형식을 지원합니다.
+    - AWS ip-ranges.json 형식: {"prefixes": [{"ip_prefix": ...}], "ipv6_prefixes": [{"ipv6_prefix": ...}]}
+    - 제공자별 목록: {"aws": ["3.5.140.0/22", ...], "gcp": [...]}
+    - 프리픽스 목록: ["3.5.140.0/22", ...]
+    """
+    if isinstance(data, list):
+        for item in data:
+            yield item
+    elif 'prefixes' in data or 'ipv6_prefixes' in data:
+        for item in data.get('prefixes', []):
+            yield item['ip_prefix']
+        for item in data.get('ipv6_prefixes', []):
+            yield item['ipv6_prefix']
+    else:
+        for prefixes in data.values():
+            yield from _iter_cidrs(prefixes)
+
+def _merge_intervals(starts, ends):
+    """[start, end] 구간들을 정렬하고 겹치거나 맞닿은 구간을 합쳐, 시작/끝이 모두 오름차순인 구간 목록으로 만듭니다."""
+    if not starts:
+        return [], []
+    order = sorted(range(len(starts)), key=starts.__getitem__)
+    merged_starts, merged_ends = [starts[order[0]]], [ends[order[0]]]
+    for i in order[1:]:
+        if starts[i] <= merged_ends[-1] + 1:
+            merged_ends[-1] = max(merged_ends[-1], ends[i])
+        else:
+            merged_starts.append(starts[i])
+            merged_ends.append(ends[i])
+    return merged_starts, merged_ends
+
+def _ipv4_to_int(ips):
+    """IPv4 문자열 Series를 정수(int64)로 바꿉니다. IPv4 형식이 아니면 -1입니다."""
+    octets = ips.str.extract(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$').astype(float)
+    valid = octets.notna().all(axis=1).to_numpy() & (octets.fillna(0) <= 255).all(axis=1).to_numpy()
+    values = octets.fillna(0).to_numpy(dtype=np.int64) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.int64)
+    return np.where(valid, values, -1)
+
+class IPRangeIndex:
+    """
+    클라우드/데이터센터 CIDR 프리픽스를 정렬된 정수 구간으로 색인합니다.
+    조회는 구간 시작 배열에 대한 searchsorted 한 번이며, 호스트명 캐시가 필요 없습니다.
+    """
+
+    def __init__(self, cidrs):
+        v4_starts, v4_ends, v6_starts, v6_ends = [], [], [], []
+        for cidr in cidrs:
+            network = ipaddress.ip_network(cidr.strip(), strict=False)
+            starts, ends = (v4_starts, v4_ends) if network.version == 4 else (v6_starts, v6_ends)
+            starts.append(int(network.network_address))
+            ends.append(int(network.broadcast_address))
+        v4_starts, v4_ends = _merge_intervals(v4_starts, v4_ends)
+        self.v4_starts = np.array(v4_starts, dtype=np.int64)
+        self.v4_ends = np.array(v4_ends, dtype=np.int64)
+        # IPv6는 128비트라 파이썬 정수 배열로 두고, 같은 방식으로 searchsorted 합니다.
+        v6_starts, v6_ends = _merge_intervals(v6_starts, v6_ends)
+        self.v6_starts = np.array(v6_starts, dtype=object)
+        self.v6_ends = np.array(v6_ends, dtype=object)
+
+    def __len__(self):
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    @classmethod
+    def from_json(cls, path_or_data):
+        """CIDR 표 JSON 파일 경로(또는 이미 읽은 JSON 객체)에서 색인을 만듭니다."""
+        data = path_or_data
+        if isinstance(path_or_data, str):
+            with open(path_or_data, encoding='utf-8') as f:
+                data = json.load(f)
+        return cls(_iter_cidrs(data))
+
+    def contains(self, ips):
+        """IP 문자열 배열의 각 원소가 색인된 구간에 속하는지 bool 배열로 반환합니다. 결측/잘못된 IP는 False입니다."""
+        ips = pd.Series(ips, dtype=object)
+        result = np.zeros(len(ips), dtype=bool)
+        is_text = ips.map(lambda ip: isinstance(ip, str)).to_numpy(dtype=bool)
+        if not is_text.any():
+            return result
+        text_ips = ips[is_text].str.strip()
+        values = _ipv4_to_int(text_ips)
+        is_v4 = values >= 0
+        if len(self.v4_starts):
+            slot = np.searchsorted(self.v4_starts, values[is_v4], side='right') - 1
+            hit = (slot >= 0) & (values[is_v4] <= self.v4_ends[np.maximum(slot, 0)])
+            result[np.flatnonzero(is_text)[is_v4]] = hit
+        if len(self.v6_starts) and not is_v4.all():
+            positions = np.flatnonzero(is_text)[~is_v4]
+            v6_values, v6_positions = [], []
+            for position, ip in zip(positions, text_ips[~is_v4]):
+                try:
+                    address = ipaddress.ip_address(ip)
+                except ValueError:
+                    continue
+                if address.version == 6:
+                    v6_values.append(int(address))
+                    v6_positions.append(position)
+            if v6_values:
+                v6_values = np.array(v6_values, dtype=object)
+                slot = np.searchsorted(self.v6_starts, v6_values, side='right') - 1
+                hit = (slot >= 0) & (v6_values <= self.v6_ends[np.maximum(slot, 0)]).astype(bool)
+                result[v6_positions] = hit
+        return result
+
+def classify_ips(user_ip, ip_cache_data=None, ip_ranges=None):
+    """
+    이벤트의 IP를 고유 IP 단위로 한 번씩만 분류하고, 결과를 factorize 코드로 이벤트에 펼칩니다.
+    - ip_cache_data: {IP: 역방향 DNS 호스트명} (선택). 호스트명에 클라우드 패턴이 있으면 클라우드 IP로 봅니다.
+    - ip_ranges: IPRangeIndex (선택). CIDR 구간에 속하면 클라우드 IP로 봅니다.
+    반환값: (hostname 배열, is_aws bool 배열)
+    """
+    codes, uniques = pd.factorize(pd.Series(user_ip), use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    if ip_cache_data:
+        unique_hostnames = uniques.map(ip_cache_data).fillna('N/A')
+    else:
+        unique_hostnames = pd.Series('N/A', index=uniques.index, dtype=object)
+    unique_is_aws = unique_hostnames.str.contains(CLOUD_HOSTNAME_PATTERN, case=False, na=False).to_numpy(dtype=bool)
+    if ip_ranges is not None:
+        unique_is_aws |= ip_ranges.contains(uniques)
+    # 결측 IP(코드 -1)는 맨 뒤에 덧붙인 'N/A'/False로 매핑됩니다.
+    hostnames = np.append(unique_hostnames.to_numpy(dtype=object), 'N/A')[codes]
+    is_aws = np.append(unique_is_aws, False)[codes]
+    return hostnames, is_aws
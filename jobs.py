@@ -0,0 +1,142 @@
+# 파일 이름: jobs.py
+
+import collections
+import threading
+import time
+import traceback
+import uuid
+
+FINAL_STATUSES = ('done', 'failed', 'cancelled')
+
+class JobCancelled(Exception):
+    """작업이 취소되어 다음 단계로 넘어가지 않고 멈출 때 발생합니다."""
+
+class Job:
+    """
+    작업 풀에 제출된 분석 작업 하나의 상태입니다. 작업 함수는 첫 인자로 이 객체를 받아
+    단계가 바뀔 때마다 start_stage()를 부르며, 취소 요청은 그 시점에 JobCancelled로 반영됩니다.
+    """
+
+    def __init__(self, owner, func, args, kwargs, stages=()):
+        self.id = uuid.uuid4().hex[:8]
+        self.owner = owner
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.stages = list(stages)
+        self.stage = None
+        self.completed_stages = 0
+        self.status = 'queued'
+        self.result = self.error = None
+        self.submitted_at = time.time()
+        self.started_at = self.finished_at = None
+        self._cancel = threading.Event()
+
+    def start_stage(self, stage):
+        """다음 단계로 넘어갑니다. 그 전에 취소 요청이 있었다면 여기서 멈춥니다."""
+        self.checkpoint()
+        if self.stage in self.stages:
+            self.completed_stages = self.stages.index(self.stage) + 1
+        self.stage = stage
+
+    def checkpoint(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def cancel(self):
+        """취소를 요청합니다. 대기 중이면 바로 취소되고, 실행 중이면 다음 단계 경계에서 멈춥니다."""
+        self._cancel.set()
+        if self.status == 'queued':
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self.status in FINAL_STATUSES
+
+    @property
+    def progress(self):
+        """완료한 단계 비율 (0~1). 단계 목록이 없으면 끝났을 때만 1입니다."""
+        if self.status == 'done':
+            return 1.0
+        return self.completed_stages / len(self.stages) if self.stages else 0.0
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def run(self):
+        self.status, self.started_at = 'running', time.time()
+        try:
+            self.checkpoint()
+            self.result = self.func(self, *self.args, **self.kwargs)
+            self.completed_stages, self.status = len(self.stages), 'done'
+        except JobCancelled:
+            self.status = 'cancelled'
+        except Exception as e:
+            self.error = f"{e}\n{traceback.format_exc()}"
+            self.status = 'failed'
+        finally:
+            self.finished_at = time.time()
+            self.func = self.args = self.kwargs = None  # 끝난 작업이 입력 데이터를 붙잡고 있지 않게 합니다
+
+class JobManager:
+    """
+    여러 세션이 함께 쓰는 작업 풀. 워커 스레드 max_workers개가 대기열을 제출 순서대로 처리합니다.
+    한 소유자(세션)는 동시에 작업 하나만 가질 수 있어, 새 작업을 내면 이전 작업은 취소됩니다.
+    그래서 한 사용자가 버튼을 여러 번 눌러도 다른 사용자의 차례를 밀어내지 못하고, 세션마다 전체 CPU를 쓰는 실행이 겹치지 않습니다.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._queue = collections.deque()
+        self._active = {}
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, name=f'analysis-worker-{i}', daemon=True) for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, owner, func, *args, stages=(), **kwargs):
+        """func(job, *args, **kwargs)를 대기열에 넣고 Job을 반환합니다."""
+        job = Job(owner, func, args, kwargs, stages)
+        with self._condition:
+            previous = self._active.get(owner)
+            if previous is not None and not previous.done:
+                previous.cancel()
+            self._queue = collections.deque(queued for queued in self._queue if queued.status == 'queued')
+            self._queue.append(job)
+            self._active[owner] = job
+            self._condition.notify()
+        return job
+
+    def queue_position(self, job):
+        """대기 중인 작업 앞에 있는 작업 수 (대기 중이 아니면 0)."""
+        with self._condition:
+            ahead = [queued for queued in self._queue if queued.status == 'queued']
+        return ahead.index(job) if job in ahead else 0
+
+    def running_jobs(self):
+        with self._condition:
+            return [job for job in self._active.values() if job.status == 'running']
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                while self._queue:
+                    job = self._queue.popleft()
+                    if job.status == 'queued':
+                        job.status = 'running'  # 이 사이에 들어온 취소 요청은 run()의 첫 checkpoint에서 반영됩니다
+                        return job
+                self._condition.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            job.run()
+            with self._condition:
+                if self._active.get(job.owner) is job:
+                    del self._active[job.owner]
@@ -0,0 +1,130 @@
+# 파일 이름: model_server.py
+
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# 한 번에 모델에 넣는 디바이스 수 (트리 순회 임시 배열 크기가 이 값에 비례합니다)
+MODEL_BATCH_ROWS = 65_536
+# 모델마다 기억해 둘 (피쳐 행 → 점수) 개수. 넘으면 오래된 것부터 버립니다.
+MEMO_MAX_ROWS = 2_000_000
+
+_LOADED = {}
+_WRAPPED = weakref.WeakKeyDictionary()
+_LOCK = threading.Lock()
+
+class ServedModel:
+    """
+    이상 탐지 모델 하나를 감싸 배치 단위로 예측하고, 같은 피쳐 행의 점수는 다시 계산하지 않습니다.
+    decision_function() 점수(음수일수록 이상)를 그대로 내주며, predict()는 그 점수로 만든 -1/1 판정입니다.
+    파일에서 읽은 모델은 pickle할 때 경로만 넘기므로, 프로세스 풀 워커는 모델 전체 대신 경로를 받아 같은 파일을 한 번씩 다시 읽습니다.
+    """
+
+    def __init__(self, model, path=None, batch_rows=MODEL_BATCH_ROWS, n_jobs=1, memo_max_rows=MEMO_MAX_ROWS):
+        self.model = model
+        self.path = path
+        self.batch_rows = batch_rows
+        self.n_jobs = n_jobs
+        self.memo_max_rows = memo_max_rows
+        self._memo = pd.Series(dtype=float)
+        self._memo_lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_memo'], state['_memo_lock'] = pd.Series(dtype=float), None
+        if self.path is not None:
+            state['model'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memo_lock = threading.Lock()
+        if self.model is None:
+            self.model = load_model(self.path).model
+
+    def _score_batches(self, features):
+        batches = [features[start:start + self.batch_rows] for start in range(0, len(features), self.batch_rows)]
+        if self.n_jobs > 1 and len(batches) > 1:
+            # 트리 순회는 GIL을 놓으므로 스레드로 배치를 나눠 돌립니다.
+            with ThreadPoolExecutor(self.n_jobs) as pool:
+                return np.concatenate(list(pool.map(self.model.decision_function, batches)))
+        return np.concatenate([self.model.decision_function(batch) for batch in batches])
+
+    def decision_function(self, features):
+        """
+        디바이스 피쳐 DataFrame의 이상 점수 (모델의 decision_function과 같은 값). 결측이 있는 행은 NaN입니다.
+        이전에 본 피쳐 행은 기억해 둔 점수를 쓰고, 처음 보는 행만 MODEL_BATCH_ROWS개씩 모델에 넣습니다.
+        """
+        scores = np.full(len(features), np.nan)
+        usable = features.notna().all(axis=1).to_numpy()
+        if not usable.any():
+            return scores
+        features = features[usable]
+        keys = pd.util.hash_pandas_object(features, index=False).to_numpy()
+        with self._memo_lock:
+            known = self._memo.reindex(keys).to_numpy()
+            missing = np.isnan(known)
+            self.hits += int((~missing).sum())
+            self.misses += int(missing.sum())
+        if missing.any():
+            new_keys, first = np.unique(keys[missing], return_index=True)
+            rows = np.flatnonzero(missing)[first]
+            new_scores = self._score_batches(features.iloc[rows])
+            known[missing] = pd.Series(new_scores, index=new_keys).reindex(keys[missing]).to_numpy()
+            with self._memo_lock:
+                new_memo = pd.Series(new_scores, index=new_keys)
+                memo = pd.concat([self._memo, new_memo]) if len(self._memo) else new_memo
+                self._memo = memo[~memo.index.duplicated(keep='last')].iloc[-self.memo_max_rows:]
+        scores[usable] = known
+        return scores
+
+    def predict(self, features):
+        """모델의 predict()와 같은 -1(이상)/1(정상) 판정. 결측 행은 1입니다."""
+        return np.where(self.decision_function(features) < 0, -1, 1)
+
+    def clear_memo(self):
+        with self._memo_lock:
+            self._memo = pd.Series(dtype=float)
+
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+def load_model(path, **kwargs):
+    """
+    모델 파일을 프로세스당 한 번만 읽어 ServedModel로 반환합니다 (파일이 바뀌면 다시 읽음).
+    파일이 없으면 FileNotFoundError입니다.
+    mmap_mode는 쓰지 않습니다: IsolationForest의 트리 배열은 sklearn Tree 객체 안에 pickle되어 있어 mmap되지 않고 어차피 메모리로 읽힙니다.
+    """
+    key = _file_fingerprint(path)
+    with _LOCK:
+        served = _LOADED.get(key)
+        if served is None:
+            served = ServedModel(joblib.load(path), path=path, **kwargs)
+            _LOADED[key] = served
+    return served
+
+def load_optional_model(path, **kwargs):
+    """load_model()과 같지만 파일이 없으면 None을 반환합니다."""
+    try:
+        return load_model(path, **kwargs)
+    except FileNotFoundError:
+        return None
+
+def serve(model):
+    """모델 객체를 ServedModel로 감쌉니다. 같은 객체는 같은 ServedModel(같은 점수 캐시)을 돌려줍니다."""
+    if model is None or isinstance(model, ServedModel):
+        return model
+    if not hasattr(model, 'offset_'):
+        raise TypeError("decision_function < 0을 이상으로 판정하는 모델(IsolationForest 등)만 지원합니다.")
+    with _LOCK:
+        served = _WRAPPED.get(model)
+        if served is None:
+            served = _WRAPPED[model] = ServedModel(model)
+    return served
@@ -0,0 +1,126 @@
+# 파일 이름: parallel.py
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from detector import CONFIG, SCORING_INPUT_COLUMNS, calculate_abuse_scores, build_ip_features, sketch_error_from
+from fraud_rings import ring_feature_table
+from profiling import active_profile, collect_profile, profile_stage
+
+# 워커 프로세스마다 한 번만 받아 두는 전역 값 (모델, 매체 CVR, 전역 IP/링 집계, 설정)
+_WORKER_CONTEXT = {}
+
+def _share_frame(df):
+    """
+    DataFrame을 pickle 프로토콜 5로 직렬화해 공유 메모리 블록 하나에 담습니다.
+    숫자 컬럼 버퍼는 파이프를 거치지 않고 out-of-band로 공유 메모리에 바로 복사됩니다.
+    반환값: (SharedMemory, 구간 크기 리스트)
+    """
+    buffers = []
+    payload = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+    parts = [memoryview(payload)] + [buffer.raw() for buffer in buffers]
+    sizes = [part.nbytes for part in parts]
+    block = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+    offset = 0
+    for part, size in zip(parts, sizes):
+        block.buf[offset:offset + size] = part.cast('B')
+        offset += size
+    return block, sizes
+
+def _load_frame(name, sizes):
+    """공유 메모리 블록에서 DataFrame을 복원합니다. 복원한 프레임은 블록과 독립된 메모리를 씁니다."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        parts, offset = [], 0
+        for size in sizes:
+            parts.append(bytearray(block.buf[offset:offset + size]))
+            offset += size
+    finally:
+        block.close()
+    return pickle.loads(parts[0], buffers=parts[1:])
+
+def _init_worker(context):
+    _WORKER_CONTEXT.update(context)
+
+def _score_shard(name, sizes, analysis_type):
+    """
+    워커: 디바이스 샤드 하나를 채점하고, 새로 계산한 컬럼만 새 공유 메모리 블록으로 돌려줍니다.
+    워커에는 부모의 프로파일이 없으므로 규칙/모델 단계 계측값을 따로 모아 함께 돌려줍니다.
+    """
+    shard = _load_frame(name, sizes)
+    input_columns = set(shard.columns)
+    context = _WORKER_CONTEXT
+    with collect_profile() as profile:
+        scored = calculate_abuse_scores(
+            shard, analysis_type, context['clicks_per_mda'], context['cvr_per_mda'],
+            anomaly_model=context['anomaly_model'], ctit_anomaly_model=context['ctit_anomaly_model'],
+            config=context['config'], ip_features=context['ip_features'], ring_features=context['ring_features'],
+        )
+    block, result_sizes = _share_frame(scored[[column for column in scored.columns if column not in input_columns]])
+    block.close()
+    return block.name, result_sizes, profile.stages
+
+def shard_by_device(df, n_shards):
+    """dvc_idx 해시로 이벤트 위치를 n_shards개 샤드로 나눕니다. 한 디바이스의 이벤트는 모두 같은 샤드에 들어갑니다."""
+    shard_ids = pd.util.hash_array(df['dvc_idx'].to_numpy()) % np.uint64(n_shards)
+    return [np.flatnonzero(shard_ids == shard) for shard in range(n_shards)]
+
+def calculate_abuse_scores_parallel(df, analysis_type='conversion', clicks_per_mda_series=None, cvr_per_mda_series=None, anomaly_model=None, ctit_anomaly_model=None, config=None, n_workers=None, n_shards=None):
+    """
+    calculate_abuse_scores와 같은 결과를 디바이스 해시 샤드 단위 프로세스 풀로 계산합니다.
+    디바이스 단위 규칙과 모델은 샤드 안에서 끝나고, IP별 디바이스 수와 디바이스–IP 링처럼 전역인 피쳐는 한 번만 계산해 워커에 넘깁니다.
+    워커에는 채점에 필요한 컬럼만(IP는 정수 코드로) 공유 메모리로 보내며, 결과의 행 순서와 값은 직렬 경로와 같습니다.
+    """
+    if df.empty:
+        return df
+    if config is None:
+        config = CONFIG
+    n_workers = n_workers or os.cpu_count() or 1
+    n_shards = n_shards or n_workers * 2
+
+    # IP 문자열은 한 번만 코드화해 전송량을 줄입니다 (결측 IP는 NaN 유지).
+    scoring_input = df[SCORING_INPUT_COLUMNS].reset_index(drop=True)
+    ip_codes, ip_uniques = pd.factorize(scoring_input['user_ip'])
+    scoring_input['user_ip'] = np.where(ip_codes >= 0, ip_codes, np.nan)
+    ip_features = build_ip_features(scoring_input, sketch_error_from(config))
+    with profile_stage(f'rings:{analysis_type}', len(scoring_input)):
+        ring_features = ring_feature_table(scoring_input['dvc_idx'], scoring_input['user_ip'], config['fraud_ring']['max_ip_devices'])
+    context = {
+        'clicks_per_mda': clicks_per_mda_series, 'cvr_per_mda': cvr_per_mda_series,
+        'anomaly_model': anomaly_model, 'ctit_anomaly_model': ctit_anomaly_model,
+        'config': config, 'ip_features': ip_features, 'ring_features': ring_features,
+    }
+    shards = [positions for positions in shard_by_device(scoring_input, n_shards) if len(positions)]
+    blocks, scored_shards = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(context,)) as pool:
+            futures = []
+            for positions in shards:
+                block, sizes = _share_frame(scoring_input.iloc[positions])
+                blocks.append(block)
+                futures.append(pool.submit(_score_shard, block.name, sizes, analysis_type))
+            for positions, future in zip(shards, futures):
+                name, sizes, stages = future.result()
+                # 워커의 규칙/모델 단계 계측값을 호출한 쪽 프로파일에 합칩니다 (샤드별 값은 더하고 최대 RSS는 최댓값).
+                if active_profile() is not None:
+                    active_profile().merge(stages)
+                computed = _load_frame(name, sizes)
+                result_block = shared_memory.SharedMemory(name=name)
+                result_block.close()
+                result_block.unlink()
+                # 워커가 정렬한 순서(샤드 내 위치)대로 원본 행을 가져와 계산된 컬럼을 붙입니다.
+                scored = df.iloc[computed.index.to_numpy()].copy()
+                for column in computed.columns:
+                    scored[column] = computed[column].to_numpy()
+                scored_shards.append(scored)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    # 샤드 안에서는 이미 정렬되어 있으므로, 안정 정렬로 합치면 직렬 경로와 같은 행 순서가 됩니다.
+    return pd.concat(scored_shards).sort_values(by=['dvc_idx', 'click_date'], kind='stable')
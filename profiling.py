@@ -0,0 +1,178 @@
+# 파일 이름: profiling.py
+
+import contextvars
+import functools
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# 현재 실행 흐름(스레드/세션)에서 기록 중인 프로파일. 없으면 계측 코드는 아무 일도 하지 않습니다.
+_ACTIVE_PROFILE = contextvars.ContextVar('active_profile', default=None)
+PROMETHEUS_PREFIX = 'abuse_detector_stage'
+
+def current_rss_mb():
+    """현재 프로세스의 RSS(MB). /proc이 없는 환경에서는 최대 RSS로 대신합니다."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def peak_rss_mb():
+    """프로세스 시작 이후 최대 RSS(MB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _stage_peak_mb(start_rss, start_peak):
+    """
+    구간 최대 RSS 추정값. 구간 안에서 프로세스 최대 RSS가 갱신됐으면 그 값이 정확한 구간 최대이고,
+    아니면 (샘플링 스레드 없이는) 구간 시작/끝 RSS 중 큰 값을 하한으로 씁니다.
+    """
+    end_peak = peak_rss_mb()
+    return end_peak if end_peak > start_peak else max(start_rss, current_rss_mb())
+
+class PerfProfile:
+    """
+    단계별 경과 시간, 입력/출력 행 수, 메모리(RSS) 변화량과 최대 RSS를 모읍니다.
+    같은 이름의 단계가 여러 번 기록되면(청크, 분석 유형별 반복 등) 호출 수와 함께 합산하고, 최대 RSS는 가장 큰 값을 남깁니다.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lap_start = None
+
+    def record(self, stage, seconds, rows_in=None, rows_out=None, memory_delta_mb=0.0, peak_rss_mb=0.0):
+        entry = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'memory_delta_mb': 0.0, 'peak_rss_mb': 0.0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['rows_in'] += int(rows_in or 0)
+        entry['rows_out'] += int(rows_out or 0)
+        entry['memory_delta_mb'] += memory_delta_mb
+        entry['peak_rss_mb'] = max(entry['peak_rss_mb'], peak_rss_mb)
+
+    def merge(self, stages):
+        """다른 프로파일(예: 워커 프로세스)의 stages를 합칩니다. 호출 수·시간·행 수·메모리 변화량은 더하고 최대 RSS는 큰 값을 남깁니다."""
+        for stage, other in stages.items():
+            entry = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0, 'memory_delta_mb': 0.0, 'peak_rss_mb': 0.0})
+            for key in ('calls', 'seconds', 'rows_in', 'rows_out', 'memory_delta_mb'):
+                entry[key] += other[key]
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'], other['peak_rss_mb'])
+
+    def mark(self):
+        """랩 측정 기준점을 지금으로 옮깁니다."""
+        self._lap_start = (time.perf_counter(), current_rss_mb(), peak_rss_mb())
+
+    def lap(self, stage, rows_in=None, rows_out=None):
+        """직전 기준점부터 지금까지를 stage로 기록하고 기준점을 옮깁니다 (연속된 규칙 마스크처럼 잘게 나뉜 구간용)."""
+        if self._lap_start is not None:
+            start, start_rss, start_peak = self._lap_start
+            self.record(stage, time.perf_counter() - start, rows_in, rows_out, current_rss_mb() - start_rss, _stage_peak_mb(start_rss, start_peak))
+        self.mark()
+
+    def to_frame(self):
+        """단계별 지표 DataFrame (index=stage)."""
+        frame = pd.DataFrame.from_dict(self.stages, orient='index')
+        frame.index.name = 'stage'
+        if not frame.empty:
+            frame['rows_per_sec'] = (frame['rows_in'] / frame['seconds']).where(frame['seconds'] > 0)
+        return frame
+
+    def to_json(self, path=None):
+        text = json.dumps(self.stages, ensure_ascii=False, indent=2)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, path=None):
+        """Prometheus 텍스트 노출 형식 (node_exporter textfile collector 등으로 수집)."""
+        metrics = (
+            ('seconds_total', 'counter', 'seconds', 1.0, '단계 누적 실행 시간(초)'),
+            ('calls_total', 'counter', 'calls', 1.0, '단계 호출 수'),
+            ('rows_in_total', 'counter', 'rows_in', 1.0, '단계 입력 행 수'),
+            ('rows_out_total', 'counter', 'rows_out', 1.0, '단계 출력(적중) 행 수'),
+            ('memory_delta_bytes', 'gauge', 'memory_delta_mb', 2**20, '단계 전후 RSS 변화량(바이트)'),
+            ('peak_rss_bytes', 'gauge', 'peak_rss_mb', 2**20, '단계 중 최대 RSS(바이트)'),
+        )
+        lines = []
+        for suffix, kind, key, scale, help_text in metrics:
+            name = f'{PROMETHEUS_PREFIX}_{suffix}'
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for stage, entry in self.stages.items():
+                label = stage.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{name}{{stage="{label}"}} {entry[key] * scale:.6g}')
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
+    def save(self, path):
+        """확장자가 .prom이면 Prometheus 텍스트로, 그 외에는 JSON으로 저장합니다."""
+        if str(path).endswith('.prom'):
+            return self.to_prometheus(path)
+        return self.to_json(path)
+
+def active_profile():
+    return _ACTIVE_PROFILE.get()
+
+@contextmanager
+def collect_profile(profile=None):
+    """with 블록 안에서 실행되는 탐지 코드의 계측값을 profile(없으면 새로 생성)에 모읍니다."""
+    profile = profile if profile is not None else PerfProfile()
+    token = _ACTIVE_PROFILE.set(profile)
+    try:
+        yield profile
+    finally:
+        _ACTIVE_PROFILE.reset(token)
+
+class _StageRecord:
+    rows_out = None
+
+@contextmanager
+def profile_stage(stage, rows_in=None):
+    """블록 하나를 단계로 기록합니다. 블록 안에서 yield된 객체의 rows_out을 채우면 출력 행 수로 남습니다."""
+    profile = _ACTIVE_PROFILE.get()
+    record = _StageRecord()
+    if profile is None:
+        yield record
+        return
+    start, start_rss, start_peak = time.perf_counter(), current_rss_mb(), peak_rss_mb()
+    try:
+        yield record
+    finally:
+        profile.record(stage, time.perf_counter() - start, rows_in, record.rows_out, current_rss_mb() - start_rss, _stage_peak_mb(start_rss, start_peak))
+        profile.mark()
+
+def start_laps():
+    profile = _ACTIVE_PROFILE.get()
+    if profile is not None:
+        profile.mark()
+
+def record_lap(stage, rows_in=None, hits=None):
+    """직전 랩 이후 구간을 stage로 기록합니다. hits(bool 마스크)를 주면 적중 수를 출력 행 수로 남깁니다."""
+    profile = _ACTIVE_PROFILE.get()
+    if profile is not None:
+        profile.lap(stage, rows_in, None if hits is None else np.count_nonzero(np.asarray(hits, dtype=bool)))
+
+def _len_or_none(value):
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+def profiled(stage):
+    """함수 전체를 단계로 기록하는 데코레이터. 첫 인자의 길이를 입력 행 수로, 반환값(튜플이면 첫 원소)의 길이를 출력 행 수로 씁니다."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage, _len_or_none(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = _len_or_none(result[0] if isinstance(result, tuple) else result)
+            return result
+        return wrapper
+    return decorator
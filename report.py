@@ -0,0 +1,84 @@
+# 파일 이름: report.py
+
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from detector import decode_reasons
+
+# 내보내기 파일을 몇 행씩 나눠 쓸지 (한 번에 문자열/Arrow 테이블로 만드는 크기가 이 값에 비례합니다)
+EXPORT_CHUNK_ROWS = 200_000
+EXPORT_FORMATS = ('csv', 'parquet')
+
+def device_report(all_scored_df, block_list):
+    """
+    제재 디바이스별 (dvc_idx, abuse_score, rule_hits, events) 표를 점수 내림차순으로 만듭니다.
+    abuse_score는 디바이스의 최고 점수, rule_hits는 디바이스의 모든 이벤트에서 실제 적중한 규칙의 합집합(비트 OR)입니다.
+    이벤트 프레임을 복사하지 않고 세 컬럼만 골라 디바이스 순으로 정렬한 뒤 reduceat으로 한 번에 집계합니다.
+    """
+    dvc = all_scored_df['dvc_idx'].to_numpy()
+    selected = np.flatnonzero(pd.Index(block_list).get_indexer(dvc) >= 0)
+    order = selected[np.argsort(dvc[selected], kind='stable')]
+    dvc = dvc[order]
+    new_device = np.ones(len(dvc), dtype=bool)
+    new_device[1:] = dvc[1:] != dvc[:-1]
+    starts = np.flatnonzero(new_device)
+    report = pd.DataFrame({
+        'dvc_idx': dvc[starts],
+        'abuse_score': np.maximum.reduceat(all_scored_df['abuse_score'].to_numpy()[order], starts),
+        'rule_hits': np.bitwise_or.reduceat(all_scored_df['rule_hits'].to_numpy(dtype=np.uint32)[order], starts),
+        'events': np.diff(np.append(starts, len(dvc))),
+    })
+    return report.sort_values('abuse_score', ascending=False, kind='stable', ignore_index=True)
+
+def reason_columns(report, names=None, sep=', ', empty='정보 없음'):
+    """device_report()에 사람이 읽는 사유 컬럼('reasons')을 붙입니다 (서로 다른 비트 조합마다 한 번만 디코딩)."""
+    return report.assign(reasons=decode_reasons(report['rule_hits'], names=names, sep=sep, empty=empty))
+
+def media_report(all_scored_df, block_list, top=10):
+    """제재 디바이스가 이용한 매체별 고유 제재 디바이스 수 상위 top개 (index=mda_idx)."""
+    abusive = all_scored_df['dvc_idx'].isin(block_list).to_numpy()
+    pairs = pd.DataFrame({
+        'mda_idx': all_scored_df['mda_idx'].to_numpy()[abusive], 'dvc_idx': all_scored_df['dvc_idx'].to_numpy()[abusive],
+    }).drop_duplicates()
+    return pairs['mda_idx'].value_counts().head(top).rename('devices')
+
+def write_csv_chunks(df, target, chunk_rows=EXPORT_CHUNK_ROWS, encoding='utf-8-sig'):
+    """df를 chunk_rows행씩 CSV로 이어 씁니다. target은 경로 또는 바이너리 파일 객체입니다 (BOM은 파일 맨 앞에 한 번만)."""
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'wb') as f:
+            return write_csv_chunks(df, f, chunk_rows, encoding)
+    text = io.TextIOWrapper(target, encoding=encoding, newline='')
+    try:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            df.iloc[start:start + chunk_rows].to_csv(text, index=False, header=(start == 0))
+        text.flush()
+    finally:
+        text.detach()  # 호출한 쪽의 파일 객체는 닫지 않습니다
+
+def write_parquet_chunks(df, target, chunk_rows=EXPORT_CHUNK_ROWS):
+    """df를 chunk_rows행짜리 row group으로 나눠 Parquet로 씁니다. 스키마는 프레임 전체 기준이라 청크마다 타입이 흔들리지 않습니다."""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(target, schema) as writer:
+        for start in range(0, len(df), chunk_rows):
+            writer.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+
+def export_file(df, file_format='csv', chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    df를 청크 단위로 이름 없는 임시 파일에 쓴 뒤 그 내용을 bytes로 반환합니다 (임시 파일은 닫아 지웁니다).
+    CSV 문자열 전체나 Arrow 테이블 전체 같은 중간 사본 없이, 메모리에는 최종 결과 bytes 하나만 남습니다.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"지원하지 않는 내보내기 형식입니다: {file_format} ({', '.join(EXPORT_FORMATS)})")
+    with tempfile.TemporaryFile() as spill:
+        if file_format == 'csv':
+            write_csv_chunks(df, spill, chunk_rows)
+        else:
+            write_parquet_chunks(df, spill, chunk_rows)
+        spill.seek(0)
+        return spill.read()
@@ -0,0 +1,152 @@
+# 파일 이름: result_cache.py
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 2 * 2**30
+META_FILE = 'meta.json'
+HASH_BLOCK = 8 * 2**20
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path):
+    """파일 내용의 SHA-256 (큰 파일도 블록 단위로 읽습니다)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(*parts):
+    """문자열/바이트/JSON 직렬화 가능한 값들로 캐시 키를 만듭니다. 같은 내용이면 세션과 프로세스가 달라도 같은 키입니다."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode('utf-8')
+        else:
+            data = json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+def _as_frame(value):
+    if isinstance(value, pd.Series):
+        name = value.name if value.name is not None else '__series__'
+        return value.to_frame(name=name), {'kind': 'series', 'name': value.name}
+    return value, {'kind': 'frame'}
+
+def _from_frame(frame, info):
+    if info['kind'] == 'series':
+        series = frame.iloc[:, 0]
+        series.name = info['name']
+        return series
+    return frame
+
+class ResultCache:
+    """
+    내용 주소(content-addressed) 디스크 캐시. 항목 하나는 키 이름의 디렉터리이며, DataFrame/Series는 Parquet 파일로,
+    나머지 값은 meta.json으로 저장합니다. 같은 디렉터리를 여러 세션(프로세스)이 함께 써도 되도록
+    임시 디렉터리에 다 쓴 뒤 이름을 바꿔 한 번에 공개하고, 전체 크기가 max_bytes를 넘으면 가장 오래 안 쓴 항목부터 지웁니다.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._entry(key), META_FILE))
+
+    def get(self, key):
+        """캐시된 값 딕셔너리를 반환합니다. 없거나 읽을 수 없으면 None이며, 읽으면 최근 사용 시각을 갱신합니다."""
+        entry = self._entry(key)
+        meta_path = os.path.join(entry, META_FILE)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            values = dict(meta['values'])
+            for name, info in meta['frames'].items():
+                values[name] = _from_frame(pd.read_parquet(os.path.join(entry, f'{name}.parquet')), info)
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            return None  # 다른 세션이 막 지운 항목이거나 깨진 항목은 없는 것으로 봅니다
+        return values
+
+    def put(self, key, values):
+        """
+        값 딕셔너리를 저장합니다. DataFrame/Series 값은 Parquet로, 나머지는 JSON으로 저장하며
+        같은 키가 이미 있으면 (다른 세션이 먼저 저장했으면) 그대로 둡니다. 반환값: 항목 크기(바이트)
+        """
+        entry = self._entry(key)
+        if key in self:
+            return 0
+        tmp_entry = os.path.join(self.root, f'.tmp-{key}-{uuid.uuid4().hex[:8]}')
+        os.makedirs(tmp_entry)
+        try:
+            meta = {'key': key, 'created': time.time(), 'frames': {}, 'values': {}}
+            for name, value in values.items():
+                if isinstance(value, (pd.DataFrame, pd.Series)):
+                    frame, info = _as_frame(value)
+                    frame.to_parquet(os.path.join(tmp_entry, f'{name}.parquet'))
+                    meta['frames'][name] = info
+                else:
+                    meta['values'][name] = value
+            with open(os.path.join(tmp_entry, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+            size = _directory_size(tmp_entry)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                return 0  # 같은 내용을 다른 세션이 먼저 저장했습니다
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+        return size
+
+    def entries(self):
+        """(키, 크기, 최근 사용 시각) 목록을 최근 사용 순으로 반환합니다."""
+        rows = []
+        for name in os.listdir(self.root):
+            meta_path = os.path.join(self.root, name, META_FILE)
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            try:
+                rows.append((name, _directory_size(os.path.join(self.root, name)), os.stat(meta_path).st_mtime))
+            except OSError:
+                continue
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def evict(self):
+        """전체 크기가 max_bytes 이하가 될 때까지 가장 오래 안 쓴 항목을 지웁니다. 반환값: 지운 항목 수"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        while entries and total > self.max_bytes:
+            key, size, _ = entries.pop()
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    @property
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
@@ -0,0 +1,313 @@
+# 파일 이름: sketches.py
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+DEFAULT_RELATIVE_ERROR = 0.02
+# from_pairs()가 한 번에 해시/정렬하는 (그룹, 항목) 쌍 수. 임시 배열 크기가 전체 이벤트 수가 아니라 이 값에 비례합니다.
+PAIR_CHUNK_ROWS = 1_000_000
+
+def precision_for_error(relative_error):
+    """HyperLogLog 상대 표준오차(≈ 1.04 / √m)가 relative_error 이하가 되는 레지스터 비트 수 p (m = 2^p)."""
+    if not 0 < relative_error < 1:
+        raise ValueError(f"relative_error는 0과 1 사이여야 합니다: {relative_error}")
+    precision = math.ceil(math.log2((1.04 / relative_error) ** 2))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+def hash_values(values):
+    """값을 64비트 해시로 바꿉니다. 같은 값은 청크/샤드/프로세스가 달라도 같은 해시를 가집니다."""
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        category_hashes = pd.util.hash_array(values.cat.categories.to_numpy(dtype=object))
+        return category_hashes[values.cat.codes.to_numpy()]
+    if pd.api.types.is_float_dtype(values.dtype) and (values == np.floor(values)).all():
+        values = values.astype(np.int64)  # 결측 때문에 float로 바뀐 ID도 정수 ID와 같은 해시를 갖게 합니다
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return pd.util.hash_array(values.to_numpy(dtype=np.int64))
+    return pd.util.hash_array(values.to_numpy(dtype=object))
+
+def _chunk_hasher(items, chunk_rows):
+    """
+    hash_values(items)와 같은 해시를 청크별로 내는 함수를 반환합니다.
+    범주형의 범주 해시와 float ID의 정수 여부는 청크마다 다시 정하지 않고 전체 기준으로 한 번만 정합니다.
+    """
+    if isinstance(items.dtype, pd.CategoricalDtype):
+        category_hashes = pd.util.hash_array(items.cat.categories.to_numpy(dtype=object))
+        return lambda chunk: category_hashes[chunk.cat.codes.to_numpy()]
+    if pd.api.types.is_float_dtype(items.dtype):
+        chunks = (items.iloc[start:start + chunk_rows].dropna() for start in range(0, len(items), chunk_rows))
+        if all((chunk == np.floor(chunk)).all() for chunk in chunks):
+            return lambda chunk: pd.util.hash_array(chunk.to_numpy(dtype=np.int64))
+        return lambda chunk: pd.util.hash_array(chunk.to_numpy(dtype=object))
+    return hash_values
+
+def _bit_length(values):
+    """uint64 배열의 비트 길이. float64로 바꿀 때 값이 반올림되지 않도록 상·하위 32비트로 나눠 계산합니다."""
+    high, low = values >> np.uint64(32), values & np.uint64(0xFFFFFFFF)
+    return np.where(high > 0, 32 + np.frexp(high.astype(np.float64))[1], np.frexp(low.astype(np.float64))[1])
+
+def _max_per_key(keys, ranks):
+    """같은 키의 랭크 중 최댓값만 남깁니다 (키 오름차순)."""
+    if not len(keys):
+        return keys.astype(np.int64), ranks.astype(np.uint8)
+    order = np.argsort(keys, kind='stable')
+    keys, ranks = keys[order], ranks[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.maximum.reduceat(ranks, starts)
+
+class GroupedHLL:
+    """
+    그룹(디바이스, IP 등)마다 HyperLogLog 스케치 하나씩을 희소 레지스터로 보관합니다.
+    레지스터는 (그룹 코드 << p | 레지스터 번호) 키와 랭크 배열로 두므로, 그룹당 메모리는 고유 항목 수가 아니라
+    최대 2^p개 레지스터로 묶입니다 (통신사 NAT IP처럼 디바이스가 수만 개인 그룹에서 효과가 큽니다).
+    같은 precision의 스케치끼리는 merge()로 합칠 수 있어 청크/샤드별 스케치를 나중에 합쳐도 결과가 같습니다.
+    """
+
+    def __init__(self, precision, groups=None, keys=None, ranks=None):
+        self.precision = precision
+        self.groups = groups if groups is not None else pd.Index([])
+        self.keys = keys if keys is not None else np.zeros(0, dtype=np.int64)
+        self.ranks = ranks if ranks is not None else np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def from_pairs(cls, groups, items, precision, chunk_rows=PAIR_CHUNK_ROWS):
+        """
+        (그룹, 항목) 쌍으로 스케치를 만듭니다. 그룹이나 항목이 결측인 쌍은 건너뜁니다.
+        쌍을 chunk_rows개씩 해시해 레지스터에 합치므로, 임시 배열은 청크 크기와 레지스터 수에만 비례합니다.
+        """
+        groups, items = pd.Series(groups).reset_index(drop=True), pd.Series(items).reset_index(drop=True)
+        register_bits = np.uint64(64 - precision)
+        hash_chunk = _chunk_hasher(items, chunk_rows)
+        group_index = None
+        keys, ranks = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        for start in range(0, len(groups), chunk_rows):
+            chunk_groups, chunk_items = groups.iloc[start:start + chunk_rows], items.iloc[start:start + chunk_rows]
+            valid = (chunk_groups.notna() & chunk_items.notna()).to_numpy()
+            chunk_codes, chunk_uniques = pd.factorize(chunk_groups[valid])
+            # 그룹 코드는 처음 나온 순서대로 청크를 넘어 이어 붙입니다.
+            chunk_uniques = pd.Index(chunk_uniques)
+            if group_index is None:
+                group_index = chunk_uniques
+            else:
+                group_index = group_index.append(chunk_uniques[~chunk_uniques.isin(group_index)])
+            group_codes = group_index.get_indexer(chunk_uniques).astype(np.int64)[chunk_codes]
+            hashes = hash_chunk(chunk_items[valid])
+            registers = (hashes >> register_bits).astype(np.int64)
+            # 랭크 = 레지스터 번호를 뺀 나머지 비트에서 처음 1이 나오는 위치 (모두 0이면 64 - p + 1)
+            chunk_ranks = (int(register_bits) + 1 - _bit_length(hashes & ((np.uint64(1) << register_bits) - np.uint64(1)))).astype(np.uint8)
+            chunk_keys, chunk_ranks = _max_per_key((group_codes << precision) | registers, chunk_ranks)
+            # 이미 있는 레지스터는 np.maximum.at으로 제자리에서 올리고, 새 레지스터만 정렬 위치에 끼워 넣습니다.
+            positions = np.searchsorted(keys, chunk_keys)
+            present = positions < len(keys)
+            present[present] = keys[positions[present]] == chunk_keys[present]
+            np.maximum.at(ranks, positions[present], chunk_ranks[present])
+            keys = np.insert(keys, positions[~present], chunk_keys[~present])
+            ranks = np.insert(ranks, positions[~present], chunk_ranks[~present])
+        if group_index is None:
+            group_index = pd.Index(groups.iloc[:0].dropna().unique())
+        return cls(precision, group_index, keys, ranks)
+
+    def merge(self, other):
+        """두 스케치를 합친 새 스케치를 반환합니다 (레지스터별 최댓값)."""
+        if other.precision != self.precision:
+            raise ValueError(f"precision이 다른 스케치는 합칠 수 없습니다: {self.precision} / {other.precision}")
+        groups = self.groups.append(other.groups[~other.groups.isin(self.groups)])
+        remap = groups.get_indexer(other.groups).astype(np.int64)
+        mask = (1 << self.precision) - 1
+        other_keys = (remap[other.keys >> self.precision] << self.precision) | (other.keys & mask)
+        keys, ranks = _max_per_key(np.concatenate([self.keys, other_keys]), np.concatenate([self.ranks, other.ranks]))
+        return GroupedHLL(self.precision, groups, keys, ranks)
+
+    def estimate(self):
+        """그룹별 고유 항목 수 추정치 (index=그룹). 작은 값은 선형 계수(linear counting)로 보정합니다."""
+        m = 1 << self.precision
+        group_codes = self.keys >> self.precision
+        n_groups = len(self.groups)
+        present = np.bincount(group_codes, minlength=n_groups)
+        harmonic = np.bincount(group_codes, weights=np.ldexp(1.0, -self.ranks.astype(np.int64)), minlength=n_groups) + (m - present)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / harmonic
+        empty = m - present
+        with np.errstate(divide='ignore'):
+            linear = m * np.log(m / np.maximum(empty, 1))
+        estimate = np.where((raw <= 2.5 * m) & (empty > 0), linear, raw)
+        return pd.Series(estimate, index=self.groups)
+
+    def counts(self):
+        """그룹별 추정 고유 수를 정수로 반올림합니다 (규칙 임계값 비교용)."""
+        return self.estimate().round().astype(np.int64)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.ranks.nbytes
+
+def approx_pair_counts(left_codes, right_values, n_left, relative_error=DEFAULT_RELATIVE_ERROR):
+    """
+    _distinct_pair_counts()의 근사판: left 코드별 고유 right 값 수를 HyperLogLog로 추정합니다.
+    left 코드 -1(결측)과 결측 right 값은 제외하며, 결과는 길이 n_left의 정수 배열입니다.
+    """
+    left = pd.Series(left_codes).where(np.asarray(left_codes) >= 0)
+    sketch = GroupedHLL.from_pairs(left, right_values, precision_for_error(relative_error))
+    counts = np.zeros(n_left, dtype=np.int64)
+    estimate = sketch.counts()
+    counts[estimate.index.to_numpy(dtype=np.int64)] = estimate.to_numpy()
+    return counts
+
+DEFAULT_QUANTILE_CAPACITY = 2048
+
+class QuantileSketch:
+    """
+    합칠 수 있는 분위수 스케치. (값, 가중치) 쌍을 값 오름차순으로 보관합니다.
+    고유 값 수가 capacity 이하이면 모든 값을 그대로 세므로 pandas quantile(선형 보간)과 같은 값을 냅니다.
+    정수 점수처럼 고유 값이 적은 입력은 규모와 무관하게 정확하며, 넘치면 누적 가중치를 n / capacity 폭의 순위 구간으로
+    나눠 같은 구간의 이웃 값을 가중 평균 센트로이드 하나로 합칩니다 (t-digest/KLL이 아닌 등폭 순위 구간 방식).
+    센트로이드 하나가 덮는 순위 폭이 약 n / capacity(+ 합치기 전 가장 무거운 센트로이드)라 분위수의 순위 오차도 그만큼으로 묶입니다.
+    """
+
+    def __init__(self, capacity=DEFAULT_QUANTILE_CAPACITY, values=None, weights=None):
+        self.capacity = capacity
+        self.values = values if values is not None else np.zeros(0)
+        self.weights = weights if weights is not None else np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values, capacity=DEFAULT_QUANTILE_CAPACITY):
+        values = pd.Series(values, dtype=float).dropna().to_numpy()
+        uniques, counts = np.unique(values, return_counts=True)
+        return cls(capacity, uniques, counts.astype(np.int64))._compress()
+
+    @property
+    def count(self):
+        return int(self.weights.sum())
+
+    @property
+    def is_exact(self):
+        """센트로이드로 합친 적이 없으면 True (보관 값이 실제 고유 값 그대로)."""
+        return self.weights.dtype == np.int64
+
+    def merge(self, other):
+        """두 스케치를 합친 새 스케치를 반환합니다. 정확한 스케치끼리는 결과도 정확합니다."""
+        values = np.concatenate([self.values, other.values])
+        weights = np.concatenate([self.weights, other.weights])
+        exact = self.is_exact and other.is_exact
+        uniques, codes = np.unique(values, return_inverse=True)
+        merged = np.bincount(codes, weights=weights, minlength=len(uniques))
+        return QuantileSketch(min(self.capacity, other.capacity), uniques, merged.astype(np.int64) if exact else merged)._compress()
+
+    def _compress(self):
+        """고유 값이 capacity를 넘으면, 시작 순위가 같은 n / capacity 폭 구간에 드는 이웃 값들을 가중 평균 하나로 합칩니다 (capacity개 이하)."""
+        if len(self.values) <= self.capacity:
+            return self
+        weights = self.weights.astype(float)
+        start_ranks = np.cumsum(weights) - weights
+        buckets = np.floor(start_ranks * self.capacity / weights.sum()).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        merged_weights = np.add.reduceat(weights, starts)
+        self.values = np.add.reduceat(self.values * weights, starts) / merged_weights
+        self.weights = merged_weights
+        return self
+
+    def quantile(self, q):
+        """q 분위수. 정확한 스케치는 pandas Series.quantile(q)와 같고, 빈 스케치는 NaN입니다."""
+        n = self.weights.sum()
+        if n == 0:
+            return float('nan')
+        if self.is_exact:
+            position = (n - 1) * q
+            lower = int(np.floor(position))
+            cumulative = np.cumsum(self.weights)
+            lower_value = self.values[np.searchsorted(cumulative, lower, side='right')]
+            upper_value = self.values[np.searchsorted(cumulative, min(lower + 1, n - 1), side='right')]
+            return float(lower_value + (position - lower) * (upper_value - lower_value))
+        # 센트로이드는 자기 가중치 구간의 가운데 순위에 있다고 보고 선형 보간합니다.
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * n, centers, self.values))
+
+def check_quantile_sketch(n=200_000, partitions=12, capacity=DEFAULT_QUANTILE_CAPACITY, seed=0):
+    """
+    고유 값이 capacity보다 훨씬 많은 float 입력(정규/로그정규 분포)을 크기가 제각각인 파티션으로 나눠 스케치를 만들고 merge()로 합친 뒤,
+    분위수 추정값의 실제 순위가 q * n에서 얼마나 벗어나는지 잽니다.
+    반환값: {분포: {'max_rank_error': 최대 순위 오차, 'bound': n / capacity, 'ok': 오차 <= 2 * bound}}
+    """
+    rng = np.random.default_rng(seed)
+    # 파티션 크기를 기하급수적으로 다르게 나눠, 무거운 센트로이드와 가벼운 센트로이드가 섞이는 병합도 확인합니다.
+    sizes = np.diff(np.round(n * (np.geomspace(1, 2 ** partitions, partitions + 1) - 1) / (2 ** partitions - 1)).astype(np.int64))
+    results = {}
+    for name, values in (('normal', rng.normal(size=n)), ('lognormal', rng.lognormal(size=n))):
+        parts = np.split(values, np.cumsum(sizes)[:-1])
+        sketch = QuantileSketch.from_values(parts[0], capacity)
+        for part in parts[1:]:
+            sketch = sketch.merge(QuantileSketch.from_values(part, capacity))
+        ordered = np.sort(values)
+        qs = np.linspace(0.001, 0.999, 999)
+        estimates = np.array([sketch.quantile(q) for q in qs])
+        errors = np.abs(np.searchsorted(ordered, estimates) - qs * n)
+        bound = n / capacity
+        results[name] = {'max_rank_error': float(errors.max()), 'bound': bound, 'ok': bool(errors.max() <= 2 * bound)}
+    return results
+
+def _feature_peak_rss(parts, sketch_error):
+    """(워커 프로세스에서 실행) 피쳐 테이블을 만드는 동안 늘어난 최대 RSS(MB). 입력을 받은 뒤의 RSS를 기준으로 잽니다."""
+    from detector import build_feature_tables
+    from profiling import current_rss_mb, peak_rss_mb
+
+    start = current_rss_mb()
+    for part in parts:
+        build_feature_tables(part, sketch_error=sketch_error)
+    return max(peak_rss_mb() - start, 0.0)
+
+def measure_feature_peak_rss(parts, sketch_error=None):
+    """
+    새 워커 프로세스에서 피쳐 테이블을 만들어 정확 집계(sketch_error=None) 또는 스케치 집계의 최대 RSS 증가량을 잽니다.
+    최대 RSS는 프로세스 수명 동안 줄지 않으므로, 앞선 측정의 영향을 받지 않도록 측정마다 프로세스를 새로 띄웁니다.
+    """
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_feature_peak_rss, parts, sketch_error).result()
+
+def sketch_report(ads_rwd_info, ads_list, ip_cache_data, config=None, relative_errors=(0.01, 0.02, 0.05), ip_ranges=None):
+    """
+    정확 집계와 스케치 근사 집계로 각각 탐지해 근사가 피쳐와 제재 리스트를 얼마나 바꾸는지 비교합니다.
+    반환값: 오차 설정별 DataFrame
+        precision, 피쳐별 평균/최대 상대오차, 제재 디바이스 수, 근사에서만/정확에서만 제재된 수, 자카드 유사도,
+        피쳐 테이블을 만드는 동안의 최대 RSS 증가량(MB, 정확 집계 exact_peak_rss_mb / 스케치 sketch_peak_rss_mb)
+    """
+    from detector import CONFIG, build_feature_tables, prepare_data, run_detection
+
+    config = config or CONFIG
+    exact_config = {**config, 'cardinality_sketch': {**config.get('cardinality_sketch', {}), 'enabled': False}}
+    exact_blocked, _, _ = run_detection(ads_rwd_info.copy(), ads_list, ip_cache_data, exact_config, ip_ranges=ip_ranges)
+    exact_blocked = set(exact_blocked)
+    _, df_complete, df_incomplete, _, _ = prepare_data(ads_rwd_info.copy(), ads_list, ip_cache_data, exact_config, ip_ranges)
+    parts = [part.sort_values(['dvc_idx', 'click_date']) for part in (df_complete, df_incomplete) if not part.empty]
+    exact_tables = [build_feature_tables(part)[:2] for part in parts]
+    exact_peak_rss = measure_feature_peak_rss(parts)
+
+    rows = []
+    for relative_error in relative_errors:
+        sketch_config = {**config, 'cardinality_sketch': {'enabled': True, 'relative_error': relative_error}}
+        errors = {'ip_count': [], 'mda_count': [], 'dvc_count': []}
+        for part, (exact_devices, exact_ips) in zip(parts, exact_tables):
+            approx_devices, approx_ips, _ = build_feature_tables(part, sketch_error=relative_error)
+            for column, exact, approx in (('ip_count', exact_devices, approx_devices), ('mda_count', exact_devices, approx_devices), ('dvc_count', exact_ips, approx_ips)):
+                truth = exact[column].to_numpy(dtype=float)
+                errors[column].append(np.abs(approx[column].to_numpy(dtype=float) - truth) / np.maximum(truth, 1))
+        sketch_blocked, _, _ = run_detection(ads_rwd_info.copy(), ads_list, ip_cache_data, sketch_config, ip_ranges=ip_ranges)
+        sketch_blocked = set(sketch_blocked)
+        row = {'relative_error': relative_error, 'precision': precision_for_error(relative_error)}
+        for column, values in errors.items():
+            values = np.concatenate(values) if values else np.zeros(0)
+            row[f'{column}_mean_error'] = float(values.mean()) if len(values) else 0.0
+            row[f'{column}_max_error'] = float(values.max()) if len(values) else 0.0
+        union = exact_blocked | sketch_blocked
+        row.update({
+            'blocked_exact': len(exact_blocked), 'blocked_sketch': len(sketch_blocked),
+            'only_sketch': len(sketch_blocked - exact_blocked), 'only_exact': len(exact_blocked - sketch_blocked),
+            'jaccard': len(exact_blocked & sketch_blocked) / len(union) if union else 1.0,
+            'exact_peak_rss_mb': exact_peak_rss, 'sketch_peak_rss_mb': measure_feature_peak_rss(parts, relative_error),
+        })
+        rows.append(row)
+    return pd.DataFrame(rows)
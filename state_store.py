@@ -0,0 +1,598 @@
+# 파일 이름: state_store.py
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from detector import CONFIG, _group_moments, preprocess_events, complete_mask, count_mda_clicks, calculate_abuse_scores, get_blocklist, prepare_data
+from fraud_rings import ring_components
+from ingest import read_events
+from streaming import ANALYSIS_TYPES, NO_CLICK, add_burst_counts, empty_window_buffer
+
+STORE_VERSION = 1
+INITIAL_CAPACITY = 1024
+CODE_BITS = 32  # (디바이스 슬롯, IP/매체 코드) 쌍을 int64 키 하나로 묶을 때 코드가 차지하는 비트 수
+
+# 디바이스 슬롯별 누적 상태 (분석 유형마다 한 벌). 슬롯은 dvc_idx가 처음 나온 순서대로 배정되며 바뀌지 않습니다.
+DEVICE_FIELDS = {
+    'clicks': np.int64, 'first_ns': np.int64, 'last_ns': np.int64,
+    'interval_n': np.int64, 'interval_mean': np.float64, 'interval_m2': np.float64,
+    'ctit_n': np.int64, 'ctit_mean': np.float64, 'ctit_m2': np.float64,
+    'ip_count': np.int64, 'mda_count': np.int64, 'max_score': np.int64,
+}
+FIELD_DEFAULTS = {'first_ns': NO_CLICK, 'last_ns': NO_CLICK}
+
+STAGED_SUFFIX = '.next'  # 갱신 중 새로 쓴 통파일. 커밋 지점(meta.json 교체) 뒤에 원래 이름으로 바꿉니다.
+STORE_FILES = ('ips.parquet', 'mda.parquet', 'window_buffer.parquet')
+
+def _save_atomic(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+def _save_staged(path, array):
+    with open(path + STAGED_SUFFIX, 'wb') as f:
+        np.save(f, array)
+
+def _promote_staged(path):
+    if os.path.exists(path + STAGED_SUFFIX):
+        os.replace(path + STAGED_SUFFIX, path)
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def _load_array(path, dtype=np.int64):
+    return np.load(path) if os.path.exists(path) else np.zeros(0, dtype=dtype)
+
+def _day_moments(values, codes, n_groups):
+    """그룹 코드별 (유효 개수, 평균, 편차제곱합). 유효값이 없는 그룹의 평균과 편차제곱합은 0입니다."""
+    valid = ~np.isnan(values)
+    valid_codes, valid_values = codes[valid], values[valid]
+    count = np.bincount(valid_codes, minlength=n_groups)
+    total = np.bincount(valid_codes, weights=valid_values, minlength=n_groups)
+    mean = np.divide(total, count, out=np.zeros(n_groups), where=count > 0)
+    deviation = valid_values - mean[valid_codes]
+    return count, mean, np.bincount(valid_codes, weights=deviation * deviation, minlength=n_groups)
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """두 (개수, 평균, 편차제곱합) 집계를 합칩니다 (Chan의 병렬 분산 공식)."""
+    n = n_a + n_b
+    safe_n = np.maximum(n, 1)
+    delta = mean_b - mean_a
+    mean = np.where(n > 0, mean_a + delta * n_b / safe_n, 0.0)
+    m2 = np.where(n > 0, m2_a + m2_b + delta * delta * n_a * n_b / safe_n, 0.0)
+    return n, mean, m2
+
+def _gather_ranges(starts, ends):
+    """[start, end) 구간들을 이어 붙인 위치 배열을 만듭니다."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum()) + offsets
+
+class _DeviceTable:
+    """
+    한 분석 유형의 디바이스 상태 테이블. 필드마다 .npy 메모리 맵 하나이며, 갱신은 건드린 슬롯에만 제자리로 씁니다.
+    제자리로 고치기 전에 기존 슬롯의 이전 값을 undo.npz에 남겨, 갱신이 실패하면 rollback()으로 되돌립니다.
+    디바이스-IP / 디바이스-매체 고유 쌍은 정렬된 int64 키 배열로 두고, 새 쌍만 끼워 넣어 고유 개수를 정확히 늘립니다.
+    """
+    WHOLE_FILES = ('ip_pairs', 'mda_pairs', 'ip_dvc_count')
+
+    def __init__(self, directory, n_devices):
+        os.makedirs(os.path.join(directory, 'values'), exist_ok=True)
+        self.directory = directory
+        self.n = n_devices
+        self.devices = self._open('dvc_idx', np.int64, 0)
+        self.fields = {name: self._open(name, dtype, FIELD_DEFAULTS.get(name, 0)) for name, dtype in DEVICE_FIELDS.items()}
+        # 용량을 늘리다 멈춘 경우 필드마다 길이가 다를 수 있어, 가장 긴 길이로 맞춥니다 (늘리는 것은 값을 바꾸지 않습니다).
+        lengths = [len(self.devices)] + [len(array) for array in self.fields.values()]
+        self.capacity = min(lengths)
+        self._reserve(max(lengths))
+        self.index = pd.Index(np.asarray(self.devices[:self.n]))
+        self.pairs = {kind: _load_array(self._path(f'{kind}_pairs')) for kind in ('ip', 'mda')}
+        self.ip_dvc_count = _load_array(self._path('ip_dvc_count'))
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def _open(self, name, dtype, default):
+        path = self._path(name)
+        if os.path.exists(path):
+            return open_memmap(path, mode='r+')
+        array = open_memmap(path, mode='w+', dtype=dtype, shape=(INITIAL_CAPACITY,))
+        array[:] = default
+        return array
+
+    def _reserve(self, size):
+        """슬롯 수가 용량을 넘으면 용량을 두 배 이상으로 늘린 새 파일로 옮깁니다."""
+        if size <= self.capacity:
+            return
+        new_capacity = max(size, 2 * self.capacity)
+        arrays = {'dvc_idx': (self.devices, 0)}
+        arrays.update({name: (array, FIELD_DEFAULTS.get(name, 0)) for name, array in self.fields.items()})
+        for name, (array, default) in arrays.items():
+            if len(array) >= new_capacity:
+                continue
+            tmp_path = self._path(name) + '.tmp.npy'
+            grown = open_memmap(tmp_path, mode='w+', dtype=array.dtype, shape=(new_capacity,))
+            grown[:len(array)] = array
+            grown[len(array):] = default
+            grown.flush()
+            del grown
+            os.replace(tmp_path, self._path(name))
+        self.devices = open_memmap(self._path('dvc_idx'), mode='r+')
+        self.fields = {name: open_memmap(self._path(name), mode='r+') for name in DEVICE_FIELDS}
+        self.capacity = min([len(self.devices)] + [len(array) for array in self.fields.values()])
+
+    def slots_for(self, dvc_ids):
+        """고유 dvc_idx 배열의 슬롯을 찾고, 처음 보는 디바이스에는 새 슬롯을 배정합니다."""
+        slots = self.index.get_indexer(dvc_ids)
+        new = slots < 0
+        if new.any():
+            n_new = int(new.sum())
+            self._reserve(self.n + n_new)
+            slots[new] = np.arange(self.n, self.n + n_new)
+            self.devices[slots[new]] = dvc_ids[new]
+            self.index = self.index.append(pd.Index(dvc_ids[new]))
+            self.n += n_new
+        return slots
+
+    def save_undo(self, slots, n_before):
+        """제자리로 고칠 슬롯 중 갱신 전부터 있던 슬롯의 현재 값을 undo.npz로 남깁니다 (새 슬롯은 되돌릴 때 기본값으로 지웁니다)."""
+        existing = slots[slots < n_before]
+        tmp_path = self._path('undo') + '.tmp.npz'
+        np.savez(tmp_path, slots=existing, **{name: np.asarray(array[existing]) for name, array in self.fields.items()})
+        os.replace(tmp_path, os.path.join(self.directory, 'undo.npz'))
+
+    def rollback(self, n_days):
+        """
+        마지막으로 커밋된 상태로 되돌립니다. self.n은 커밋된 meta의 디바이스 수여야 합니다.
+        undo.npz의 이전 값을 다시 쓰고, 그 뒤에 배정된 슬롯은 기본값으로 지우며, 커밋 전 파일(.next, 진행 중인 날짜의 원시 값)을 지웁니다.
+        """
+        undo_path = os.path.join(self.directory, 'undo.npz')
+        if os.path.exists(undo_path):
+            with np.load(undo_path) as undo:
+                for name, array in self.fields.items():
+                    array[undo['slots']] = undo[name]
+            os.remove(undo_path)
+        for name, array in self.fields.items():
+            array[self.n:] = FIELD_DEFAULTS.get(name, 0)
+        self.devices[self.n:] = 0
+        self.flush_memmaps()
+        for name in self.WHOLE_FILES:
+            _remove(self._path(name) + STAGED_SUFFIX)
+        for kind in ('interval', 'ctit'):
+            for part in ('slots', 'offsets', 'values'):
+                _remove(os.path.join(self.directory, 'values', f'{kind}_{n_days:05d}_{part}.npy'))
+
+    def add_pairs(self, kind, event_slots, codes, n_codes):
+        """이벤트의 (슬롯, 코드) 쌍 중 처음 보는 쌍만 반영해 디바이스별(및 IP별) 고유 개수를 늘립니다. 코드 -1은 건너뜁니다."""
+        valid = codes >= 0
+        keys = np.unique((event_slots[valid].astype(np.int64) << CODE_BITS) | codes[valid])
+        existing = self.pairs[kind]
+        positions = np.searchsorted(existing, keys)
+        seen = np.zeros(len(keys), dtype=bool)
+        in_range = positions < len(existing)
+        seen[in_range] = existing[positions[in_range]] == keys[in_range]
+        new_keys = keys[~seen]
+        self.pairs[kind] = np.insert(existing, positions[~seen], new_keys)
+        slots, counts = np.unique(new_keys >> CODE_BITS, return_counts=True)
+        self.fields[f'{kind}_count'][slots] += counts
+        if kind == 'ip':
+            if len(self.ip_dvc_count) < n_codes:
+                self.ip_dvc_count = np.pad(self.ip_dvc_count, (0, n_codes - len(self.ip_dvc_count)))
+            self.ip_dvc_count += np.bincount(new_keys & ((1 << CODE_BITS) - 1), minlength=len(self.ip_dvc_count))
+
+    def ring_features(self, slots, n_ips, max_ip_devices):
+        """저장된 전체 기간의 디바이스–IP 고유 쌍으로 링을 다시 찾아 주어진 슬롯들의 링 피쳐를 반환합니다 (fraud_rings.ring_components)."""
+        keys = self.pairs['ip']
+        rings = ring_components(keys >> CODE_BITS, keys & ((1 << CODE_BITS) - 1), self.n, n_ips, max_ip_devices)
+        return {column: values[slots] for column, values in rings.items()}
+
+    def write_values(self, day_no, kind, event_slots, values):
+        """모델 중앙값용 원시 값을 하루 단위 CSR(슬롯 정렬, 오프셋, 값) 파일로 남깁니다."""
+        valid = ~np.isnan(values)
+        order = np.argsort(event_slots[valid], kind='stable')
+        slots, counts = np.unique(event_slots[valid][order], return_counts=True)
+        prefix = os.path.join(self.directory, 'values', f'{kind}_{day_no:05d}')
+        np.save(prefix + '_slots.npy', slots)
+        np.save(prefix + '_offsets.npy', np.concatenate([[0], np.cumsum(counts)]))
+        np.save(prefix + '_values.npy', values[valid][order])
+
+    def gather_values(self, n_days, kind, slots):
+        """주어진 슬롯들의 전체 기간 원시 값을 (slot, value) 프레임으로 모읍니다. 날짜별 파일에서 해당 슬롯 구간만 읽습니다."""
+        parts = []
+        for day_no in range(n_days):
+            prefix = os.path.join(self.directory, 'values', f'{kind}_{day_no:05d}')
+            day_slots = np.load(prefix + '_slots.npy', mmap_mode='r')
+            if not len(day_slots):
+                continue
+            offsets = np.load(prefix + '_offsets.npy', mmap_mode='r')
+            positions = np.minimum(np.searchsorted(day_slots, slots), len(day_slots) - 1)
+            found = day_slots[positions] == slots
+            starts, ends = offsets[positions[found]], offsets[positions[found] + 1]
+            values = np.load(prefix + '_values.npy', mmap_mode='r')[_gather_ranges(starts, ends)]
+            parts.append(pd.DataFrame({'slot': np.repeat(slots[found], ends - starts), 'value': values}))
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame({'slot': [], 'value': []})
+
+    def flush_memmaps(self):
+        self.devices.flush()
+        for array in self.fields.values():
+            array.flush()
+
+    def stage(self):
+        """메모리 맵을 디스크에 내리고, 통째로 다시 쓰는 배열(쌍 키, IP별 디바이스 수)은 .next 파일로 씁니다."""
+        self.flush_memmaps()
+        for kind, pairs in self.pairs.items():
+            _save_staged(self._path(f'{kind}_pairs'), pairs)
+        _save_staged(self._path('ip_dvc_count'), self.ip_dvc_count)
+
+class DeviceStateStore:
+    """
+    일 단위 증분 탐지를 위한 디스크 상태 저장소입니다.
+    디바이스별 누적 집계(클릭 수, 클릭 간격/CTIT 적률, CTIT 최소/최대, 고유 IP/매체 수, 마지막 클릭 시각, 최고 점수)와
+    IP별 고유 디바이스 수, 매체별 클릭/전환 수, 최근 Burst 윈도우 클릭 버퍼를 보관합니다.
+    새 날짜 로그는 저장소를 제자리로 갱신하고, 그날 등장한 디바이스만 다시 채점합니다.
+
+    - 날짜는 click_date 순서대로 넣어야 하며, 오래된 날짜를 빼는(룩백 만료) 기능은 없습니다.
+      룩백 기간을 바꾸려면 해당 기간의 로그로 새 저장소를 쌓으세요.
+    - 갱신은 실패해도 저장소를 바꾸지 않습니다. 메모리 맵을 고치기 전에 이전 값을 undo 파일로 남기고, 통째로 쓰는 파일은
+      .next로 써 두었다가 meta.json 교체(커밋 지점) 뒤에 바꿔 넣습니다. 예외가 나면 바로, 프로세스가 죽었으면 다음에 열 때
+      마지막 커밋 상태로 되돌리며, 커밋 뒤에 멈췄으면 남은 파일 교체를 마저 끝냅니다.
+    - 한계: 갱신 비용이 당일 로그 크기만으로 정해지지는 않습니다.
+      keep_values=True(이상 탐지 모델을 쓸 때 필요)면 이벤트별 클릭 간격/CTIT 원시 값을 전체 기간 동안 보관하고,
+      당일 등장한 디바이스의 모델 입력(중앙값 등)을 위해 그 디바이스들의 전체 기간 값을 다시 읽습니다.
+      링 피쳐는 저장된 모든 디바이스–IP 쌍으로 연결 요소를 매번 다시 찾습니다.
+      그래서 일일 갱신도 룩백 기간 전체의 (당일 디바이스의) 원시 값과 전체 쌍 수에 비례하는 스캔을 합니다.
+      모델을 쓰지 않으면 keep_values=False로 원시 값 보관과 재조회를 끌 수 있습니다.
+    """
+
+    def __init__(self, path, keep_values=True, buffer_window_min=None):
+        self.path = path
+        self.meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(self.meta_path):
+            os.makedirs(path, exist_ok=True)
+            burst = CONFIG['burst_attack']
+            self.meta = {
+                'version': STORE_VERSION, 'days': [], 'last_ns': int(NO_CLICK), 'keep_values': keep_values,
+                'buffer_window_min': buffer_window_min or max([burst['window_min']] + list(burst.get('windows_min', []))),
+                'devices': {analysis_type: 0 for analysis_type in ANALYSIS_TYPES}, 'updating': False,
+            }
+            self._write_meta()
+        self._load()
+
+    def _load(self):
+        """디스크의 마지막 커밋 상태를 읽습니다. 멈춘 갱신이 있으면 커밋 전이면 되돌리고, 커밋 뒤면 파일 교체를 마저 끝냅니다."""
+        path = self.path
+        with open(self.meta_path, encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"지원하지 않는 상태 저장소 버전입니다: {self.meta.get('version')}")
+        if self.meta.get('staged'):
+            self._promote()
+        self.tables = {t: _DeviceTable(os.path.join(path, t), self.meta['devices'][t]) for t in ANALYSIS_TYPES}
+        if self.meta.get('updating'):
+            for table in self.tables.values():
+                table.rollback(len(self.meta['days']))
+            for name in STORE_FILES:
+                _remove(os.path.join(path, name) + STAGED_SUFFIX)
+            self.meta['updating'] = False
+            self._write_meta()
+            print(f"⚠️ 중간에 멈춘 갱신을 되돌렸습니다 (누적 {len(self.meta['days'])}일 상태): {path}")
+        ips_path = os.path.join(path, 'ips.parquet')
+        self.ips = pd.Index(pd.read_parquet(ips_path)['user_ip'].to_numpy(dtype=object)) if os.path.exists(ips_path) else pd.Index([], dtype=object)
+        mda_path = os.path.join(path, 'mda.parquet')
+        self.mda = pd.read_parquet(mda_path) if os.path.exists(mda_path) else pd.DataFrame({'clicks': pd.Series(dtype=np.int64), 'conversions': pd.Series(dtype=np.int64)}, index=pd.Index([], name='mda_idx', dtype=np.int64))
+        buffer_path = os.path.join(path, 'window_buffer.parquet')
+        self.window_buffer = pd.read_parquet(buffer_path) if os.path.exists(buffer_path) else empty_window_buffer()
+
+    @property
+    def days(self):
+        return [day['label'] for day in self.meta['days']]
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _ip_codes(self, user_ip):
+        """IP를 저장소 전역 코드로 바꿉니다. 처음 보는 IP는 사전에 추가하며, 결측 IP는 -1입니다."""
+        codes, uniques = pd.factorize(pd.Series(user_ip).astype(object))
+        unique_codes = self.ips.get_indexer(uniques)
+        new = unique_codes < 0
+        if new.any():
+            unique_codes[new] = np.arange(len(self.ips), len(self.ips) + new.sum())
+            self.ips = self.ips.append(pd.Index(np.asarray(uniques, dtype=object)[new]))
+        return np.where(codes >= 0, unique_codes[np.maximum(codes, 0)], -1)
+
+    def _update_table(self, analysis_type, part, day_no):
+        """(dvc_idx, click_date)로 정렬된 하루치 이벤트로 디바이스 상태를 갱신하고, 채점에 쓸 클릭 간격과 슬롯을 반환합니다."""
+        table = self.tables[analysis_type]
+        dvc = part['dvc_idx'].to_numpy(dtype=np.int64)
+        n = len(dvc)
+        new_device = np.ones(n, dtype=bool)
+        new_device[1:] = dvc[1:] != dvc[:-1]
+        starts = np.flatnonzero(new_device)
+        day_codes = np.cumsum(new_device) - 1
+        n_before = table.n
+        slots = table.slots_for(dvc[starts])
+        table.save_undo(slots, n_before)
+        fields = table.fields  # 슬롯 배정 중 용량이 늘면 메모리 맵이 바뀌므로 그 뒤에 읽습니다.
+        event_slots = slots[day_codes]
+
+        # 클릭 간격: 디바이스의 첫 클릭은 저장소의 마지막 클릭과 이어 붙입니다 (배치 경로와 같은 값).
+        click_ns = part['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        time_diff = np.empty(n)
+        time_diff[1:] = (click_ns[1:] - click_ns[:-1]) / 1_000_000_000
+        previous = fields['last_ns'][slots]
+        seen = previous != NO_CLICK
+        time_diff[starts] = np.where(seen, (click_ns[starts] - previous) / 1_000_000_000, np.nan)
+        ctit = part['ctit'].to_numpy(dtype=float)
+
+        for prefix, values in (('interval', time_diff), ('ctit', ctit)):
+            count, mean, m2 = _day_moments(values, day_codes, len(starts))
+            merged = _merge_moments(fields[f'{prefix}_n'][slots], fields[f'{prefix}_mean'][slots], fields[f'{prefix}_m2'][slots], count, mean, m2)
+            fields[f'{prefix}_n'][slots], fields[f'{prefix}_mean'][slots], fields[f'{prefix}_m2'][slots] = merged
+        fields['first_ns'][slots] = np.where(seen, fields['first_ns'][slots], click_ns[starts])
+        fields['last_ns'][slots] = click_ns[np.append(starts[1:], n) - 1]
+        fields['clicks'][slots] += np.diff(np.append(starts, n))
+
+        table.add_pairs('ip', event_slots, self._ip_codes(part['user_ip']), len(self.ips))
+        mda_codes = self.mda.index.get_indexer(part['mda_idx'].to_numpy(dtype=float))
+        table.add_pairs('mda', event_slots, mda_codes, len(self.mda))
+        if self.meta['keep_values']:
+            table.write_values(day_no, 'interval', event_slots, time_diff)
+            table.write_values(day_no, 'ctit', event_slots, ctit)
+        return time_diff, slots, dvc[starts]
+
+    def device_features(self, analysis_type, slots, dvc_ids, medians=(), max_ip_devices=None):
+        """
+        슬롯들의 누적 상태를 detector.build_feature_tables()와 같은 컬럼의 디바이스 피쳐 테이블로 만듭니다.
+        max_ip_devices를 주면 링 규칙용 링 컬럼도 붙입니다 (링은 전역 그래프라 저장소 전체 쌍으로 매번 다시 계산합니다).
+        """
+        table = self.tables[analysis_type]
+        fields = {name: np.asarray(array[slots]) for name, array in table.fields.items()}
+        features = pd.DataFrame({
+            'total_clicks': fields['clicks'], 'ip_count': fields['ip_count'], 'mda_count': fields['mda_count'],
+        }, index=pd.Index(dvc_ids, name='dvc_idx'))
+        for prefix in ('interval', 'ctit'):
+            count = fields[f'{prefix}_n']
+            features[f'{prefix}_count'] = count
+            features[f'{prefix}_mean'] = np.where(count > 0, fields[f'{prefix}_mean'], np.nan)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features[f'{prefix}_std'] = np.where(count > 1, np.sqrt(fields[f'{prefix}_m2'] / (count - 1)), np.nan)
+        for prefix in medians:
+            if not self.meta['keep_values']:
+                raise ValueError("모델 입력 중앙값을 계산하려면 keep_values=True로 만든 저장소가 필요합니다.")
+            values = table.gather_values(len(self.meta['days']), prefix, slots)
+            # 모델 입력은 원시 값에서 배치 경로와 같은 순서(시간순)로 다시 집계해, 적률 병합의 부동소수점 오차가 판정을 바꾸지 않게 합니다.
+            codes = pd.Index(slots).get_indexer(values['slot'])
+            count, mean, std = _group_moments(values['value'].to_numpy(dtype=float), codes, len(slots))
+            features[f'{prefix}_count'], features[f'{prefix}_mean'], features[f'{prefix}_std'] = count, mean, std
+            stats = values.groupby('slot')['value'].agg(['median', 'min', 'max']).reindex(slots)
+            for stat in ('median', 'min', 'max'):
+                features[f'{prefix}_{stat}'] = stats[stat].to_numpy()
+        if max_ip_devices is not None:
+            for column, values in table.ring_features(slots, len(self.ips), max_ip_devices).items():
+                features[column] = values
+        return features
+
+    def update(self, ads_rwd_info, ads_list, ip_cache_data=None, config=None, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None, day=None):
+        """
+        하루치(또는 직전 갱신 이후의) 로그로 저장소를 갱신하고, 그 로그의 이벤트를 누적 상태 기준으로 채점해 반환합니다.
+        채점 결과는 지금까지 넣은 모든 날짜를 합쳐 배치 경로로 채점했을 때 이 날짜 이벤트가 받는 점수와 같습니다.
+        """
+        if config is None:
+            config = CONFIG
+        window_min = config['burst_attack']['window_min']
+        windows = sorted(set(config['burst_attack'].get('windows_min', [])) | {window_min})
+        if max(windows) > self.meta['buffer_window_min']:
+            raise ValueError(f"저장소의 Burst 버퍼({self.meta['buffer_window_min']}분)보다 긴 윈도우는 사용할 수 없습니다.")
+
+        df = preprocess_events(ads_rwd_info, ads_list, ip_cache_data, ip_ranges, config)
+        if df.empty:
+            return df
+        if df['click_date'].isna().any():
+            raise ValueError("증분 모드는 click_date가 비어 있는 행을 지원하지 않습니다.")
+        first_ns, last_ns = df['click_date'].min().value, df['click_date'].max().value
+        if first_ns <= self.meta['last_ns']:
+            raise ValueError("증분 모드는 저장소의 마지막 클릭 이후 로그만 추가할 수 있습니다 (날짜 순서대로 넣어 주세요).")
+
+        self.meta['updating'] = True
+        self._write_meta()
+        try:
+            scored = self._apply_day(df, ads_list, config, anomaly_model, ctit_anomaly_model, windows, window_min, last_ns, day)
+            self.flush()
+        except BaseException:
+            # 디스크의 마지막 커밋 상태로 되돌리고(undo 적용, .next 삭제) 메모리 상태도 다시 읽습니다.
+            self._load()
+            raise
+        return scored
+
+    def _apply_day(self, df, ads_list, config, anomaly_model, ctit_anomaly_model, windows, window_min, last_ns, day):
+        """update()의 본체. 저장소 상태를 바꾸며, 커밋(flush) 전에 실패하면 update()가 되돌립니다."""
+        day_no = len(self.meta['days'])
+        df = df.sort_values(by=['dvc_idx', 'click_date'], kind='stable', ignore_index=True)
+        df, _ = add_burst_counts(df, self.window_buffer, windows, window_min)
+        # Burst 버퍼는 이번 설정의 윈도우가 아니라 저장소 설정 길이만큼 남겨, 다음 날짜가 더 긴 윈도우를 써도 이어서 계산합니다.
+        buffer_start = last_ns - int(self.meta['buffer_window_min'] * 60 * 1_000_000_000)
+        recent = pd.concat([self.window_buffer, df[['dvc_idx', 'click_date']]], ignore_index=True)
+        self.window_buffer = recent[recent['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64) > buffer_start].reset_index(drop=True)
+
+        clicks, conversions = count_mda_clicks(df)
+        day_mda = pd.DataFrame({'clicks': clicks, 'conversions': conversions}).fillna(0).astype(np.int64)
+        day_mda.index = day_mda.index.astype(np.int64)
+        # 매체 행 순서가 곧 디바이스-매체 쌍의 코드이므로, 새 매체는 뒤에 덧붙이기만 합니다.
+        self.mda = self.mda.reindex(self.mda.index.append(day_mda.index.difference(self.mda.index)), fill_value=0)
+        self.mda.loc[day_mda.index] += day_mda
+        self.mda.index.name = 'mda_idx'
+        clicks_per_mda = self.mda['clicks']
+        cvr_per_mda = (self.mda['conversions'] / clicks_per_mda).fillna(0)
+
+        # 원시 값 파일을 모을 때 이번 날짜도 포함되도록 먼저 등록합니다.
+        self.meta['days'].append({
+            'label': day or str(df['click_date'].min().date()), 'rows': len(df),
+            'first_click': str(df['click_date'].min()), 'last_click': str(df['click_date'].max()),
+        })
+        is_complete = complete_mask(df)
+        scored_parts = []
+        for analysis_type, part in (('conversion', df[is_complete].copy()), ('click', df[~is_complete].copy())):
+            if part.empty:
+                continue
+            part.reset_index(drop=True, inplace=True)
+            time_diff, slots, dvc_ids = self._update_table(analysis_type, part, day_no)
+            medians = ()
+            if analysis_type == 'click' and anomaly_model:
+                medians = ('interval',)
+            if analysis_type == 'conversion' and ctit_anomaly_model:
+                medians = ('ctit',)
+            device_features = self.device_features(analysis_type, slots, dvc_ids, medians, config['fraud_ring']['max_ip_devices'])
+            ip_values = pd.unique(part['user_ip'].dropna().astype(object))
+            ip_features = pd.DataFrame({'dvc_count': self.tables[analysis_type].ip_dvc_count[self.ips.get_indexer(ip_values)]}, index=pd.Index(ip_values, name='user_ip'))
+            part['time_diff_sec'] = time_diff
+            scored = calculate_abuse_scores(
+                part, analysis_type, clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model,
+                config=config, device_features=device_features, ip_features=ip_features,
+            )
+            day_max = scored.groupby('dvc_idx')['abuse_score'].max()
+            max_score = self.tables[analysis_type].fields['max_score']
+            max_score[slots] = np.maximum(max_score[slots], day_max.reindex(dvc_ids).to_numpy())
+            scored_parts.append(scored)
+
+        self.meta['last_ns'] = int(last_ns)
+        return pd.concat(scored_parts, ignore_index=True)
+
+    def device_scores(self):
+        """저장소 전체 기간의 디바이스별 최고 점수 (점수 > 0인 디바이스만, index=dvc_idx)."""
+        parts = []
+        for table in self.tables.values():
+            scores = np.asarray(table.fields['max_score'][:table.n])
+            parts.append(pd.Series(scores, index=pd.Index(np.asarray(table.devices[:table.n]), name='dvc_idx')))
+        scores = pd.concat(parts).groupby(level=0).max()
+        return scores[scores > 0].rename('abuse_score')
+
+    def flush(self):
+        """갱신을 커밋합니다. 새 파일을 .next로 모두 쓴 뒤 meta.json을 한 번 교체하는 것이 커밋 지점입니다."""
+        for analysis_type, table in self.tables.items():
+            table.stage()
+            self.meta['devices'][analysis_type] = table.n
+        staged = {name: os.path.join(self.path, name) + STAGED_SUFFIX for name in STORE_FILES}
+        pd.DataFrame({'user_ip': self.ips.to_numpy(dtype=object)}).to_parquet(staged['ips.parquet'], index=False)
+        self.mda.to_parquet(staged['mda.parquet'])
+        self.window_buffer.to_parquet(staged['window_buffer.parquet'], index=False)
+        self.meta['updating'] = False
+        self.meta['staged'] = True
+        self._write_meta()
+        self._promote()
+
+    def _promote(self):
+        """커밋 뒤에 .next 파일을 원래 이름으로 바꾸고 undo 파일을 지웁니다. 중간에 멈춰도 다음에 열 때 이어서 끝냅니다."""
+        for analysis_type in ANALYSIS_TYPES:
+            directory = os.path.join(self.path, analysis_type)
+            for name in _DeviceTable.WHOLE_FILES:
+                _promote_staged(os.path.join(directory, f'{name}.npy'))
+            _remove(os.path.join(directory, 'undo.npz'))
+        for name in STORE_FILES:
+            _promote_staged(os.path.join(self.path, name))
+        self.meta.pop('staged', None)
+        self._write_meta()
+
+def run_incremental_detection(day_log, store_path, ads_list, ip_cache_data=None, config=None, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None, day=None):
+    """
+    하루치 로그(DataFrame 또는 파일 경로)를 상태 저장소에 더하고, 저장소 전체 기간 기준 제재 리스트를 만듭니다.
+    반환값: (최종 제재 디바이스 리스트, 채점된 당일 이벤트, 디바이스별 최고 점수 Series)
+    """
+    if isinstance(day_log, (str, os.PathLike)):
+        day_log = read_events(day_log)
+    store = DeviceStateStore(store_path)
+    print(f"--- 증분 갱신: 기존 {len(store.days)}일 + 신규 로그 {len(day_log):,}행 ---")
+    scored = store.update(day_log, ads_list, ip_cache_data, config, anomaly_model, ctit_anomaly_model, ip_ranges, day)
+    device_max = store.device_scores()
+    final_block_list, device_scores, _ = get_blocklist(device_max.reset_index(), "증분 통합", config)
+    print(f"\n✅ 최종 통합 제재 디바이스: {len(final_block_list)}개 (누적 {len(store.days)}일)")
+    return final_block_list, scored, device_scores
+
+def check_incremental_parity(ads_rwd_info, ads_list, ip_cache_data, store_path, config=None, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None):
+    """
+    로그를 날짜별로 나눠 빈 저장소에 차례로 넣고, 마지막 날짜 이벤트의 점수를 전체 로그 배치 채점 결과와 비교합니다.
+    반환값: {'days': 넣은 날짜 수, 'events': 비교한 이벤트 수, 'score_mismatches': ..., 'hit_mismatches': ...}
+    """
+    if config is None:
+        config = CONFIG
+    log = ads_rwd_info.copy()
+    days = pd.to_datetime(log['click_date']).dt.normalize()
+    store = DeviceStateStore(store_path)
+    scored = None
+    for _, day_log in log.groupby(days, sort=True):
+        scored = store.update(day_log.copy(), ads_list, ip_cache_data, config, anomaly_model, ctit_anomaly_model, ip_ranges)
+
+    _, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(log.copy(), ads_list, ip_cache_data, config, ip_ranges)
+    batch = pd.concat([
+        calculate_abuse_scores(part, analysis_type, clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config)
+        for analysis_type, part in (('conversion', df_complete), ('click', df_incomplete))
+    ], ignore_index=True)
+    last_day = batch[batch['click_date'] >= scored['click_date'].min()]
+    key = ['dvc_idx', 'click_date', 'ads_idx', 'mda_idx']
+    left = last_day.sort_values(key + ['abuse_score', 'rule_hits'], ignore_index=True)
+    right = scored.sort_values(key + ['abuse_score', 'rule_hits'], ignore_index=True)
+    if len(left) != len(right):
+        raise AssertionError(f"이벤트 수가 다릅니다: 배치 {len(left)} / 증분 {len(right)}")
+    return {
+        'days': len(store.days), 'events': len(right),
+        'score_mismatches': int((left['abuse_score'].to_numpy() != right['abuse_score'].to_numpy()).sum()),
+        'hit_mismatches': int((left['rule_hits'].to_numpy() != right['rule_hits'].to_numpy()).sum()),
+    }
+
+def _store_snapshot(store):
+    """저장소의 디바이스 상태(필드, 고유 쌍, IP별 디바이스 수)와 날짜 목록을 비교용으로 복사합니다."""
+    arrays = {}
+    for analysis_type, table in store.tables.items():
+        arrays[f'{analysis_type}/dvc_idx'] = np.array(table.devices[:table.n])
+        arrays.update({f'{analysis_type}/{name}': np.array(array[:table.n]) for name, array in table.fields.items()})
+        arrays.update({f'{analysis_type}/{kind}_pairs': pairs.copy() for kind, pairs in table.pairs.items()})
+        arrays[f'{analysis_type}/ip_dvc_count'] = table.ip_dvc_count.copy()
+    return store.days, arrays
+
+def _same_snapshot(left, right):
+    if left[0] != right[0] or left[1].keys() != right[1].keys():
+        return False
+    return all(np.array_equal(left[1][name], right[1][name], equal_nan=left[1][name].dtype.kind == 'f') for name in left[1])
+
+class _FailingModel:
+    """check_update_rollback()용: 클릭 절반의 상태를 고친 뒤 채점 단계에서 실패하는 모델."""
+    offset_ = 0.0
+
+    def decision_function(self, features):
+        raise RuntimeError("의도한 실패")
+
+def check_update_rollback(ads_rwd_info, ads_list, ip_cache_data, store_path, config=None, ip_ranges=None):
+    """
+    마지막 날짜의 갱신을 중간에 실패시킨 뒤 저장소를 다시 열어, 실패 전 상태로 되돌아갔는지와
+    같은 날짜를 다시 넣으면 실패 없이 넣은 저장소와 같은 점수가 나오는지 확인합니다.
+    반환값: {'reopened': 다시 열림, 'state_restored': 디바이스 상태·날짜 목록 동일, 'retry_matches': 재시도 점수·상태 동일}
+    """
+    log = ads_rwd_info.copy()
+    day_logs = [day_log for _, day_log in log.groupby(pd.to_datetime(log['click_date']).dt.normalize(), sort=True)]
+    reference = DeviceStateStore(store_path + '_reference')
+    for day_log in day_logs:
+        expected = reference.update(day_log.copy(), ads_list, ip_cache_data, config, ip_ranges=ip_ranges)
+
+    store = DeviceStateStore(store_path)
+    for day_log in day_logs[:-1]:
+        store.update(day_log.copy(), ads_list, ip_cache_data, config, ip_ranges=ip_ranges)
+    before = _store_snapshot(store)
+    try:
+        store.update(day_logs[-1].copy(), ads_list, ip_cache_data, config, anomaly_model=_FailingModel(), ip_ranges=ip_ranges)
+    except RuntimeError:
+        pass
+    reopened = DeviceStateStore(store_path)
+    state_restored = _same_snapshot(_store_snapshot(reopened), before)
+    retried = reopened.update(day_logs[-1].copy(), ads_list, ip_cache_data, config, ip_ranges=ip_ranges)
+    key = ['dvc_idx', 'click_date', 'ads_idx', 'mda_idx', 'abuse_score', 'rule_hits']
+    retry_matches = retried.sort_values(key, ignore_index=True)[key].equals(expected.sort_values(key, ignore_index=True)[key])
+    retry_matches = retry_matches and _same_snapshot(_store_snapshot(DeviceStateStore(store_path)), _store_snapshot(reference))
+    return {'reopened': True, 'state_restored': bool(state_restored), 'retry_matches': bool(retry_matches)}
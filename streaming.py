@@ -0,0 +1,406 @@
+# 파일 이름: streaming.py
+"""
+청크 단위 2단계 스캔(1차: 디바이스/IP 상태 누적, 2차: 채점)으로 전체 로그를 메모리에 올리지 않고 배치 경로와 같은 점수를 냅니다.
+
+메모리 상한 (이벤트 수에 비례하지 않는 부분과 비례하는 부분):
+- 디바이스 상태: 디바이스 수에 비례 (청크 부분 집계는 COMPACT_MIN_ROWS 또는 직전 압축 크기의 2배마다 합침).
+- 고유 쌍: (디바이스, IP)/(디바이스, 매체) 고유 쌍 수에 비례. sketch_error를 주면 (디바이스, 매체)와 IP별 디바이스 수는
+  그룹당 HLL 레지스터로 묶이지만, 링 규칙을 켜면 (디바이스, IP) 쌍은 그대로 보관합니다.
+- 모델 입력 중앙값용 원시 값: 메모리가 아니라 임시 디스크 파일에 이벤트당 16바이트로 쌓이고,
+  마무리 때 dvc_idx 해시 버킷 하나씩(전체의 약 1/SPILL_BUCKETS)만 읽어 디바이스별 중앙값/최소/최대를 구합니다.
+- 2차 스캔: 청크 하나, 디바이스별 마지막 클릭 시각, 가장 긴 Burst 윈도우 구간의 클릭 버퍼.
+"""
+
+import functools
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ingest import iter_event_chunks
+from detector import (
+    CONFIG, preprocess_events, complete_mask, count_mda_clicks, count_clicks_in_windows,
+    calculate_abuse_scores, add_model_flags, get_blocklist, prepare_data, sketch_error_from,
+)
+from fraud_rings import RING_COLUMNS, ring_feature_table
+from sketches import GroupedHLL, precision_for_error
+
+# 청크마다 쌓이는 부분 집계 행 수가 이 값(또는 직전 압축 결과의 2배)을 넘으면 디바이스 단위로 다시 합칩니다.
+COMPACT_MIN_ROWS = 1_000_000
+ANALYSIS_TYPES = ('conversion', 'click')
+NO_CLICK = np.iinfo(np.int64).min  # 아직 클릭이 없었던 디바이스의 마지막 클릭 시각
+SPILL_BUCKETS = 64  # 모델 입력 원시 값을 나눠 쓰는 임시 파일 수 (마무리 때 한 번에 읽는 값은 전체의 약 1/SPILL_BUCKETS)
+SPILL_DTYPE = np.dtype([('dvc_idx', np.int64), ('value', np.float64)])
+
+def iter_frame_chunks(df, chunksize):
+    """메모리에 있는 로그를 청크로 나눕니다 (패리티 검증/테스트용)."""
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize].copy()
+
+def _preprocessed_chunks(raw_chunks, ads_list, ip_cache_data, ip_ranges=None, config=None):
+    """
+    원본 청크를 행 단위로 전처리해 돌려줍니다.
+    같은 click_date가 청크 경계에서 갈라지지 않도록 각 청크의 마지막 시각 행들은 다음 청크로 넘깁니다.
+    """
+    carry = None
+    last_time = None
+    for raw in raw_chunks:
+        df = preprocess_events(raw, ads_list, ip_cache_data, ip_ranges, config)
+        if df['click_date'].isna().any():
+            raise ValueError("스트리밍 모드는 click_date가 비어 있는 행을 지원하지 않습니다.")
+        if last_time is not None and not df.empty and df['click_date'].min() < last_time:
+            raise ValueError("스트리밍 모드는 click_date 오름차순으로 정렬된 로그가 필요합니다.")
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+        if df.empty:
+            continue
+        last_time = df['click_date'].max()
+        at_last_time = (df['click_date'] == last_time).to_numpy()
+        carry = df[at_last_time]
+        if not at_last_time.all():
+            yield df[~at_last_time]
+    if carry is not None and not carry.empty:
+        yield carry
+
+def _sorted_by_device(df):
+    return df.sort_values(by=['dvc_idx', 'click_date']).reset_index(drop=True)
+
+def _combine_moments(rows, prefix, group_keys):
+    """(개수, 평균, 편차제곱합) 부분 집계들을 그룹별로 합칩니다 (Chan의 병렬 분산 공식)."""
+    count = rows[f'{prefix}_n']
+    mean = rows[f'{prefix}_mean'].where(count > 0, 0.0)
+    total = count.groupby(group_keys).transform('sum')
+    group_mean = (count * mean).groupby(group_keys).transform('sum') / total
+    spread = rows[f'{prefix}_m2'].fillna(0.0) + count * (mean - group_mean) ** 2
+    return pd.DataFrame({
+        f'{prefix}_n': total, f'{prefix}_mean': group_mean, f'{prefix}_m2': spread.groupby(group_keys).transform('sum'),
+    })
+
+class _ValueSpill:
+    """
+    (dvc_idx, 값) 쌍을 dvc_idx 해시 버킷별 임시 파일에 덧붙이고, 마무리 때 버킷 하나씩 읽어 디바이스별 중앙값/최소/최대를 구합니다.
+    한 디바이스의 값은 모두 같은 버킷에 있으므로 버킷별 집계가 곧 전체 집계이며, 값은 정확히(근사 없이) 보존됩니다.
+    """
+    def __init__(self, n_buckets=SPILL_BUCKETS):
+        self.directory = tempfile.TemporaryDirectory(prefix='stream_values_')
+        self.n_buckets = n_buckets
+        self.rows = 0
+
+    def _path(self, bucket):
+        return os.path.join(self.directory.name, f'{bucket:03d}.bin')
+
+    def append(self, dvc_idx, values):
+        records = np.empty(len(values), dtype=SPILL_DTYPE)
+        records['dvc_idx'] = dvc_idx
+        records['value'] = values
+        buckets = records['dvc_idx'] % self.n_buckets
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(self.n_buckets + 1))
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            with open(self._path(bucket), 'ab') as f:
+                records[order[bounds[bucket]:bounds[bucket + 1]]].tofile(f)
+        self.rows += len(records)
+
+    def stats(self):
+        """디바이스별 (median, min, max) 테이블을 만들고 임시 파일을 지웁니다."""
+        parts = []
+        for bucket in range(self.n_buckets):
+            if os.path.exists(self._path(bucket)):
+                records = pd.DataFrame(np.fromfile(self._path(bucket), dtype=SPILL_DTYPE))
+                parts.append(records.groupby('dvc_idx')['value'].agg(['median', 'min', 'max']))
+                os.remove(self._path(bucket))
+        self.directory.cleanup()
+        return pd.concat(parts) if parts else None
+
+class DeviceStateAccumulator:
+    """
+    한 분석 유형(conversion/click)의 디바이스/IP 상태를 청크 단위로 누적합니다.
+    상태 크기는 이벤트 수가 아니라 디바이스 수, (디바이스, IP)/(디바이스, 매체) 고유 쌍 수에 비례합니다.
+    모델 입력의 중앙값은 스트리밍으로 정확히 구할 수 없어, 모델을 쓸 때만 (dvc_idx, 값) 쌍을 임시 파일(_ValueSpill)로 내려 둡니다.
+    sketch_error를 주면 고유 쌍 대신 청크별 HyperLogLog 스케치를 합쳐 고유 수 상태를 그룹당 레지스터 수로 묶습니다.
+    max_ip_devices를 주면 링 규칙용 디바이스–IP 그래프가 필요하므로, 스케치 모드에서도 (디바이스, IP) 고유 쌍은 보관합니다.
+    """
+    def __init__(self, keep_interval_values=False, keep_ctit_values=False, sketch_error=None, max_ip_devices=None):
+        self.keep_interval_values = keep_interval_values
+        self.keep_ctit_values = keep_ctit_values
+        self.max_ip_devices = max_ip_devices
+        self.sketch_precision = None if sketch_error is None else precision_for_error(sketch_error)
+        self.sketches = {'ip_per_dvc': [], 'mda_per_dvc': [], 'dvc_per_ip': []}
+        self.partials, self.ip_pairs, self.mda_pairs = [], [], []
+        self.interval_values = _ValueSpill() if keep_interval_values else None
+        self.ctit_values = _ValueSpill() if keep_ctit_values else None
+        self.partial_rows = 0
+        self.compacted_rows = 0
+        self.chunk_no = 0
+
+    def update(self, df):
+        """(dvc_idx, click_date)로 정렬된 청크 하나를 상태에 반영합니다."""
+        if df.empty:
+            return
+        dvc = df['dvc_idx'].to_numpy()
+        click_ns = df['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        new_device = np.ones(len(df), dtype=bool)
+        new_device[1:] = dvc[1:] != dvc[:-1]
+        time_diff = np.empty(len(df))
+        time_diff[1:] = (click_ns[1:] - click_ns[:-1]) / 1_000_000_000
+        time_diff[new_device] = np.nan
+        events = pd.DataFrame({'dvc_idx': dvc, 'click_ns': click_ns, 'time_diff_sec': time_diff, 'ctit': df['ctit'].to_numpy(dtype=float)})
+        grouped = events.groupby('dvc_idx', sort=False)
+        partial = grouped.agg(
+            clicks=('click_ns', 'size'), first_ns=('click_ns', 'min'), last_ns=('click_ns', 'max'),
+            interval_n=('time_diff_sec', 'count'), interval_mean=('time_diff_sec', 'mean'), interval_var=('time_diff_sec', 'var'),
+            ctit_n=('ctit', 'count'), ctit_mean=('ctit', 'mean'), ctit_var=('ctit', 'var'),
+            ctit_min=('ctit', 'min'), ctit_max=('ctit', 'max'),
+        )
+        for prefix in ('interval', 'ctit'):
+            partial[f'{prefix}_m2'] = partial.pop(f'{prefix}_var').fillna(0.0) * (partial[f'{prefix}_n'] - 1).clip(lower=0)
+        partial['chunk_no'] = self.chunk_no
+        self.chunk_no += 1
+        self.partials.append(partial.reset_index())
+        if self.sketch_precision is None or self.max_ip_devices is not None:
+            self.ip_pairs.append(df[['dvc_idx', 'user_ip']].dropna().drop_duplicates())
+        if self.sketch_precision is None:
+            self.mda_pairs.append(df[['dvc_idx', 'mda_idx']].dropna().drop_duplicates())
+        else:
+            for name, groups, items in (('ip_per_dvc', 'dvc_idx', 'user_ip'), ('mda_per_dvc', 'dvc_idx', 'mda_idx'), ('dvc_per_ip', 'user_ip', 'dvc_idx')):
+                self.sketches[name].append(GroupedHLL.from_pairs(df[groups], df[items], self.sketch_precision))
+        if self.keep_interval_values:
+            self.interval_values.append(dvc[~new_device], time_diff[~new_device])
+        if self.keep_ctit_values:
+            ctit = events['ctit'].to_numpy()
+            has_ctit = ~np.isnan(ctit)
+            self.ctit_values.append(dvc[has_ctit], ctit[has_ctit])
+        self.partial_rows += len(partial)
+        if self.partial_rows > max(COMPACT_MIN_ROWS, 2 * self.compacted_rows):
+            self._compact()
+
+    def _compact(self):
+        """디바이스별 부분 집계를 하나로 합치고, 연속된 청크 사이의 클릭 간격을 간격 통계에 더합니다."""
+        rows = pd.concat(self.partials, ignore_index=True).sort_values(['dvc_idx', 'chunk_no'], kind='stable', ignore_index=True)
+        dvc = rows['dvc_idx'].to_numpy()
+        continues = np.zeros(len(rows), dtype=bool)
+        continues[1:] = dvc[1:] == dvc[:-1]
+        boundary_gaps = (rows['first_ns'].to_numpy()[continues] - rows['last_ns'].to_numpy()[np.flatnonzero(continues) - 1]) / 1_000_000_000
+        if len(boundary_gaps):
+            boundary_rows = pd.DataFrame({
+                'dvc_idx': dvc[continues], 'clicks': 0, 'interval_n': 1, 'interval_mean': boundary_gaps, 'interval_m2': 0.0, 'ctit_n': 0,
+            })
+            if self.keep_interval_values:
+                self.interval_values.append(dvc[continues], boundary_gaps)
+            rows = pd.concat([rows, boundary_rows], ignore_index=True)
+        keys = rows['dvc_idx']
+        moments = pd.concat([_combine_moments(rows, 'interval', keys), _combine_moments(rows, 'ctit', keys)], axis=1)
+        combined = rows.groupby('dvc_idx').agg(
+            clicks=('clicks', 'sum'), first_ns=('first_ns', 'min'), last_ns=('last_ns', 'max'), chunk_no=('chunk_no', 'max'),
+            ctit_min=('ctit_min', 'min'), ctit_max=('ctit_max', 'max'),
+        )
+        combined = combined.join(moments.groupby(keys).first()).reset_index()
+        combined['clicks'] = combined['clicks'].astype(np.int64)
+        self.partials = [combined]
+        if self.ip_pairs:
+            self.ip_pairs = [pd.concat(self.ip_pairs, ignore_index=True).drop_duplicates()]
+        if self.sketch_precision is None:
+            self.mda_pairs = [pd.concat(self.mda_pairs, ignore_index=True).drop_duplicates()]
+        else:
+            self.sketches = {name: [functools.reduce(GroupedHLL.merge, sketches)] for name, sketches in self.sketches.items()}
+        self.partial_rows = self.compacted_rows = len(combined)
+
+    def finalize(self):
+        """
+        누적 상태를 detector.build_feature_tables()와 같은 컬럼의 (디바이스 피쳐, IP 피쳐) 테이블로 만듭니다.
+        max_ip_devices를 줬으면 디바이스 피쳐에 링 컬럼(RING_COLUMNS)도 붙입니다.
+        """
+        if not self.partials:
+            return None, None
+        self._compact()
+        state = self.partials[0].set_index('dvc_idx').sort_index()
+        device_features = pd.DataFrame(index=state.index)
+        device_features['total_clicks'] = state['clicks']
+        if self.sketch_precision is None:
+            ip_pairs, mda_pairs = self.ip_pairs[0], self.mda_pairs[0]
+            device_features['ip_count'] = ip_pairs.groupby('dvc_idx').size().reindex(state.index, fill_value=0)
+            device_features['mda_count'] = mda_pairs.groupby('dvc_idx').size().reindex(state.index, fill_value=0)
+            ip_features = ip_pairs.groupby('user_ip', observed=True).size().rename('dvc_count').to_frame()
+        else:
+            sketches = {name: sketches[0].counts() for name, sketches in self.sketches.items()}
+            device_features['ip_count'] = sketches['ip_per_dvc'].reindex(state.index, fill_value=0)
+            device_features['mda_count'] = sketches['mda_per_dvc'].reindex(state.index, fill_value=0)
+            ip_features = sketches['dvc_per_ip'].rename('dvc_count').rename_axis('user_ip').to_frame()
+        for prefix in ('interval', 'ctit'):
+            count = state[f'{prefix}_n'].astype(np.int64)
+            device_features[f'{prefix}_count'] = count
+            device_features[f'{prefix}_mean'] = state[f'{prefix}_mean'].where(count > 0)
+            device_features[f'{prefix}_std'] = np.sqrt(state[f'{prefix}_m2'] / (count - 1)).where(count > 1)
+        for prefix, values in (('interval', self.interval_values), ('ctit', self.ctit_values)):
+            stats = None if values is None else values.stats()
+            if stats is not None:
+                for stat in ('median', 'min', 'max'):
+                    device_features[f'{prefix}_{stat}'] = stats[stat].reindex(state.index)
+        if self.max_ip_devices is not None:
+            ip_pairs = self.ip_pairs[0] if self.ip_pairs else pd.DataFrame({'dvc_idx': [], 'user_ip': []})
+            rings = ring_feature_table(ip_pairs['dvc_idx'], ip_pairs['user_ip'], self.max_ip_devices)
+            # IP가 모두 결측인 디바이스는 간선이 없으므로 혼자인 링(1대, IP 0개)입니다.
+            rings = rings.reindex(state.index).fillna({'ring_size': 1, 'ring_ip_count': 0, 'ring_density': 0.0})
+            rings = rings.astype({'ring_size': np.int64, 'ring_ip_count': np.int64})
+            for column in RING_COLUMNS:
+                device_features[column] = rings[column].to_numpy()
+        return device_features, ip_features
+
+def build_stream_state(raw_chunks, ads_list, ip_cache_data, config=None, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None):
+    """
+    1차 스캔: 청크를 한 번 훑으며 분석 유형별 디바이스/IP 피쳐와 매체별 클릭/전환 수를 누적합니다.
+    반환값은 score_stream()에 그대로 넘기는 상태 딕셔너리입니다.
+    """
+    max_ip_devices = (config or CONFIG)['fraud_ring']['max_ip_devices']
+    accumulators = {
+        'conversion': DeviceStateAccumulator(keep_ctit_values=bool(ctit_anomaly_model), sketch_error=sketch_error_from(config), max_ip_devices=max_ip_devices),
+        'click': DeviceStateAccumulator(keep_interval_values=bool(anomaly_model), sketch_error=sketch_error_from(config), max_ip_devices=max_ip_devices),
+    }
+    clicks_per_mda = conversions_per_mda = pd.Series(dtype=np.int64)
+    for df in _preprocessed_chunks(raw_chunks, ads_list, ip_cache_data, ip_ranges, config):
+        chunk_clicks, chunk_conversions = count_mda_clicks(df)
+        clicks_per_mda = clicks_per_mda.add(chunk_clicks, fill_value=0)
+        conversions_per_mda = conversions_per_mda.add(chunk_conversions, fill_value=0)
+        is_complete = complete_mask(df)
+        accumulators['conversion'].update(_sorted_by_device(df[is_complete]))
+        accumulators['click'].update(_sorted_by_device(df[~is_complete]))
+
+    clicks_per_mda = clicks_per_mda.astype(np.int64)
+    state = {
+        'clicks_per_mda': clicks_per_mda,
+        'cvr_per_mda': (conversions_per_mda.astype(np.int64) / clicks_per_mda).fillna(0),
+    }
+    for analysis_type, accumulator in accumulators.items():
+        device_features, ip_features = accumulator.finalize()
+        if device_features is not None:
+            device_features = add_model_flags(device_features, analysis_type, anomaly_model, ctit_anomaly_model)
+        state[analysis_type] = (device_features, ip_features)
+    return state
+
+def score_stream(raw_chunks, state, ads_list, ip_cache_data, config=None, ip_ranges=None):
+    """
+    2차 스캔: 청크마다 배치 경로와 같은 점수를 계산해 채점된 청크를 하나씩 돌려줍니다.
+    청크 경계를 넘는 값은 디바이스별 마지막 클릭 시각과 최근 윈도우 구간의 클릭 버퍼로 이어 붙입니다.
+    """
+    if config is None:
+        config = CONFIG
+    window_min = config['burst_attack']['window_min']
+    windows = sorted(set(config['burst_attack'].get('windows_min', [])) | {window_min})
+    window_buffer = empty_window_buffer()
+    last_click = {}
+    for analysis_type in ANALYSIS_TYPES:
+        device_features = state[analysis_type][0]
+        if device_features is not None:
+            last_click[analysis_type] = np.full(len(device_features), NO_CLICK)
+
+    for df in _preprocessed_chunks(raw_chunks, ads_list, ip_cache_data, ip_ranges, config):
+        df, window_buffer = add_burst_counts(_sorted_by_device(df), window_buffer, windows, window_min)
+        is_complete = complete_mask(df)
+        scored_parts = []
+        for analysis_type, part in (('conversion', df[is_complete].copy()), ('click', df[~is_complete].copy())):
+            if part.empty:
+                continue
+            device_features, ip_features = state[analysis_type]
+            part['time_diff_sec'] = _carry_time_diff(part, device_features, last_click[analysis_type])
+            scored_parts.append(calculate_abuse_scores(
+                part, analysis_type, state['clicks_per_mda'], state['cvr_per_mda'], config=config,
+                device_features=device_features, ip_features=ip_features,
+            ))
+        if scored_parts:
+            yield pd.concat(scored_parts, ignore_index=True)
+
+def empty_window_buffer():
+    return pd.DataFrame({'dvc_idx': pd.Series(dtype=np.int64), 'click_date': pd.Series(dtype='datetime64[ns]')})
+
+def add_burst_counts(df, window_buffer, windows, window_min):
+    """
+    (dvc_idx, click_date)로 정렬된 청크에 Burst 피쳐(clicks_in_{N}min, clicks_in_Nmin)를 채웁니다.
+    직전 청크들의 최근 max(windows)분 클릭 버퍼와 이어 붙여 계산하므로 청크 경계를 넘는 윈도우도 배치 경로와 같습니다.
+    반환값: (피쳐가 추가된 청크, 다음 청크에 넘길 클릭 버퍼)
+    """
+    recent = pd.concat([window_buffer, df[['dvc_idx', 'click_date']]], ignore_index=True)
+    recent['is_current'] = np.r_[np.zeros(len(window_buffer), dtype=bool), np.ones(len(df), dtype=bool)]
+    recent = _sorted_by_device(recent)
+    clicks_in_windows = count_clicks_in_windows(recent['dvc_idx'].to_numpy(), recent['click_date'], windows)
+    is_current = recent['is_current'].to_numpy()
+    for minutes in windows:
+        df[f'clicks_in_{minutes}min'] = clicks_in_windows[minutes][is_current]
+    df['clicks_in_Nmin'] = df[f'clicks_in_{window_min}min']
+    buffer_start = df['click_date'].max().value - int(max(windows) * 60 * 1_000_000_000)
+    window_buffer = recent.loc[recent['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64) > buffer_start, ['dvc_idx', 'click_date']]
+    return df, window_buffer.reset_index(drop=True)
+
+def _carry_time_diff(part, device_features, last_click):
+    """정렬된 청크의 클릭 간격을 계산하고, 디바이스의 첫 클릭은 이전 청크의 마지막 클릭과 이어 붙입니다."""
+    codes = device_features.index.get_indexer(part['dvc_idx'])
+    click_ns = part['click_date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    new_device = np.ones(len(part), dtype=bool)
+    new_device[1:] = codes[1:] != codes[:-1]
+    time_diff = np.empty(len(part))
+    time_diff[1:] = (click_ns[1:] - click_ns[:-1]) / 1_000_000_000
+    previous = last_click[codes[new_device]]
+    seen = previous != NO_CLICK
+    time_diff[new_device] = np.where(seen, (click_ns[new_device] - previous) / 1_000_000_000, np.nan)
+    last_in_chunk = np.append(new_device[1:], True)
+    last_click[codes[last_in_chunk]] = click_ns[last_in_chunk]
+    return time_diff
+
+def _max_score_per_device(partials):
+    return pd.concat(partials).groupby(level=0).max()
+
+def run_streaming_detection(path, ads_list, ip_cache_data, config=None, chunksize=500_000, anomaly_model=None, ctit_anomaly_model=None, output_path=None, read_csv_kwargs=None, ip_ranges=None):
+    """
+    메모리에 다 올라가지 않는 로그를 두 번 청크 스캔해 배치 경로(run_detection)와 같은 점수로 탐지합니다.
+    output_path를 주면 채점된 이벤트를 CSV로 이어 씁니다.
+    반환값: (최종 제재 디바이스 리스트, 디바이스별 최고 점수 Series)
+    """
+    if config is None:
+        config = CONFIG
+    read_csv_kwargs = read_csv_kwargs or {}
+    print("--- 1차 스캔: 디바이스/IP/매체 상태 누적 ---")
+    state = build_stream_state(iter_event_chunks(path, chunksize, **read_csv_kwargs), ads_list, ip_cache_data, config, anomaly_model, ctit_anomaly_model, ip_ranges)
+    print("--- 2차 스캔: 청크별 채점 ---")
+    partial_maxima, partial_rows, compacted_rows = [], 0, 0
+    for i, scored in enumerate(score_stream(iter_event_chunks(path, chunksize, **read_csv_kwargs), state, ads_list, ip_cache_data, config, ip_ranges)):
+        if output_path is not None:
+            scored.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        chunk_max = scored.loc[scored['abuse_score'] > 0].groupby('dvc_idx')['abuse_score'].max()
+        partial_maxima.append(chunk_max)
+        partial_rows += len(chunk_max)
+        if partial_rows > max(COMPACT_MIN_ROWS, 2 * compacted_rows):
+            partial_maxima = [_max_score_per_device(partial_maxima)]
+            partial_rows = compacted_rows = len(partial_maxima[0])
+    device_max = _max_score_per_device(partial_maxima) if partial_maxima else pd.Series(dtype=np.int64)
+    final_block_list, device_scores, _ = get_blocklist(device_max.rename('abuse_score').rename_axis('dvc_idx').reset_index(), "스트리밍 통합", config)
+    print(f"\n✅ 최종 통합 제재 디바이스: {len(final_block_list)}개")
+    return final_block_list, device_scores
+
+def check_streaming_parity(ads_rwd_info, ads_list, ip_cache_data, config=None, chunksize=50_000, anomaly_model=None, ctit_anomaly_model=None, ip_ranges=None):
+    """
+    같은 로그를 배치 경로(prepare_data + calculate_abuse_scores)와 스트리밍 경로로 채점해 이벤트별 점수를 비교합니다.
+    반환값: {'events': 비교한 이벤트 수, 'score_mismatches': 점수가 다른 이벤트 수, 'hit_mismatches': 적중 비트가 다른 이벤트 수}
+    """
+    if config is None:
+        config = CONFIG
+    log = ads_rwd_info.sort_values('click_date', key=pd.to_datetime, kind='stable').reset_index(drop=True)
+    log['_row'] = np.arange(len(log))
+
+    _, df_complete, df_incomplete, clicks_per_mda, cvr_per_mda = prepare_data(log.copy(), ads_list, ip_cache_data, config, ip_ranges)
+    batch = pd.concat([
+        calculate_abuse_scores(df_complete, 'conversion', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config),
+        calculate_abuse_scores(df_incomplete, 'click', clicks_per_mda, cvr_per_mda, anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config),
+    ], ignore_index=True)
+    state = build_stream_state(iter_frame_chunks(log, chunksize), ads_list, ip_cache_data, config, anomaly_model, ctit_anomaly_model, ip_ranges)
+    stream = pd.concat(score_stream(iter_frame_chunks(log, chunksize), state, ads_list, ip_cache_data, config, ip_ranges), ignore_index=True)
+
+    keys = ['_row', 'ads_type', 'ads_category', 'ads_name']
+    batch = batch.sort_values(keys, kind='stable', ignore_index=True)
+    stream = stream.sort_values(keys, kind='stable', ignore_index=True)
+    if len(batch) != len(stream):
+        raise AssertionError(f"이벤트 수가 다릅니다: 배치 {len(batch)}건, 스트리밍 {len(stream)}건")
+    return {
+        'events': len(batch),
+        'score_mismatches': int((batch['abuse_score'].to_numpy() != stream['abuse_score'].to_numpy()).sum()),
+        'hit_mismatches': int((batch['rule_hits'].to_numpy() != stream['rule_hits'].to_numpy()).sum()),
+    }
@@ -0,0 +1,201 @@
+# 파일 이름: sweep.py
+
+import copy
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from detector import (
+    CONFIG, RuleHitMatrix, add_model_flags, build_feature_tables, calculate_abuse_scores,
+    detection_signature, prepare_signature, sketch_error_from,
+)
+from fraud_rings import ring_feature_table
+
+# 설정 몇 개씩 묶어 디바이스 점수 행렬을 만들지 (디바이스 수 × 이 값 크기의 점수 행렬만 메모리에 둡니다)
+SWEEP_CHUNK = 64
+OVERLAP_BLOCK = 1 << 16
+
+def config_grid(base_config=None, scores=None, thresholds=None, cutoffs=None):
+    """
+    기준 설정에서 규칙 점수, 규칙 임계값, 제재 커트라인을 바꾼 모든 조합의 설정을 만듭니다.
+      scores:     {규칙: [점수, ...]}
+      thresholds: {(규칙, 키): [값, ...]}
+      cutoffs:    [{'blocklist_method': 'percentile', 'blocklist_percentile': 0.97}, ...]
+    반환값: {설정 이름: 설정} (이름은 바꾼 값들을 'burst_attack.score=30, blocklist_percentile=0.97' 형태로 나열)
+    """
+    base_config = base_config or CONFIG
+    axes = [((rule, 'score'), values) for rule, values in (scores or {}).items()]
+    axes += [(key, values) for key, values in (thresholds or {}).items()]
+    cutoffs = list(cutoffs) if cutoffs else [{}]
+    grid = {}
+    for values in itertools.product(*(values for _, values in axes)):
+        for cutoff in cutoffs:
+            config = copy.deepcopy(base_config)
+            labels = []
+            for ((rule, key), _), value in zip(axes, values):
+                config[rule][key] = value
+                labels.append(f"{rule}.{key}={value}")
+            for key, value in cutoff.items():
+                config[key] = value
+                labels.append(f"{key}={value}")
+            grid[', '.join(labels) or '기준'] = config
+    return grid
+
+def _named(configs):
+    if isinstance(configs, dict):
+        return list(configs), list(configs.values())
+    configs = list(configs)
+    return [f"설정 {i + 1}" for i in range(len(configs))], configs
+
+def _device_pairs(all_scored_df, hit_matrix, devices):
+    """(디바이스, 조건 패턴) 쌍을 중복 없이 디바이스 순서로 정렬해 반환합니다. 디바이스 최고 점수는 이 쌍들만 보면 됩니다."""
+    dvc_codes = devices.get_indexer(all_scored_df['dvc_idx'])
+    n_patterns = len(hit_matrix.patterns)
+    pairs = np.unique(dvc_codes.astype(np.int64) * n_patterns + hit_matrix.codes)
+    pair_devices, pair_patterns = pairs // n_patterns, pairs % n_patterns
+    starts = np.flatnonzero(np.r_[True, pair_devices[1:] != pair_devices[:-1]])
+    return pair_devices[starts], pair_patterns, starts
+
+def _cutoff_thresholds(device_scores, configs):
+    """
+    설정(열)마다 get_blocklist()와 같은 커트라인을 계산합니다. percentile은 양수 점수만으로 구한 pandas 선형 보간 분위수이고,
+    점수를 열마다 정렬해 양수 구간의 위치를 한 번에 찾습니다. 커트라인이 없으면 NaN입니다.
+    """
+    n_rows = device_scores.shape[0]
+    n_positive = (device_scores > 0).sum(axis=0)
+    thresholds = np.full(len(configs), np.nan)
+    percentiles = np.array([config.get('blocklist_percentile', np.nan) for config in configs], dtype=float)
+    is_percentile = np.array([config.get('blocklist_method', 'percentile') == 'percentile' for config in configs])
+    is_absolute = np.array([config.get('blocklist_method', 'percentile') == 'absolute' for config in configs])
+    use = is_percentile & (n_positive > 0)
+    if use.any():
+        ordered = np.sort(device_scores[:, use], axis=0)
+        count = n_positive[use]
+        position = (count - 1) * percentiles[use]
+        lower = np.floor(position).astype(np.int64)
+        offset = n_rows - count
+        lower_value = np.take_along_axis(ordered, (offset + lower)[None, :], axis=0)[0]
+        upper_value = np.take_along_axis(ordered, (offset + np.minimum(lower + 1, count - 1))[None, :], axis=0)[0]
+        thresholds[use] = lower_value + (position - lower) * (upper_value - lower_value)
+    thresholds[is_absolute] = [config['absolute_score_threshold'] for config, absolute in zip(configs, is_absolute) if absolute]
+    return thresholds
+
+def _sweep_group(all_scored_df, configs, devices, hit_matrix=None):
+    """탐지 임계값이 같은 설정들의 (커트라인, 디바이스 × 설정 제재 여부)를 계산합니다."""
+    hit_matrix = hit_matrix or RuleHitMatrix(all_scored_df['rule_conditions'])
+    pattern_scores = hit_matrix.rescore_many(configs)
+    row_devices, pair_patterns, starts = _device_pairs(all_scored_df, hit_matrix, devices)
+    blocked = np.zeros((len(devices), len(configs)), dtype=bool)
+    thresholds = np.full(len(configs), np.nan)
+    for begin in range(0, len(configs), SWEEP_CHUNK):
+        chunk = slice(begin, begin + SWEEP_CHUNK)
+        scores = np.maximum.reduceat(pattern_scores[pair_patterns, chunk], starts, axis=0)
+        thresholds[chunk] = _cutoff_thresholds(scores, configs[chunk])
+        blocked[row_devices, chunk] = (scores > 0) & (scores >= thresholds[chunk])
+    return thresholds, blocked
+
+def _overlap(blocked):
+    """설정 × 설정 공통 제재 디바이스 수 (제재 행렬의 Bᵀ·B를 행 블록 단위로 누적)."""
+    overlap = np.zeros((blocked.shape[1], blocked.shape[1]))
+    for begin in range(0, blocked.shape[0], OVERLAP_BLOCK):
+        block = blocked[begin:begin + OVERLAP_BLOCK].astype(np.float32)
+        overlap += block.T @ block
+    return overlap.astype(np.int64)
+
+def summarize_sweep(names, configs, thresholds, blocked, devices):
+    """
+    스윕 결과를 (요약 DataFrame, 공통 제재 수 DataFrame, 디바이스 × 설정 제재 여부 DataFrame)로 정리합니다.
+    요약에는 설정별 방식/커트라인/제재 수와 첫 번째 설정 대비 자카드 유사도를 담습니다.
+    """
+    overlap = _overlap(blocked)
+    counts = np.diag(overlap)
+    union = counts[0] + counts - overlap[0] if len(names) else counts
+    summary = pd.DataFrame({
+        'name': names,
+        'method': [config.get('blocklist_method', 'percentile') for config in configs],
+        'cutoff': [config.get('blocklist_percentile') if config.get('blocklist_method', 'percentile') == 'percentile' else config.get('absolute_score_threshold') for config in configs],
+        'threshold': thresholds,
+        'blocked': counts,
+        'jaccard_vs_first': np.divide(overlap[0], union, out=np.ones(len(names)), where=union > 0) if len(names) else [],
+    })
+    overlap = pd.DataFrame(overlap, index=names, columns=names)
+    blocked = pd.DataFrame(blocked, index=devices, columns=names)
+    return summary, overlap, blocked
+
+def sweep_scored(all_scored_df, configs, hit_matrix=None):
+    """
+    채점이 끝난 이벤트(rule_conditions 컬럼)로 점수/커트라인만 다른 설정들을 한 번에 평가합니다.
+    모든 설정의 detection_signature()가 같아야 하며, 설정마다 get_blocklist()를 부른 것과 같은 제재 리스트를 얻습니다.
+    configs: {이름: 설정} 또는 설정 리스트
+    반환값: summarize_sweep()과 같음
+    """
+    names, configs = _named(configs)
+    if len({detection_signature(config) for config in configs}) > 1:
+        raise ValueError("sweep_scored()는 점수/커트라인만 다른 설정에만 쓸 수 있습니다. 임계값이 다르면 run_sweep()을 사용하세요.")
+    devices = pd.Index(np.sort(all_scored_df['dvc_idx'].unique()))
+    thresholds, blocked = _sweep_group(all_scored_df, configs, devices, hit_matrix) if configs else (np.array([]), np.zeros((len(devices), 0), dtype=bool))
+    return summarize_sweep(names, configs, thresholds, blocked, devices)
+
+def run_sweep(df_complete, df_incomplete, clicks_per_mda_series, cvr_per_mda_series, configs, anomaly_model=None, ctit_anomaly_model=None):
+    """
+    prepare_data() 결과 하나로 규칙 점수/임계값/커트라인이 다른 여러 설정을 한 번에 평가합니다.
+    디바이스/IP 피쳐와 모델 플래그(링 피쳐는 max_ip_devices마다)는 분석 유형마다 한 번만 만들고, 규칙 조건은 서로 다른 임계값 조합마다 한 번,
+    점수는 같은 임계값 조합 안의 모든 설정을 가중치 행렬 곱 한 번으로 계산합니다.
+    Burst 윈도우(prepare_signature)는 prepare_data() 단계에서 정해지므로 모든 설정이 같아야 합니다.
+    반환값: summarize_sweep()과 같음
+    """
+    names, configs = _named(configs)
+    if len({prepare_signature(config) for config in configs}) > 1:
+        raise ValueError("Burst 윈도우가 다른 설정은 prepare_data()부터 따로 실행해야 합니다.")
+
+    parts = {}
+    for analysis_type, df in (('conversion', df_complete), ('click', df_incomplete)):
+        if not df.empty:
+            parts[analysis_type] = df.sort_values(['dvc_idx', 'click_date'])
+    features = {}
+    def shared_features(analysis_type, sketch_error):
+        key = (analysis_type, sketch_error)
+        if key not in features:
+            part = parts[analysis_type].copy()
+            medians = ()
+            if analysis_type == 'click' and anomaly_model:
+                medians += ('time_diff_sec',)
+            if analysis_type == 'conversion' and ctit_anomaly_model:
+                medians += ('ctit',)
+            device_features, ip_features, events = build_feature_tables(part, medians, sketch_error)
+            part['time_diff_sec'] = events['time_diff_sec']
+            device_features = add_model_flags(device_features, analysis_type, anomaly_model, ctit_anomaly_model)
+            features[key] = (part, device_features, ip_features)
+        return features[key]
+    rings = {}
+    def shared_rings(analysis_type, max_ip_devices):
+        key = (analysis_type, max_ip_devices)
+        if key not in rings:
+            rings[key] = ring_feature_table(parts[analysis_type]['dvc_idx'], parts[analysis_type]['user_ip'], max_ip_devices)
+        return rings[key]
+
+    groups = {}
+    for position, config in enumerate(configs):
+        groups.setdefault(detection_signature(config), []).append(position)
+    all_devices = [part['dvc_idx'] for part in parts.values()]
+    devices = pd.Index(np.sort(pd.concat(all_devices).unique())) if all_devices else pd.Index([])
+    thresholds = np.full(len(configs), np.nan)
+    blocked = np.zeros((len(devices), len(configs)), dtype=bool)
+    for group_number, positions in enumerate(groups.values(), 1):
+        config = configs[positions[0]]
+        scored = []
+        for analysis_type in parts:
+            part, device_features, ip_features = shared_features(analysis_type, sketch_error_from(config))
+            scored.append(calculate_abuse_scores(
+                part.copy(), analysis_type, clicks_per_mda_series, cvr_per_mda_series,
+                anomaly_model=anomaly_model, ctit_anomaly_model=ctit_anomaly_model, config=config,
+                device_features=device_features, ip_features=ip_features,
+                ring_features=shared_rings(analysis_type, config['fraud_ring']['max_ip_devices']),
+            ))
+        if not scored:
+            continue
+        all_scored_df = pd.concat(scored, ignore_index=True)
+        thresholds[positions], blocked[:, positions] = _sweep_group(all_scored_df, [configs[i] for i in positions], devices)
+        print(f"--- [스윕] 임계값 조합 {group_number}/{len(groups)}: 설정 {len(positions)}개 평가 ---")
+    return summarize_sweep(names, configs, thresholds, blocked, devices)
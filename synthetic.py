@@ -0,0 +1,230 @@
+# 파일 이름: synthetic.py
+
+import numpy as np
+import pandas as pd
+
+from ingest import apply_event_schema
+
+# 주입하는 봇 패턴별 (디바이스당 이벤트 수, 봇 이벤트 중 비중)
+BOT_PATTERNS = {
+    'burst': (40, 0.25),          # 수 분 안에 몰아치는 클릭
+    'constant_ctit': (20, 0.25),  # 거의 같은 CTIT로 반복 전환
+    'ip_farm': (8, 0.25),         # 한 IP에 디바이스 여러 대 (팜당 IP_FARM_SIZE대)
+    'aws_host': (15, 0.25),       # 클라우드(AWS) IP에서 짧은 CTIT 전환
+}
+IP_FARM_SIZE = 12
+CARRIER_HOSTS = ('kt.net', 'skbroadband.com', 'lgdacom.net', 'hanaro.com')
+SECONDS_PER_DAY = 86_400
+
+def _zipf_weights(n, exponent, rng=None):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    if rng is not None:
+        weights = rng.permutation(weights)
+    return weights / weights.sum()
+
+def _random_ips(rng, n, first_octets):
+    """서로 다른 IPv4 문자열 n개를 만듭니다. 첫 옥텟은 first_octets 중에서 고릅니다."""
+    values = rng.choice(1 << 24, size=n, replace=False) + (rng.choice(first_octets, size=n) << 24)
+    octets = [(values >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+    return np.array(['.'.join(map(str, parts)) for parts in zip(*octets)], dtype=object)
+
+def _build_population(rng, n_rows, bot_fraction, dup_ads_fraction):
+    """디바이스/IP/매체/광고 모집단과 봇 목록을 한 번 만듭니다. 청크로 나눠 생성해도 모든 청크가 같은 모집단을 씁니다."""
+    n_devices = max(50, n_rows // 12)
+    n_ips = max(20, int(n_devices * 0.6))
+    n_media = int(np.clip(np.sqrt(n_rows) / 2, 10, 500))
+    n_ads = int(np.clip(np.sqrt(n_rows) * 2, 20, 5000))
+
+    # 봇 수: 봇 이벤트 총량을 패턴 비중대로 나눈 뒤 디바이스당 이벤트 수로 나눕니다.
+    bot_rows = int(n_rows * bot_fraction)
+    n_bots = {}
+    for pattern, (events, share) in BOT_PATTERNS.items():
+        per_unit = events * (IP_FARM_SIZE if pattern == 'ip_farm' else 1)
+        n_bots[pattern] = max(1, int(bot_rows * share) // per_unit) if bot_rows else 0
+    n_farm_devices = n_bots['ip_farm'] * IP_FARM_SIZE
+    n_bot_devices = n_bots['burst'] + n_bots['constant_ctit'] + n_farm_devices + n_bots['aws_host']
+
+    # IP 풀: 일반 IP + 팜 전용 IP + AWS IP. 일반 IP의 70%에는 통신사 호스트명이 캐시되어 있습니다.
+    n_aws_ips = max(1, n_bots['aws_host'] // 3)
+    all_ips = _random_ips(rng, n_ips + n_bots['ip_farm'] + n_aws_ips, first_octets=np.array([1, 14, 27, 39, 49, 58, 59, 61, 106, 110, 112, 115, 175, 211, 218, 221, 222]))
+    farm_ip_codes = np.arange(n_ips, n_ips + n_bots['ip_farm'])
+    aws_ip_codes = np.arange(n_ips + n_bots['ip_farm'], len(all_ips))
+    ip_cache = {}
+    cached = np.flatnonzero(rng.random(n_ips) < 0.7)
+    for code, host in zip(cached, rng.choice(CARRIER_HOSTS, size=len(cached))):
+        ip_cache[all_ips[code]] = f"{all_ips[code].replace('.', '-')}.{host}"
+    for code in aws_ip_codes:
+        ip_cache[all_ips[code]] = f"ec2-{all_ips[code].replace('.', '-')}.ap-northeast-2.compute.amazonaws.com"
+
+    device_ids = (rng.permutation(n_devices + n_bot_devices) + 1).astype(np.int32)
+    bots, start = [], n_devices
+    for pattern in BOT_PATTERNS:
+        count = n_farm_devices if pattern == 'ip_farm' else n_bots[pattern]
+        for i in range(count):
+            if pattern == 'ip_farm':
+                ip_code = farm_ip_codes[i // IP_FARM_SIZE]
+            elif pattern == 'aws_host':
+                ip_code = rng.choice(aws_ip_codes)
+            else:
+                ip_code = rng.integers(n_ips)
+            bots.append((device_ids[start + i], pattern, ip_code))
+        start += count
+
+    device_activity = rng.lognormal(0, 1.0, n_devices)  # 디바이스별 활동량 (소수의 헤비 유저)
+    ads_idx = np.arange(1, n_ads + 1)
+    ads_list = pd.DataFrame({
+        'ads_idx': ads_idx,
+        'ads_type': rng.integers(1, 13, n_ads),
+        'ads_category': rng.integers(0, 14, n_ads),
+        'ads_name': [f'광고_{i}' for i in ads_idx],
+    })
+    if dup_ads_fraction > 0:
+        # 실제 광고 리스트처럼 같은 ads_idx가 여러 번 들어 있는 상황을 재현합니다.
+        duplicated = ads_list.sample(frac=dup_ads_fraction, random_state=int(rng.integers(1 << 31)))
+        ads_list = pd.concat([ads_list, duplicated.assign(ads_name=duplicated['ads_name'] + '_중복')], ignore_index=True)
+
+    return {
+        'n_devices': n_devices, 'n_ips': n_ips,
+        'device_ids': device_ids,
+        'device_p': device_activity / device_activity.sum(),
+        'device_ip': rng.choice(n_ips, size=n_devices, p=_zipf_weights(n_ips, 0.6, rng)),
+        'ip_weights': _zipf_weights(n_ips, 0.6, rng),
+        'ips': all_ips,
+        'media_weights': _zipf_weights(n_media, 1.1, rng),
+        'media_cvr': rng.uniform(0.1, 0.5, n_media),
+        'ads_weights': _zipf_weights(n_ads, 0.9, rng),
+        'ads_list': ads_list, 'ip_cache': ip_cache, 'bots': bots,
+    }
+
+def _diurnal_seconds(rng, n, start_sec, end_sec):
+    """[start_sec, end_sec) 구간에서 저녁에 많고 새벽에 적은 일중 패턴을 따르는 초 단위 시각 n개를 뽑습니다."""
+    minutes = np.arange(start_sec // 60, max(end_sec // 60, start_sec // 60 + 1))
+    hour = (minutes % (24 * 60)) / 60
+    weights = 1.0 + 0.8 * np.sin((hour - 9) / 24 * 2 * np.pi)
+    picked = rng.choice(minutes, size=n, p=weights / weights.sum())
+    return np.clip(picked * 60 + rng.integers(0, 60, n), start_sec, end_sec - 1)
+
+def _bot_events(rng, dvc, pattern, ip_code, start_sec, end_sec, n_media):
+    events = BOT_PATTERNS[pattern][0]
+    span = end_sec - start_sec
+    mda = np.full(events, rng.integers(n_media))
+    if pattern == 'burst':
+        t0 = start_sec + rng.integers(0, max(span - events * 8, 1))
+        seconds = t0 + np.cumsum(rng.integers(1, 8, events))
+        converted = rng.random(events) < 0.1
+        ctit = rng.lognormal(np.log(60), 1.0, events)
+    elif pattern == 'constant_ctit':
+        t0 = start_sec + rng.integers(0, max(span - 6 * 3600, 1))
+        seconds = np.sort(t0 + rng.integers(0, min(6 * 3600, span), events))
+        converted = np.ones(events, dtype=bool)
+        ctit = rng.uniform(20, 60) + rng.normal(0, 0.5, events)
+    elif pattern == 'ip_farm':
+        seconds = np.sort(_diurnal_seconds(rng, events, start_sec, end_sec))
+        converted = rng.random(events) < 0.5
+        ctit = rng.lognormal(np.log(120), 1.2, events)
+    else:  # aws_host
+        seconds = np.sort(_diurnal_seconds(rng, events, start_sec, end_sec))
+        mda = rng.integers(n_media, size=events)
+        converted = rng.random(events) < 0.6
+        ctit = rng.uniform(1, 4, events)
+    return dict(dvc=np.full(events, dvc), ip=np.full(events, ip_code), mda=mda, seconds=seconds, converted=converted, ctit=ctit)
+
+def _generate_slice(rng, population, n_normal, bots, start_sec, end_sec, base_time):
+    """[start_sec, end_sec) 구간의 일반 이벤트 n_normal개와 주어진 봇들의 이벤트를 click_date 순으로 만듭니다."""
+    n_media = len(population['media_weights'])
+    device = rng.choice(population['n_devices'], size=n_normal, p=population['device_p'])
+    ip = population['device_ip'][device]
+    roaming = rng.random(n_normal) < 0.1  # 10%는 다른 망(IP)에서 접속
+    ip[roaming] = rng.choice(population['n_ips'], size=roaming.sum(), p=population['ip_weights'])
+    mda = rng.choice(n_media, size=n_normal, p=population['media_weights'])
+    parts = [dict(
+        dvc=population['device_ids'][device], ip=ip, mda=mda,
+        seconds=_diurnal_seconds(rng, n_normal, start_sec, end_sec),
+        converted=rng.random(n_normal) < population['media_cvr'][mda],
+        ctit=np.maximum(rng.lognormal(np.log(120), 1.2, n_normal), 1.0),
+    )]
+    parts += [_bot_events(rng, dvc, pattern, ip_code, start_sec, end_sec, n_media) for dvc, pattern, ip_code in bots]
+    merged = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    n = len(merged['dvc'])
+    ip_codes = merged['ip'].astype(np.int64)
+    ip_codes[rng.random(n) < 0.01] = -1  # IP가 비어 있는 로그
+    click_date = base_time + pd.to_timedelta(merged['seconds'], unit='s')
+    ctit = np.where(merged['converted'], np.round(merged['ctit']), np.nan)
+    done_date = click_date + pd.to_timedelta(np.nan_to_num(ctit), unit='s')
+    ads_idx = rng.choice(len(population['ads_weights']), size=n, p=population['ads_weights']) + 1
+    df = pd.DataFrame({
+        'ads_idx': ads_idx.astype(np.int32),
+        'mda_idx': (merged['mda'] + 1).astype(np.int32),
+        'dvc_idx': merged['dvc'].astype(np.int32),
+        'user_ip': pd.Categorical.from_codes(ip_codes, categories=population['ips']),
+        'click_date': click_date,
+        'done_date': pd.Series(done_date).where(merged['converted']).to_numpy(),
+        'ctit': ctit,
+    })
+    return apply_event_schema(df.sort_values('click_date', kind='stable', ignore_index=True))
+
+def _truth(population):
+    return pd.DataFrame(population['bots'], columns=['dvc_idx', 'pattern', 'ip_code'])[['dvc_idx', 'pattern']]
+
+def _slices(rng, population, n_rows, n_slices):
+    bot_events = sum(BOT_PATTERNS[pattern][0] for _, pattern, _ in population['bots'])
+    n_normal = max(n_rows - bot_events, 0)
+    bot_slice = rng.integers(n_slices, size=len(population['bots']))
+    for i in range(n_slices):
+        rows = n_normal // n_slices + (n_normal % n_slices if i == n_slices - 1 else 0)
+        yield i, rows, [bot for bot, slice_id in zip(population['bots'], bot_slice) if slice_id == i]
+
+def generate_ad_logs(n_rows, seed=0, days=1, bot_fraction=0.01, dup_ads_fraction=0.0, start='2025-06-01'):
+    """
+    재현 가능한 합성 광고 로그를 메모리에 만듭니다.
+    반환값: (ads_rwd_info, ads_list, ip_cache, truth) — truth는 주입한 봇 디바이스와 패턴(dvc_idx, pattern)입니다.
+    """
+    rng = np.random.default_rng(seed)
+    population = _build_population(rng, n_rows, bot_fraction, dup_ads_fraction)
+    (_, rows, bots), = _slices(rng, population, n_rows, 1)
+    df = _generate_slice(rng, population, rows, bots, 0, days * SECONDS_PER_DAY, pd.Timestamp(start))
+    return df, population['ads_list'], population['ip_cache'], _truth(population)
+
+def write_synthetic_logs(path, n_rows, seed=0, days=1, bot_fraction=0.01, dup_ads_fraction=0.0, start='2025-06-01', chunk_rows=5_000_000):
+    """
+    메모리에 다 올리기 어려운 크기(~10^8행)의 합성 로그를 시간 구간별로 나눠 만들어 click_date 순서대로 Parquet에 씁니다.
+    스트리밍 모드(run_streaming_detection)의 입력으로 바로 쓸 수 있습니다.
+    반환값: (ads_list, ip_cache, truth)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pa_parquet
+
+    rng = np.random.default_rng(seed)
+    population = _build_population(rng, n_rows, bot_fraction, dup_ads_fraction)
+    n_slices = max(1, -(-n_rows // chunk_rows))
+    span = days * SECONDS_PER_DAY
+    writer = None
+    try:
+        for i, rows, bots in _slices(rng, population, n_rows, n_slices):
+            df = _generate_slice(rng, population, rows, bots, span * i // n_slices, span * (i + 1) // n_slices, pd.Timestamp(start))
+            # 청크마다 카테고리가 달라지지 않도록 IP는 문자열로 저장합니다.
+            table = pa.Table.from_pandas(df.assign(user_ip=df['user_ip'].astype(object)), preserve_index=False)
+            if writer is None:
+                writer = pa_parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            print(f"합성 로그 {i + 1}/{n_slices} 구간 기록 ({len(df):,}행)")
+    finally:
+        if writer is not None:
+            writer.close()
+    return population['ads_list'], population['ip_cache'], _truth(population)
+
+def evaluate_detection(block_list, truth):
+    """제재 리스트를 주입한 봇 정답과 비교해 정밀도/재현율과 패턴별 재현율을 계산합니다."""
+    blocked = set(block_list)
+    bot_devices = set(truth['dvc_idx'])
+    true_positives = len(blocked & bot_devices)
+    result = {
+        'blocked': len(blocked),
+        'bots': len(bot_devices),
+        'precision': true_positives / len(blocked) if blocked else 0.0,
+        'recall': true_positives / len(bot_devices) if bot_devices else 0.0,
+    }
+    for pattern, devices in truth.groupby('pattern')['dvc_idx']:
+        result[f'recall_{pattern}'] = devices.isin(blocked).mean()
+    return result